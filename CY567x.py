@@ -1,7 +1,12 @@
 """
 manages two cypress dongles: CY5677 and CY5670 (old)
 """
+import collections
+import functools
+import logging
+import os
 import queue
+import selectors
 import struct
 import threading
 
@@ -124,12 +129,40 @@ def desc_tp(tp):
     return 'TX POWER ? {} ?'.format(tp)
 
 
+# records inside the discovery responses
+_SERVIZIO = struct.Struct('<2HB')
+_CARATTERISTICA = struct.Struct('<HBH')
+_CARATTERISTICA_UUID = struct.Struct('<HBHB')
+_DESCRITTORE = struct.Struct('<HB')
+_UUID16 = struct.Struct('<H')
+
+
 class _COMMAND:
-    def __init__(self, cmd, prm=None):
+    __slots__ = ('_cod', '_prm', '_dati', 'to', '_fatto', '_res', '_depot',
+                 'confermato', 'fine', 'msg', 'annullato')
+
+    def __init__(self, cmd, prm=None, dati=None, to=5):
         self._cod = cmd
+        # values for cycost.CMD_LAYOUT
         self._prm = prm
-        self._res_q = queue.Queue()
+        # what follows them
+        self._dati = dati
+        # how long the caller will wait
+        self.to = to
+        # released once, by set_result
+        self._fatto = threading.Lock()
+        self._fatto.acquire()
+        self._res = None
+        # pieces of the response
         self._depot = None
+        # EVT_COMMAND_STATUS received
+        self.confermato = False
+        # if not None, it receives the result instead of get_result
+        self.fine = None
+        # the frame, composed by submit
+        self.msg = None
+        # aborted while in flight: its answers are discarded
+        self.annullato = False
 
     def are_you(self, cmd):
         """
@@ -144,7 +177,7 @@ class _COMMAND:
         retrieves the command's parameters
         :return:
         """
-        return {'cod': self._cod, 'prm': self._prm}
+        return {'cod': self._cod, 'prm': self._prm, 'dati': self._dati}
 
     def get_result(self, to=5):
         """
@@ -152,32 +185,70 @@ class _COMMAND:
         :param to: timeout in seconds
         :return: the result or None if to expires
         """
-        try:
-            return self._res_q.get(True, to)
-        except queue.Empty:
-            return None
+        if self._fatto.acquire(True, to):
+            return self._res
+        return None
 
     def set_result(self, res):
         """
-        put the result in the queue
+        deliver the result (only the first one counts)
         :param res: the command's result
         :return: n.a.
         """
-        if self._depot is None:
-            self._res_q.put_nowait(res)
-        else:
-            self._res_q.put_nowait(self._depot)
+        if self._depot is not None:
+            if len(self._depot) == 1:
+                res = bytearray(self._depot[0])
+            else:
+                res = bytearray().join(self._depot)
+            self._depot = None
+
+        if self.fine is not None:
+            fine = self.fine
+            self.fine = None
+            fine(res)
+        elif self._fatto.locked():
+            self._res = res
+            self._fatto.release()
 
     def save(self, data):
         """
-        save a result
-        :param data: bytearray
+        save a piece of the result
+        :param data: bytes-like (it must not change until set_result)
         :return:
         """
         if self._depot is None:
-            self._depot = bytearray(data)
+            self._depot = [data]
         else:
-            self._depot += bytearray(data)
+            self._depot.append(data)
+
+
+class _SEGNALE:
+    """
+    an operation waits for one of the events in CY567x.sincro
+    """
+
+    def __init__(self, nome, to):
+        self.nome = nome
+        self.to = to
+
+
+def _operazione(gen):
+    """
+    The API methods are generators: they yield a _COMMAND (or a _SEGNALE)
+    and receive its result, so the same code can be driven by a thread
+    (CY567x) or by an event loop (AsyncCY567x)
+    This decorator gives back the blocking method; the generator is
+    available as operazione
+    :param gen: generator function
+    :return: method
+    """
+
+    @functools.wraps(gen)
+    def bloccante(self, *args, **kwargs):
+        return self._esegui(gen(self, *args, **kwargs))
+
+    bloccante.operazione = gen
+    return bloccante
 
 
 class CY567x(threading.Thread):
@@ -212,6 +283,7 @@ class CY567x(threading.Thread):
     Cmd_Initiate_Pairing_Request_Api = 0xFE99
     Cmd_Pairing_PassKey_Api = 0xFE9B
     Cmd_Terminate_Connection_Api = 0xFE98
+    Cmd_Cancle_Connection_Api = 0xFE9D
     Cmd_Characteristic_Value_Write_Without_Response_Api = GATT_GROUP + 10
     Cmd_Write_Characteristic_Value_Api = GATT_GROUP + 11
     Cmd_Write_Long_Characteristic_Value_Api = GATT_GROUP + 12
@@ -226,7 +298,8 @@ class CY567x(threading.Thread):
     Cmd_Discover_All_Characteristics_Api = 0xFE03
     Cmd_Discover_All_Characteristic_Descriptors_Api = 0xFE05
 
-    def __init__(self, BAUD=BAUD_CY5677, poll=0.1, porta=None, logga=False):
+    def __init__(self, BAUD=BAUD_CY5677, poll=0.1, porta=None, logga=False, finestra=1,
+                 gestore=None, cattura=None, esecutore=None):
         if logga:
             self.diario = utili.LOGGA('CY567x')
         else:
@@ -288,31 +361,70 @@ class CY567x(threading.Thread):
             cc.EVT_READ_CHARACTERISTIC_DESCRIPTOR_RESPONSE:
                 self._evt_gattc_read_rsp,
             cc.EVT_GET_SCAN_PARAMETERS_RESPONSE:
-                self._evt_get_scan_parameters_response,
-            cc.EVT_GET_CONNECTION_PARAMETERS_RESPONSE: self._evt_get_connection_parameters_response,
+                self._evt_save_response,
+            cc.EVT_GET_CONNECTION_PARAMETERS_RESPONSE:
+                self._evt_save_response,
             cc.EVT_GET_TX_POWER_RESPONSE:
-                self._evt_get_tx_power_response,
+                self._evt_save_response,
             cc.EVT_GET_RSSI_RESPONSE:
-                self._evt_get_rssi_response
+                self._evt_save_response
         }
 
         self.connection = {'mtu': 23, 'cyBle_connHandle': None}
 
         self.command = {
-            'curr': None,
             'todo': queue.Queue(),
-            'wait': {},
+            # taken from todo, waiting for room in the window
+            'attesa': collections.deque(),
+            # sent: opcode -> commands in the order they were sent
+            'volo': {},
+            # sent but not yet acknowledged by EVT_COMMAND_STATUS
+            'senza_stato': 0,
+            # max number of commands in senza_stato
+            'finestra': finestra,
             'poll': poll,
+            # pipe rung when something is put in todo
+            'campanello': None,
         }
 
+        # scan_util.FILTRO of the advertisements (None: all)
+        self.scan_filter = None
+
+        # cyregistro.REGISTRO of every advertisement (None: none)
+        self.scan_recorder = None
+
+        # called with the name of the events of sincro without a callback
+        # (replaced, never modified: the thread of the dongle walks it)
+        self.signal_listeners = []
+
+        # cycattura.CATTURA of the traffic (closed by its owner)
+        self.cattura = cattura
+
+        # cyesecutore.ESECUTORE of the callbacks (None: this thread runs them,
+        # else it is closed by its owner)
+        self.esecutore = esecutore
+
+        # who serves the port: the thread of the object or a DongleManager
+        self.gestore = None
+        # set when nobody serves the port anymore
+        self.fermo = threading.Event()
+
         self.services = {'primary': [], 'current': [], 'char': []}
 
-        self.sincro = {
+        # a subclass can fill it before calling this __init__: its keys stay
+        self.sincro = getattr(self, 'sincro', {})
+        for chiave, evento in {
             # signaled by gap_auth_req_cb
             'authReq': threading.Event(),
             # signaled by gap_passkey_entry_request_cb
             'passkeyReq': threading.Event(),
-        }
+            # CYBLE_EVT_GAP_ENCRYPT_CHANGE: encryption on
+            'encrypt': threading.Event(),
+            # CYBLE_EVT_GAP_KEYINFO_EXCHNGE_CMPLT or CYBLE_EVT_GAP_AUTH_COMPLETE
+            # (that follows the key exchange, if any)
+            'keyinfo': threading.Event(),
+        }.items():
+            self.sincro.setdefault(chiave, evento)
 
         try:
             serial_open = serial.Serial
@@ -328,9 +440,15 @@ class CY567x(threading.Thread):
                                     timeout=1,
                                     rtscts=True)
 
-            # posso girare
+            self._prepara_campanello()
+
             threading.Thread.__init__(self, daemon=True)
-            self.start()
+            if gestore is not None and self.command['campanello'] is not None:
+                self.gestore = gestore
+                gestore.add(self)
+            else:
+                # posso girare
+                self.start()
 
         except serial.SerialException as err:
             self.diario.debug(str(err))
@@ -340,105 +458,116 @@ class CY567x(threading.Thread):
         self.diario.debug('del')
         self.close()
 
+    def _in_volo(self, cod):
+        """
+        the oldest command sent with that opcode
+        :param cod: opcode
+        :return: _COMMAND or None
+        """
+        try:
+            return self.command['volo'][cod][0]
+        except (KeyError, IndexError):
+            return None
+
+    def _togli(self, cod, cmd):
+        volo = self.command['volo'][cod]
+        volo.remove(cmd)
+        if not volo:
+            del self.command['volo'][cod]
+        if not cmd.confermato:
+            self.command['senza_stato'] -= 1
+
     def _close_command(self, cod, resul):
-        trovato = False
-        if self.command['curr'] is None:
-            pass
-        elif self.command['curr'].are_you(cod):
-            trovato = True
-            self.diario.info('curr _close_command({:04X},{})'.format(cod, resul))
-            self.command['curr'].set_result(resul == 0)
-            self.command['curr'] = None
+        cmd = self._in_volo(cod)
+        if cmd is None:
+            self.diario.error('wrong cmd ({:04X})'.format(cod))
         else:
-            pass
-
-        if not trovato:
-            if cod in self.command['wait']:
-                cmd = self.command['wait'][cod]
-                del self.command['wait'][cod]
-                self.diario.info('wait _close_command({:04X},{})'.format(cod, resul))
-                cmd.set_result(resul == 0)
+            self._togli(cod, cmd)
+            if cmd.annullato:
+                self.diario.info('_close_command(%04X,%s) discarded', cod, resul)
             else:
-                self.diario.error('wrong cmd ({:04X})'.format(cod))
+                self.diario.info('_close_command(%04X,%s)', cod, resul)
+                cmd.set_result(resul == 0)
 
     def _wait_command(self, cod, resul):
-        if self.command['curr'] is None:
-            self.diario.error('no cmd waiting')
-        elif self.command['curr'].are_you(cod):
-            self.diario.info('_wait_command {:04X}'.format(cod))
-            self.command['wait'][cod] = self.command['curr']
-            self.command['curr'] = None
+        for cmd in self.command['volo'].get(cod, ()):
+            if not cmd.confermato:
+                self.diario.info('_wait_command %04X', cod)
+                cmd.confermato = True
+                self.command['senza_stato'] -= 1
+                return
+
+        self.diario.error('wrong cmd ({:04X})'.format(cod))
+
+    def _abort_command(self, cmd):
+        cod = cmd.get()['cod']
+        if cmd in self.command['attesa']:
+            self.diario.info('attesa _abort_command(%04X)', cod)
+            self.command['attesa'].remove(cmd)
+        elif cmd in self.command['volo'].get(cod, ()):
+            # the dongle will answer anyway: the answers must not go
+            # to the next command with that opcode, nor the window be
+            # free before them
+            self.diario.info('volo _abort_command(%04X)', cod)
+            cmd.annullato = True
         else:
             self.diario.error('wrong cmd ({:04X})'.format(cod))
 
-    def _abort_command(self, cod):
-        trovato = False
-        if self.command['curr'] is None:
-            pass
-        elif self.command['curr'].are_you(cod):
-            trovato = True
-            self.diario.info('curr _abort_command({:04X})'.format(cod))
-            self.command['curr'] = None
-        else:
-            pass
-
-        if not trovato:
-            if cod in self.command['wait']:
-                self.diario.info('wait _abort_command({:04X})'.format(cod))
-                del self.command['wait'][cod]
-            else:
-                self.diario.error('wrong cmd ({:04X})'.format(cod))
-
     def _save_data(self, cod, data):
-        trovato = False
-        if self.command['curr'] is None:
-            pass
-        elif self.command['curr'].are_you(cod):
-            trovato = True
-            self.command['curr'].save(data)
+        cmd = self._in_volo(cod)
+        if cmd is None:
+            self.diario.error('wrong cmd ({:04X})'.format(cod))
         else:
-            pass
+            cmd.save(data)
 
-        if not trovato:
-            if cod in self.command['wait']:
-                self.command['wait'][cod].save(data)
-            else:
-                self.diario.error('wrong cmd ({:04X})'.format(cod))
-
-    def _evt_command_status(self, prm):
-        cod, status = struct.unpack('<2H', prm)
-        self.diario.debug('EVT_COMMAND_STATUS: cmd={:04X} stt={}'.format(
-            cod, status))
-        if cod == self.Cmd_Start_Scan_Api:
-            self._close_command(cod, status)
+    def _richiama(self, classe, funz, *args):
+        """
+        invoke a callback, here or in the esecutore
+        :param classe: cfr cyesecutore.CLASSI
+        :param funz: the callback
+        :param args: its arguments
+        :return: n.a.
+        """
+        if self.esecutore is None:
+            funz(*args)
         else:
-            self._wait_command(cod, status)
-
-    def _evt_command_complete(self, prm):
-        cmd, status = struct.unpack('<2H', prm)
-        self.diario.debug('EVT_COMMAND_COMPLETE: cmd={:04X} stt={}'.format(
-            cmd, status))
-        self._close_command(cmd, status)
+            self.esecutore.esegui(classe, funz, *args)
 
-    def _evt_scan_progress_result(self, prm):
-        _ = struct.unpack('<H', prm[:2])
-        self.scan_progress_cb(prm[2:])
-
-    def _evt_gatt_connect_ind(self, prm):
-        cmd, conh = struct.unpack('<2H', prm)
+    def _evt_command_status(self, evt):
+        self.diario.debug('EVT_COMMAND_STATUS: cmd=%04X stt=%s', evt.cmd, evt.status)
+        if evt.cmd == self.Cmd_Start_Scan_Api:
+            self._close_command(evt.cmd, evt.status)
+        else:
+            self._wait_command(evt.cmd, evt.status)
+
+    def _evt_command_complete(self, evt):
+        self.diario.debug('EVT_COMMAND_COMPLETE: cmd=%04X stt=%s', evt.cmd, evt.status)
+        self._close_command(evt.cmd, evt.status)
+
+    def _evt_scan_progress_result(self, evt):
+        registro = self.scan_recorder
+        if registro is not None:
+            registro(evt.tail)
+        # the uninteresting ones are not even copied
+        filtro = self.scan_filter
+        if filtro is not None and not filtro(evt.tail):
+            return
+        # the callback owns its copy
+        self._richiama('scan', self.scan_progress_cb, bytearray(evt.tail))
+
+    def _evt_gatt_connect_ind(self, evt):
         self.diario.debug(
             'EVT_ESTABLISH_CONNECTION_RESPONSE: cmd={:04X} handle={:04X}'.
-                format(cmd, conh))
-        self.connection['cyBle_connHandle'] = conh
+                format(evt.cmd, evt.conn))
+        self.connection['cyBle_connHandle'] = evt.conn
         self.connection['mtu'] = 23
 
-    def _evt_gap_enhance_conn_complete(self, prm):
-        cmd, status, conh, role = struct.unpack('<HBHB', prm[:6])
+    def _evt_gap_enhance_conn_complete(self, evt):
         self.diario.debug(
             'EVT_ENHANCED_CONNECTION_COMPLETE: cmd={:04X} status={} handle={:04X} role='
-                .format(cmd, status, conh) + 'master' if role == 0 else 'slave')
+                .format(evt.cmd, evt.status, evt.conn) + 'master' if evt.role == 0 else 'slave')
 
-    def _evt_gap_auth_req(self, prm):
+    def _evt_gap_auth_req(self, evt):
         """
         EVT_PAIRING_REQUEST_RECEIVED_NOTIFICATION [7]:
         04 00 	cyBle_connHandle
@@ -449,17 +578,15 @@ class CY567x(threading.Thread):
         00 		authErr
         00		pairingProperties
         """
-        _, security, bonding, ekeySize, _, pairingProperties = struct.unpack(
-            '<H5B', prm)
         ai = {
-            'security': security,
-            'bonding': bonding,
-            'ekeySize': ekeySize,
-            'pairingProperties': pairingProperties
+            'security': evt.security,
+            'bonding': evt.bonding,
+            'ekeySize': evt.ekeySize,
+            'pairingProperties': evt.pairingProperties
         }
-        self.gap_auth_req_cb(ai)
+        self._richiama('gap', self.gap_auth_req_cb, ai)
 
-    def _evt_gap_data_length_change(self, prm):
+    def _evt_gap_data_length_change(self, evt):
         """
         EVT_DATA_LENGTH_CHANGED_NOTIFICATION [10]:
         04 00   cyBle_connHandle
@@ -469,14 +596,13 @@ class CY567x(threading.Thread):
         1B 00   connMaxRxOctets
         48 01   connMaxRxTime
         """
-        _, txo, txt, rxo, rxt = struct.unpack('<5H', prm)
         self.diario.debug('EVT_DATA_LENGTH_CHANGED_NOTIFICATION: ' +
-                          'connMaxTxOctets={} '.format(txo) +
-                          'connMaxTxTime={} '.format(txt) +
-                          'connMaxRxOctets={} '.format(rxo) +
-                          'connMaxRxTime={}'.format(rxt))
+                          'connMaxTxOctets={} '.format(evt.connMaxTxOctets) +
+                          'connMaxTxTime={} '.format(evt.connMaxTxTime) +
+                          'connMaxRxOctets={} '.format(evt.connMaxRxOctets) +
+                          'connMaxRxTime={}'.format(evt.connMaxRxTime))
 
-    def _evt_negotiated_pairing_parameters(self, prm):
+    def _evt_negotiated_pairing_parameters(self, evt):
         """
         EVT_NEGOTIATED_PAIRING_PARAMETERS [8]:
         04 00 cyBle_connHandle
@@ -489,10 +615,11 @@ class CY567x(threading.Thread):
         00 	  authErr
         00	  pairingProperties
         """
-        _, reason, security, bonding, ekeySize, authErr, pairingProperties = struct.unpack('<H6B', prm)
         self.diario.debug(
             'EVT_NEGOTIATED_PAIRING_PARAMETERS: reason={} security={} bonding={} ekeySize={} authErr={} pairingProperties={}'.format(
-                reason, security, bonding, ekeySize, authErr, pairingProperties))
+                evt.reason, evt.security, evt.bonding, evt.ekeySize, evt.authErr, evt.pairingProperties))
+        if evt.reason == 1:
+            self._segnala('keyinfo')
 
     def _evt_gap_passkey_entry_request(self, _):
         """
@@ -500,107 +627,95 @@ class CY567x(threading.Thread):
             99 FE command
             04 00 cyBle_connHandle
         """
-        # if self.command['curr'] is None:
-        #     pass
-        # elif self.command['curr'].are_you(self.Cmd_Initiate_Pairing_Request_Api):
-        #     self._close_command(self.Cmd_Initiate_Pairing_Request_Api, 0)
         self._close_command(self.Cmd_Initiate_Pairing_Request_Api, 0)
-        self.gap_passkey_entry_request_cb()
+        self._richiama('gap', self.gap_passkey_entry_request_cb)
 
-    def _evt_gattc_xchng_mtu_rsp(self, prm):
+    def _evt_gattc_xchng_mtu_rsp(self, evt):
         """
         EVT_EXCHANGE_GATT_MTU_SIZE_RESPONSE [6]:
             12 FE command
             04 00 cyBle_connHandle
             17 00 mtu
         """
-        _, _, mtu = struct.unpack('<3H', prm)
-        self.connection['mtu'] = mtu
+        self.connection['mtu'] = evt.mtu
         self.diario.debug(
-            'EVT_EXCHANGE_GATT_MTU_SIZE_RESPONSE: mtu={}'.format(mtu))
+            'EVT_EXCHANGE_GATT_MTU_SIZE_RESPONSE: mtu={}'.format(evt.mtu))
 
-    def _evt_gap_auth_failed(self, prm):
+    def _evt_gap_auth_failed(self, evt):
         """
         EVT_AUTHENTICATION_ERROR_NOTIFICATION [5]:
             99 FE command
             04 00 cyBle_connHandle
             03    reason
         """
-        _, _, reason = struct.unpack('<2HB', prm)
-        self.gap_auth_resul_cb(reason)
+        self._richiama('gap', self.gap_auth_resul_cb, evt.reason)
 
-    def _evt_gap_device_disconnected(self, prm):
+    def _evt_gap_device_disconnected(self, evt):
         """
         EVT_CONNECTION_TERMINATED_NOTIFICATION [3]:
             04 00 cyBle_connHandle
             13    CYBLE_HCI_ERROR_T
         """
-        _, reason = struct.unpack('<HB', prm)
         self.connection['cyBle_connHandle'] = None
-        self.gap_device_disconnected_cb(reason)
+        self.sincro['encrypt'].clear()
+        self.sincro['keyinfo'].clear()
+        self._richiama('gap', self.gap_device_disconnected_cb, evt.reason)
 
-    def _evt_report_stack_misc_status(self, prm):
+    def _evt_report_stack_misc_status(self, evt):
         """
         EVT_REPORT_STACK_MISC_STATUS [5]:
             29 00 event
             01 00 prm size
             01    prm
         """
-        event, dim = struct.unpack('<2H', prm[:4])
-        prm = prm[4:]
-        if event == 0x0029 and len(prm) == 1:
+        prm = evt.tail
+        if evt.event == 0x0029 and len(prm) == 1:
             x = '?'
             if prm[0] == 0:
                 x = 'Encryption OFF'
+                self.sincro['encrypt'].clear()
             elif prm[0] == 1:
                 x = 'Encryption ON'
+                self._segnala('encrypt')
             self.diario.debug(
                 'EVT_REPORT_STACK_MISC_STATUS: CYBLE_EVT_GAP_ENCRYPT_CHANGE ' + x)
-        elif event == 0x002C:
+        elif evt.event == 0x002C:
+            self._segnala('keyinfo')
             self.diario.debug(
                 'EVT_REPORT_STACK_MISC_STATUS: CYBLE_EVT_GAP_KEYINFO_EXCHNGE_CMPLT ' +
                 utili.stringa_da_ba(prm, ' '))
         else:
             self.diario.debug(
-                'EVT_REPORT_STACK_MISC_STATUS: CYBLE_EVT_={:04X}[{}] '.format(event, dim) +
+                'EVT_REPORT_STACK_MISC_STATUS: CYBLE_EVT_={:04X}[{}] '.format(evt.event, evt.dim) +
                 utili.stringa_da_ba(prm, ' '))
 
-    def _evt_gattc_handle_value_ntf(self, prm):
-        # connHandle, attrHandle, len
-        _, crt, _ = struct.unpack('<3H', prm[:6])
-        ntf = prm[6:]
-        self.gattc_handle_value_ntf_cb(crt, ntf)
+    def _segnala(self, nome):
+        # the events of sincro without a callback
+        self.sincro[nome].set()
+        for ascoltatore in self.signal_listeners:
+            ascoltatore(nome)
+
+    def _evt_gattc_handle_value_ntf(self, evt):
+        # the only copy between the uart and the callback
+        self._richiama('ntf', self.gattc_handle_value_ntf_cb, evt.attr, bytearray(evt.tail))
 
-    def _evt_gattc_handle_value_ind(self, prm):
-        # connHandle, attrHandle, result of CyBle_GattcConfirmation, len
-        _, crt, result, _ = struct.unpack('<4H', prm[:8])
-        self.gattc_handle_value_ind_cb(crt, result, prm[8:])
+    def _evt_gattc_handle_value_ind(self, evt):
+        # result of CyBle_GattcConfirmation
+        self._richiama('ntf', self.gattc_handle_value_ind_cb,
+                       evt.attr, evt.result, bytearray(evt.tail))
 
-    def _evt_get_bluetooth_device_address_response(self, prm):
-        # command, bda, type
-        cmd = struct.unpack('<H', prm[:2])
-        self._save_data(cmd[0], prm[2:8])
+    def _evt_get_bluetooth_device_address_response(self, evt):
+        # bda, type
+        self._save_data(evt.cmd, evt.tail[:6])
 
     def _evt_scan_stopped_notification(self, _):
         self.diario.debug('EVT_SCAN_STOPPED_NOTIFICATION')
 
-    def _evt_get_scan_parameters_response(self, prm):
-        cmd = struct.unpack('<H', prm[:2])
-        self._save_data(cmd[0], prm[2:])
-
-    def _evt_get_connection_parameters_response(self, prm):
-        cmd = struct.unpack('<H', prm[:2])
-        self._save_data(cmd[0], prm[2:])
-
-    def _evt_get_tx_power_response(self, prm):
-        cmd = struct.unpack('<H', prm[:2])
-        self._save_data(cmd[0], prm[2:])
+    def _evt_save_response(self, evt):
+        # EVT_GET_*_RESPONSE: cmd + data
+        self._save_data(evt.cmd, evt.tail)
 
-    def _evt_get_rssi_response(self, prm):
-        cmd = struct.unpack('<H', prm[:2])
-        self._save_data(cmd[0], prm[2:])
-
-    def _evt_gatt_error_notification(self, prm):
+    def _evt_gatt_error_notification(self, evt):
         """
         EVT_GATT_ERROR_NOTIFICATION [8]:
         0B FE cmd
@@ -609,56 +724,52 @@ class CY567x(threading.Thread):
         15 00 GattErrResp->attrHandle
         0E    GattErrResp->errorCode
         """
-        cmd, _, pdu, _, error = struct.unpack('<2HBHB', prm)
         self.diario.debug(
             'EVT_GATT_ERROR_NOTIFICATION ' +
-            cc.quale_pdu(pdu) +
+            cc.quale_pdu(evt.pdu) +
             ' ' +
-            cc.quale_errore(error))
-        if cmd in (self.Cmd_Discover_All_Primary_Services_Api,
-                   self.Cmd_Discover_Primary_Services_By_Uuid_Api,
-                   self.Cmd_Discover_All_Characteristics_Api):
+            cc.quale_errore(evt.error))
+        if evt.cmd in (self.Cmd_Discover_All_Primary_Services_Api,
+                       self.Cmd_Discover_Primary_Services_By_Uuid_Api,
+                       self.Cmd_Discover_All_Characteristics_Api):
             # always return CYBLE_GATT_ERR_ATTRIBUTE_NOT_FOUND
-            self._close_command(cmd, 0)
+            self._close_command(evt.cmd, 0)
         else:
-            self._close_command(cmd, error)
+            self._close_command(evt.cmd, evt.error)
 
-    def _evt_gattc_read_rsp(self, prm):
+    def _evt_gattc_read_rsp(self, evt):
         """
         EVT_READ_CHARACTERISTIC_VALUE_RESPONSE
         cmd, connHandle, len, dati
         """
-        cmd, _, _ = struct.unpack('<3H', prm[:6])
-        self._save_data(cmd, prm[6:])
+        self._save_data(evt.cmd, evt.tail)
 
-    def _evt_gattc_find_by_type_value_rsp(self, prm):
+    def _evt_gattc_find_by_type_value_rsp(self, evt):
         """
         CYBLE_EVT_GATTC_FIND_BY_TYPE_VALUE_RSP
         cmd, connHandle, startHandle, endHandle
         """
-        cmd, _, sh, endh = struct.unpack('<4H', prm)
         # The sequence of operations is complete when ...
         # or when the End Group Handle in the Find By Type Value Response is
         # 0xFFFF
-        if endh == 0xFFFF:
-            self._close_command(cmd, 0)
-        elif cmd == self.Cmd_Discover_Primary_Services_By_Uuid_Api:
-            srv = {'starth': sh, 'endh': endh}
+        if evt.endh == 0xFFFF:
+            self._close_command(evt.cmd, 0)
+        elif evt.cmd == self.Cmd_Discover_Primary_Services_By_Uuid_Api:
+            srv = {'starth': evt.starth, 'endh': evt.endh}
             self.services['current'].append(srv)
 
-    def _evt_gattc_read_by_group_type_rsp(self, prm):
+    def _evt_gattc_read_by_group_type_rsp(self, evt):
         """
         CYBLE_EVT_GATTC_READ_BY_GROUP_TYPE_RSP
         cmd connHandle [sh eh type uuid], ...
         """
-        _, _ = struct.unpack('<2H', prm[:4])
-        prm = prm[4:]
+        prm = evt.tail
         while len(prm):
-            sh, eh, stype = struct.unpack('<2HB', prm[:5])
+            sh, eh, stype = _SERVIZIO.unpack_from(prm)
             srv = {'starth': sh, 'endh': eh}
-            prm = prm[5:]
+            prm = prm[_SERVIZIO.size:]
             if stype == 1:
-                uid16 = struct.unpack('<H', prm[:2])[0]
+                uid16 = _UUID16.unpack_from(prm)[0]
                 srv['uuid16'] = uid16
                 prm = prm[2:]
                 # self.diario.debug('start={:04X} end={:04X} uuid={:04X}'.format(sh, eh, uid16))
@@ -669,159 +780,302 @@ class CY567x(threading.Thread):
                 # self.diario.debug('start={:04X} end={:04X} uuid='.format(sh, eh) + srv['uuid128'])
             self.services['primary'].append(srv)
 
-    def _evt_gattc_read_by_type_rsp_chr_uid(self, prm):
+    def _evt_gattc_read_by_type_rsp_chr_uid(self, evt):
         """
         CYBLE_EVT_GATTC_READ_BY_TYPE_RSP + CMD_DISCOVER_CHARACTERISTICS_BY_UUID
         cmd connHandle [attrh prop valh], ...
         """
-        _, _ = struct.unpack('<2H', prm[:4])
-        prm = prm[4:]
-        while len(prm) >= 5:
-            attr, prop, value = struct.unpack('<HBH', prm[:5])
+        prm = evt.tail
+        while len(prm) >= _CARATTERISTICA.size:
+            attr, prop, value = _CARATTERISTICA.unpack_from(prm)
             chrt = {
                 'attr': attr,
                 'prop': cc.char_properties(prop),
                 'value': value
             }
             self.services['char'].append(chrt)
-            prm = prm[5:]
+            prm = prm[_CARATTERISTICA.size:]
 
-    def _evt_gattc_read_by_type_rsp_all_char(self, prm):
+    def _evt_gattc_read_by_type_rsp_all_char(self, evt):
         """
         CYBLE_EVT_GATTC_READ_BY_TYPE_RSP + CMD_DISCOVER_ALL_CHARACTERISTICS
         cmd connHandle [attrh prop valh uidtype uid], ...
         """
-        _, _ = struct.unpack('<2H', prm[:4])
-        prm = prm[4:]
+        prm = evt.tail
         while len(prm) >= 2 + 1 + 2 + 1 + 2:
-            attr, prop, value, uidtype = struct.unpack('<HBHB', prm[:6])
-            prm = prm[6:]
+            attr, prop, value, uidtype = _CARATTERISTICA_UUID.unpack_from(prm)
+            prm = prm[_CARATTERISTICA_UUID.size:]
             chrt = {
                 'attr': attr,
                 'prop': cc.char_properties(prop),
                 'value': value
             }
             if uidtype == 1:
-                chrt['uuid16'] = struct.unpack('<H', prm[:2])[0]
+                chrt['uuid16'] = _UUID16.unpack_from(prm)[0]
                 prm = prm[2:]
             else:
                 chrt['uuid128'] = stringuuid_from_ba(prm[:16])
                 prm = prm[16:]
             self.services['char'].append(chrt)
 
-    def _evt_gattc_find_info_rsp(self, prm):
+    def _evt_gattc_find_info_rsp(self, evt):
         """
         CYBLE_EVT_GATTC_FIND_INFO_RSP
         cmd connHandle [attrh uidtype uid], ...
         """
-        _, _ = struct.unpack('<2H', prm[:4])
-        prm = prm[4:]
+        prm = evt.tail
         while len(prm) >= 2 + 1 + 2:
-            attr, uidtype = struct.unpack('<HB', prm[:3])
-            prm = prm[3:]
+            attr, uidtype = _DESCRITTORE.unpack_from(prm)
+            prm = prm[_DESCRITTORE.size:]
             chrt = {
                 'attr': attr,
             }
             if uidtype == 1:
-                chrt['uuid16'] = struct.unpack('<H', prm[:2])[0]
+                chrt['uuid16'] = _UUID16.unpack_from(prm)[0]
                 prm = prm[2:]
             else:
                 chrt['uuid128'] = stringuuid_from_ba(prm[:16])
                 prm = prm[16:]
             self.services['char'].append(chrt)
 
-    def _send_command_and_wait(self, cod, prm=None, to=5):
-        # send
-        cmd = _COMMAND(cod, prm)
+    def _prepara_campanello(self):
+        """
+        the thread will wake up as soon as the dongle sends something
+        or a command is queued
+        where the serial port has no file descriptor the thread polls
+        """
+        try:
+            self.uart.fileno()
+        except (AttributeError, serial.SerialException) as err:
+            self.diario.debug('polling: ' + str(err))
+            return
+
+        lettura, scrittura = os.pipe()
+        os.set_blocking(lettura, False)
+        os.set_blocking(scrittura, False)
+        self.command['campanello'] = (lettura, scrittura)
+
+    def submit(self, cmd):
+        """
+        queue a command and wake up the thread without waiting
+        for the result (cfr _COMMAND.fine)
+        :param cmd: _COMMAND
+        :return: n.a.
+        """
+        if not (cmd.are_you(self.QUIT) or cmd.are_you(self.ABORT_COMMAND)):
+            # wrong parameters are the caller's problem, not the thread's
+            cmd.msg = self.proto['tx'].compose(cmd.get())
         self.command['todo'].put_nowait(cmd)
+        if self.command['campanello'] is not None:
+            try:
+                os.write(self.command['campanello'][1], b'\x00')
+            except BlockingIOError:
+                # the pipe is full: the thread will wake up anyway
+                pass
+
+    def _send_command_and_wait(self, cmd):
+        # send
+        self.submit(cmd)
 
         # wait
-        res = cmd.get_result(to)
+        res = cmd.get_result(cmd.to)
         if res is None:
-            # abort
-            self.command['todo'].put_nowait(
-                _COMMAND(self.ABORT_COMMAND, cod))
+            self.abort(cmd)
             return False
 
         return res
 
-    def _exec_command(self):
+    def abort(self, cmd):
+        """
+        forget a command that did not answer in time
+        :param cmd: _COMMAND
+        :return: n.a.
+        """
+        self.submit(_COMMAND(self.ABORT_COMMAND, cmd))
+
+    def _esegui(self, oper):
+        """
+        drive an operation blocking the caller
+        :param oper: generator (cfr _operazione)
+        :return: what the operation returns
+        """
         try:
-            cmd = self.command['todo'].get(True, self.command['poll'])
+            cosa = next(oper)
+            while True:
+                if isinstance(cosa, _SEGNALE):
+                    res = self.sincro[cosa.nome].wait(cosa.to)
+                else:
+                    res = self._send_command_and_wait(cosa)
+                cosa = oper.send(res)
+        except StopIteration as fine:
+            return fine.value
 
-            if cmd.are_you(self.QUIT):
-                return False
+    def _exec_command(self, cmd):
+        """
+        manage a command taken from todo
+        :param cmd: _COMMAND
+        :return: False if the thread must quit
+        """
+        if cmd.are_you(self.QUIT):
+            return False
 
-            if cmd.are_you(self.ABORT_COMMAND):
-                prm = cmd.get()
-                self._abort_command(prm['prm'])
-                return True
+        if cmd.are_you(self.ABORT_COMMAND):
+            prm = cmd.get()
+            self._abort_command(prm['prm'])
+        else:
+            self.command['attesa'].append(cmd)
+
+        return True
 
-            if self.command['curr'] is None:
-                self.diario.info('tx {:04X}'.format(cmd.get()['cod']))
-                self.command['curr'] = cmd
+    def _send_commands(self):
+        """
+        send the waiting commands while there is room in the window
+        :return: n.a.
+        """
+        attesa = self.command['attesa']
+        while attesa and self.command['senza_stato'] < self.command['finestra']:
+            cmd = attesa.popleft()
+            cod = cmd.get()['cod']
+            self.diario.info('tx %04X', cod)
+            self.command['volo'].setdefault(cod, collections.deque()).append(cmd)
+            self.command['senza_stato'] += 1
 
-                msg = self.proto['tx'].compose(cmd.get())
+            try:
+                msg = cmd.msg
 
-                self.diario.debug(
-                    'IRP_MJ_WRITE Data: ' +
-                    utili.stringa_da_ba(
-                        msg,
-                        ' '))
+                self.diario.debug('IRP_MJ_WRITE Data: %s', utili.Esa(msg))
+                if self.cattura is not None:
+                    self.cattura.tx(msg)
                 self.uart.write(msg)
-            else:
-                self.diario.info('busy')
-                self.command['todo'].put_nowait(cmd)
-        except (utili.Problema, queue.Empty) as err:
-            if isinstance(err, utili.Problema):
+            except utili.Problema as err:
                 self.diario.debug(str(err))
 
-        return True
+    def _read_uart(self, almeno=0):
+        dim = max(almeno, self.uart.in_waiting)
+        while dim:
+            tmp = self.uart.read(dim)
+            if len(tmp) == 0:
+                break
 
-    def run(self):
+            self.diario.debug('IRP_MJ_READ Data: %s', utili.Esa(tmp))
+            if self.cattura is not None:
+                self.cattura.rx(tmp)
+            self.proto['rx'].examine(tmp)
+
+            dim = self.uart.in_waiting
+
+    def _manage_events(self):
+        for msg in self.proto['rx'].iter_msgs():
+            evt = self.proto['rx'].decompose(msg)
+            if evt is not None:
+                try:
+                    self.events[evt.evn](evt)
+                except KeyError:
+                    self.diario.debug('PLEASE MANAGE %r', evt)
+
+    def _run_poll(self):
         while True:
             # any command?
-            if not self._exec_command():
-                # quit
-                break
-
-            # any data?
-            while self.uart.in_waiting:
-                tmp = self.uart.read(self.uart.in_waiting)
-                if len(tmp) == 0:
+            try:
+                cmd = self.command['todo'].get(True, self.command['poll'])
+                if not self._exec_command(cmd):
+                    # quit
                     break
+            except queue.Empty:
+                pass
 
-                self.diario.debug(
-                    'IRP_MJ_READ Data: ' +
-                    utili.stringa_da_ba(
-                        tmp,
-                        ' '))
-                self.proto['rx'].examine(tmp)
+            # any data?
+            self._read_uart()
 
             # any message?
+            self._manage_events()
+
+            self._send_commands()
+
+    def uart_ready(self):
+        """
+        the serial port has data (called by who serves the port)
+        :return: False if the port has been unplugged
+        """
+        try:
+            # at least one byte: a port that is readable
+            # but empty has been unplugged
+            self._read_uart(1)
+            return True
+        except serial.SerialException as err:
+            self.diario.error(str(err))
+            return False
+
+    def bell_rung(self):
+        """
+        something was put in todo (called by who serves the port)
+        :return: n.a.
+        """
+        os.read(self.command['campanello'][0], 512)
+
+    def work(self):
+        """
+        manage events and commands after uart_ready/bell_rung
+        (called by who serves the port)
+        :return: False when the dongle must be released
+        """
+        self._manage_events()
+
+        while True:
+            try:
+                cmd = self.command['todo'].get_nowait()
+            except queue.Empty:
+                break
+            if not self._exec_command(cmd):
+                return False
+
+        self._send_commands()
+        return True
+
+    def _run_selettore(self):
+        selettore = selectors.DefaultSelector()
+        selettore.register(self.uart.fileno(), selectors.EVENT_READ, 'uart')
+        selettore.register(self.command['campanello'][0], selectors.EVENT_READ, 'campanello')
+        try:
             while True:
-                msg = self.proto['rx'].get_msg()
-                if msg is None:
+                for chiave, _ in selettore.select():
+                    if chiave.data == 'campanello':
+                        self.bell_rung()
+                    elif not self.uart_ready():
+                        selettore.unregister(chiave.fileobj)
+
+                if not self.work():
                     break
+        finally:
+            selettore.close()
+
+    def run(self):
+        if self.command['campanello'] is None:
+            self._run_poll()
+        else:
+            self._run_selettore()
 
-                dec = self.proto['rx'].decompose(msg)
-                if any(dec):
-                    try:
-                        self.events[dec['evn']](dec['prm'])
-                    except KeyError:
-                        self.diario.debug('PLEASE MANAGE ' +
-                                          self.proto['rx'].msg_to_string(msg))
+        self.goodbye()
 
+    def goodbye(self):
+        """
+        last message to the dongle (called by who serves the port
+        after work returns False)
+        :return: n.a.
+        """
         # switch dongle to initial configuration
         cmd = _COMMAND(self.Cmd_Tool_Disconnected_Api)
         msg = self.proto['tx'].compose(cmd.get())
 
-        self.diario.debug(
-            'IRP_MJ_WRITE Data: ' +
-            utili.stringa_da_ba(
-                msg,
-                ' '))
-        self.uart.write(msg)
+        self.diario.debug('IRP_MJ_WRITE Data: %s', utili.Esa(msg))
+        if self.cattura is not None:
+            self.cattura.tx(msg)
+        try:
+            self.uart.write(msg)
+        except serial.SerialException as err:
+            self.diario.error(str(err))
+
+        self.fermo.set()
 
     def close(self):
         """
@@ -832,10 +1086,18 @@ class CY567x(threading.Thread):
             # kill the thd
             ktt = _COMMAND(self.QUIT)
 
-            self.command['todo'].put_nowait(ktt)
+            self.submit(ktt)
 
             # wait
-            self.join()
+            if self.gestore is None:
+                self.join()
+            else:
+                self.fermo.wait()
+
+            if self.command['campanello'] is not None:
+                os.close(self.command['campanello'][0])
+                os.close(self.command['campanello'][1])
+                self.command['campanello'] = None
 
             # close the serial port
             self.uart.close()
@@ -848,22 +1110,25 @@ class CY567x(threading.Thread):
         """
         return self.uart is not None
 
+    @_operazione
     def init_ble_stack(self):
         """
         send the command that stops and then restart bluetooth
         :return: bool
         """
         self.diario.debug('init_ble_stack')
-        return self._send_command_and_wait(self.Cmd_Init_Ble_Stack_Api)
+        return (yield _COMMAND(self.Cmd_Init_Ble_Stack_Api))
 
+    @_operazione
     def get_rssi(self):
         self.diario.debug('get_rssi')
-        rsp = self._send_command_and_wait(self.Cmd_Get_Rssi_Api)
+        rsp = (yield _COMMAND(self.Cmd_Get_Rssi_Api))
         if not isinstance(rsp, bool):
             return struct.unpack('<b', rsp)[0]
 
         return None
 
+    @_operazione
     def get_txpowerlevel(self, conn=True):
         """
         get the power level of the channel
@@ -871,9 +1136,8 @@ class CY567x(threading.Thread):
         :return: dict or None
         """
         self.diario.debug('get_txpowerlevel')
-        prm = bytearray([1 if conn else 0])
-        rsp = self._send_command_and_wait(
-            self.Cmd_Get_TxPowerLevel_Api, prm=prm)
+        rsp = (yield _COMMAND(
+            self.Cmd_Get_TxPowerLevel_Api, prm=(1 if conn else 0,)))
         if not isinstance(rsp, bool):
             chg, pl = struct.unpack('<BB', rsp)
             return {
@@ -883,16 +1147,16 @@ class CY567x(threading.Thread):
 
         return None
 
+    @_operazione
     def set_txpowerlevel(self, conn=True, pot=3):
         self.diario.debug('set_txpowerlevel')
 
-        prm = struct.pack('<BB',
-                          1 if conn else 0,
-                          val_tp(pot))
+        prm = (1 if conn else 0, val_tp(pot))
 
-        return self._send_command_and_wait(
-            self.Cmd_Set_TxPowerLevel_Api, prm=prm)
+        return (yield _COMMAND(
+            self.Cmd_Set_TxPowerLevel_Api, prm=prm))
 
+    @_operazione
     def my_address(self, public=True):
         """
         get the dongle address
@@ -900,14 +1164,14 @@ class CY567x(threading.Thread):
         :return: bytearray or None
         """
         self.diario.debug('my_address')
-        prm = bytearray([0 if public else 1])
-        rsp = self._send_command_and_wait(
-            self.Cmd_Get_Bluetooth_Device_Address_Api, prm=prm)
+        rsp = (yield _COMMAND(
+            self.Cmd_Get_Bluetooth_Device_Address_Api, prm=(0 if public else 1,)))
         if not isinstance(rsp, bool):
             return rsp
 
         return None
 
+    @_operazione
     def set_connection_parameters(self, cp):
         self.diario.debug('set_connection_parameters')
 
@@ -915,26 +1179,23 @@ class CY567x(threading.Thread):
         connIntvMax = int(cp['connIntvMax'] / 1.25)
         supervisionTO = int(cp['supervisionTO'] / 10.0)
 
-        prm = bytearray(
-            struct.pack(
-                '<HHB',
-                cp['scanIntv'],
-                cp['scanWindow'],
-                cp['initiatorFilterPolicy']))
-        prm += cp['peerBdAddr']
-        prm += struct.pack('<BBHHHHHH',
-                           cp['peerAddrType'],
-                           cp['ownAddrType'],
-                           connIntvMin,
-                           connIntvMax,
-                           cp['connLatency'],
-                           supervisionTO,
-                           cp['minCeLength'],
-                           cp['maxCeLength'])
-
-        return self._send_command_and_wait(
-            self.Cmd_Set_Connection_Parameters_Api, prm=prm)
-
+        prm = (cp['scanIntv'],
+               cp['scanWindow'],
+               cp['initiatorFilterPolicy'],
+               bytes(cp['peerBdAddr']),
+               cp['peerAddrType'],
+               cp['ownAddrType'],
+               connIntvMin,
+               connIntvMax,
+               cp['connLatency'],
+               supervisionTO,
+               cp['minCeLength'],
+               cp['maxCeLength'])
+
+        return (yield _COMMAND(
+            self.Cmd_Set_Connection_Parameters_Api, prm=prm))
+
+    @_operazione
     def get_connection_parameters(self):
         """
         get the parameters currently used
@@ -942,8 +1203,8 @@ class CY567x(threading.Thread):
         :return: dict or None
         """
         self.diario.debug('get_connection_parameters')
-        rsp = self._send_command_and_wait(
-            self.Cmd_Get_Connection_Parameters_Api)
+        rsp = (yield _COMMAND(
+            self.Cmd_Get_Connection_Parameters_Api))
         if not isinstance(rsp, bool):
             scanIntv, scanWindow, initiatorFilterPolicy = struct.unpack(
                 '<HHB', rsp[:5])
@@ -988,6 +1249,7 @@ class CY567x(threading.Thread):
 
         return None
 
+    @_operazione
     def get_scan_parameters(self):
         """
         get the parameters currently used
@@ -995,8 +1257,8 @@ class CY567x(threading.Thread):
         :return: dict or None
         """
         self.diario.debug('get_scan_parameters')
-        rsp = self._send_command_and_wait(
-            self.Cmd_Get_Scan_Parameters_Api)
+        rsp = (yield _COMMAND(
+            self.Cmd_Get_Scan_Parameters_Api))
         if not isinstance(rsp, bool):
             discProcedure, tipo, intv, window, ownAddrType, filterPolicy, to, filterDuplicates = struct.unpack(
                 '<BBHHBBHB', rsp)
@@ -1014,46 +1276,85 @@ class CY567x(threading.Thread):
 
         return None
 
+    @_operazione
     def set_scan_parameters(self, sp):
         self.diario.debug('set_scan_parameters')
 
-        prm = struct.pack('<BBHHBBHB',
-                          valore(sp['discProcedure'], DISCOVERY_PROC),
-                          1 if sp['active'] else 0,
-                          int(sp['interval'] / 0.625),
-                          int(sp['window'] / 0.625),
-                          valore(sp['ownAddrType'], ADDRESS_TYPE),
-                          valore(sp['filterPolicy'], FILTER_POLICY),
-                          sp['to'],
-                          1 if sp['filterDuplicates'] else 0)
+        prm = (valore(sp['discProcedure'], DISCOVERY_PROC),
+               1 if sp['active'] else 0,
+               int(sp['interval'] / 0.625),
+               int(sp['window'] / 0.625),
+               valore(sp['ownAddrType'], ADDRESS_TYPE),
+               valore(sp['filterPolicy'], FILTER_POLICY),
+               sp['to'],
+               1 if sp['filterDuplicates'] else 0)
 
-        return self._send_command_and_wait(
-            self.Cmd_Set_Scan_Parameters_Api, prm=prm)
+        return (yield _COMMAND(
+            self.Cmd_Set_Scan_Parameters_Api, prm=prm))
 
+    @_operazione
     def clear_list(self):
         """
         removes the bonding information of the device and removes it from the white list
         :return: bool
         """
         self.diario.debug('clear_list')
-        return self._send_command_and_wait(self.Cmd_Clear_White_List_Api)
+        return (yield _COMMAND(self.Cmd_Clear_White_List_Api))
+
+    def set_scan_filter(self, filtro=None):
+        """
+        only the advertisements that pass the filter reach scan_progress_cb
+        (the filter runs in the thread of the dongle, on the raw bytes)
+        :param filtro: scan_util.FILTRO, a callable with the same signature or None (all)
+        :return: n.a.
+        """
+        self.scan_filter = filtro
+
+    def set_scan_recorder(self, registro=None):
+        """
+        every advertisement, before the filter, is given to registro
+        (in the thread of the dongle, on the raw bytes)
+        :param registro: cyregistro.REGISTRO, a callable with the same signature or None
+        :return: n.a.
+        """
+        self.scan_recorder = registro
+
+    def add_signal_listener(self, ascoltatore):
+        """
+        ascoltatore(nome) is called (in the thread of the dongle, after the
+        event is set) when 'encrypt' or 'keyinfo' of sincro are set
+        :param ascoltatore: callable
+        :return: n.a.
+        """
+        self.signal_listeners = self.signal_listeners + [ascoltatore]
+
+    def remove_signal_listener(self, ascoltatore):
+        """
+        cfr add_signal_listener
+        :param ascoltatore: callable
+        :return: n.a.
+        """
+        self.signal_listeners = [_ for _ in self.signal_listeners if _ != ascoltatore]
 
+    @_operazione
     def scan_start(self):
         """
         start scanning for devices
         :return: bool
         """
         self.diario.debug('scan_start')
-        return self._send_command_and_wait(self.Cmd_Start_Scan_Api)
+        return (yield _COMMAND(self.Cmd_Start_Scan_Api))
 
+    @_operazione
     def scan_stop(self):
         """
         stop scanning
         :return: bool
         """
         self.diario.debug('scan_stop')
-        return self._send_command_and_wait(self.Cmd_Stop_Scan_Api)
+        return (yield _COMMAND(self.Cmd_Stop_Scan_Api))
 
+    @_operazione
     def set_local_device_security(self, level, bondable=False):
         """
         configure cyBle_authInfo
@@ -1083,15 +1384,16 @@ class CY567x(threading.Thread):
             # don't force secure connections (this should be done by the perip)
             CyBle_GapSetSecureConnectionsOnlyMode = 0
 
-            prm = struct.pack('<6B', security, bonding, ekeySize, authErr,
-                              pairingProperties,
-                              CyBle_GapSetSecureConnectionsOnlyMode)
+            prm = (security, bonding, ekeySize, authErr,
+                   pairingProperties,
+                   CyBle_GapSetSecureConnectionsOnlyMode)
 
-            return self._send_command_and_wait(
-                self.Cmd_Set_Local_Device_Security_Api, prm=prm)
+            return (yield _COMMAND(
+                self.Cmd_Set_Local_Device_Security_Api, prm=prm))
 
         return False
 
+    @_operazione
     def set_device_io_capabilities(self, capa):
         """
         can influence security
@@ -1100,29 +1402,45 @@ class CY567x(threading.Thread):
         """
         self.diario.debug('set_device_io_capabilities')
         try:
-            prm = bytearray([IO_CAPABILITIES[capa]])
-            return self._send_command_and_wait(
-                self.Cmd_Set_Device_Io_Capabilities_Api, prm=prm)
+            prm = (IO_CAPABILITIES[capa],)
+            return (yield _COMMAND(
+                self.Cmd_Set_Device_Io_Capabilities_Api, prm=prm))
         except KeyError:
             return False
 
-    def connect(self, bda, public=True) -> bool:
+    @_operazione
+    def connect(self, bda, public=True, to=10) -> bool:
         """
         connect to the device
         :param bda: string
+        :param public: type of the address
+        :param to: timeout (then the attempt is cancelled)
         :return: bool
         """
         if self.connection['cyBle_connHandle'] is None:
             self.diario.debug('connect')
-            prm = utili.mac_da_stringa(bda)
-            prm.append(0 if public else 1)
+            prm = (bytes(utili.mac_da_stringa(bda)), 0 if public else 1)
 
-            return self._send_command_and_wait(
-                self.Cmd_Establish_Connection_Api, prm=prm, to=10)
+            esito = (yield _COMMAND(
+                self.Cmd_Establish_Connection_Api, prm=prm, to=to))
+            if not esito and self.connection['cyBle_connHandle'] is None:
+                # otherwise the dongle keeps trying
+                yield from self.cancel_connection.operazione(self)
+            return esito
 
         # only one device at a time
         return False
 
+    @_operazione
+    def cancel_connection(self):
+        """
+        stop a connection that has not been established yet
+        :return: bool
+        """
+        self.diario.debug('cancel_connection')
+        return (yield _COMMAND(self.Cmd_Cancle_Connection_Api))
+
+    @_operazione
     def connect_pk(self, bda: str, pk: str, public=True, clearlist=True, to=20) -> bool:
         """
         connect to a device that will request pairing (legacy passkey or just works)
@@ -1135,23 +1453,23 @@ class CY567x(threading.Thread):
             self.sincro['passkeyReq'].clear()
 
             if clearlist:
-                if not self.clear_list():
+                if not (yield from self.clear_list.operazione(self)):
                     raise utili.Problema('err clear_list')
 
-            if not self.connect(bda, public):
+            if not (yield from self.connect.operazione(self, bda, public)):
                 raise utili.Problema('Connessione: ERRORE')
 
-            if not self.sincro['authReq'].wait(to):
+            if not (yield _SEGNALE('authReq', to)):
                 raise utili.Problema("err autReq")
 
-            if not self.initiate_pairing_request():
+            if not (yield from self.initiate_pairing_request.operazione(self)):
                 raise utili.Problema('err pair req')
 
             if pk != 'JUST_WORKS':
-                if not self.sincro['passkeyReq'].wait(to):
+                if not (yield _SEGNALE('passkeyReq', to)):
                     raise utili.Problema("err passkeyReq")
 
-                if not self.pairing_passkey(int(pk)):
+                if not (yield from self.pairing_passkey.operazione(self, int(pk))):
                     raise utili.Problema('err pairing_passkey')
 
             return True
@@ -1160,6 +1478,20 @@ class CY567x(threading.Thread):
             self.diario.error(str(err))
             return False
 
+    @_operazione
+    def wait_encryption(self, to=5):
+        """
+        wait for the end of the pairing (cfr pairing_passkey):
+        encryption on and keys exchanged
+        :param to: timeout of each of the two
+        :return: bool
+        """
+        self.diario.debug('wait_encryption')
+        if not (yield _SEGNALE('encrypt', to)):
+            return False
+        return (yield _SEGNALE('keyinfo', to))
+
+    @_operazione
     def disconnect(self):
         """
         close the connection to the device
@@ -1167,13 +1499,14 @@ class CY567x(threading.Thread):
         """
         if self.connection['cyBle_connHandle'] is not None:
             self.diario.debug('disconnect')
-            prm = struct.pack('<H', self.connection['cyBle_connHandle'])
-            return self._send_command_and_wait(
-                self.Cmd_Terminate_Connection_Api, prm=prm)
+            prm = (self.connection['cyBle_connHandle'],)
+            return (yield _COMMAND(
+                self.Cmd_Terminate_Connection_Api, prm=prm))
 
         # no connections: so I have executed the disconnection!
         return True
 
+    @_operazione
     def find_primary_service(self, suid, to=10):
         """
         check if the service uuid is present
@@ -1186,17 +1519,17 @@ class CY567x(threading.Thread):
 
             self.services['current'] = []
 
-            prm = struct.pack('<HB', self.connection['cyBle_connHandle'], 2)
-            prm += ba_from_stringuuid(suid)
-            if self._send_command_and_wait(
+            prm = (self.connection['cyBle_connHandle'], 2, bytes(ba_from_stringuuid(suid)))
+            if (yield _COMMAND(
                     self.Cmd_Discover_Primary_Services_By_Uuid_Api, prm=prm,
-                    to=to):
+                    to=to)):
                 if any(self.services['current']):
                     return self.services['current'][0]
 
         # no connection, no service
         return None
 
+    @_operazione
     def find_primary_services(self, to=10):
         """
         find all the services
@@ -1208,16 +1541,17 @@ class CY567x(threading.Thread):
 
             self.services['primary'] = []
 
-            prm = struct.pack('<H', self.connection['cyBle_connHandle'])
-            if self._send_command_and_wait(
+            prm = (self.connection['cyBle_connHandle'],)
+            if (yield _COMMAND(
                     self.Cmd_Discover_All_Primary_Services_Api, prm=prm,
-                    to=to):
+                    to=to)):
                 if any(self.services['primary']):
                     return self.services['primary']
 
         # no connection, no service
         return None
 
+    @_operazione
     def discover_characteristics_by_uuid(self, sehu, to=10):
         """
         find all the characteristics
@@ -1230,18 +1564,19 @@ class CY567x(threading.Thread):
 
             self.services['char'] = []
 
-            prm = struct.pack('<HB', self.connection['cyBle_connHandle'], 2)
-            prm += ba_from_stringuuid(sehu['uuid128'])
-            prm += struct.pack('<2H', sehu['starth'], sehu['endh'])
-            if self._send_command_and_wait(
+            prm = (self.connection['cyBle_connHandle'], 2,
+                   bytes(ba_from_stringuuid(sehu['uuid128'])),
+                   sehu['starth'], sehu['endh'])
+            if (yield _COMMAND(
                     self.Cmd_Discover_Characteristics_By_Uuid_Api, prm=prm,
-                    to=to):
+                    to=to)):
                 if any(self.services['char']):
                     return self.services['char']
 
         # no connection, no characteristics
         return None
 
+    @_operazione
     def discover_all_characteristics(self, sehu, to=10):
         """
         find all characteristic declarations within a service definition
@@ -1254,15 +1589,15 @@ class CY567x(threading.Thread):
 
             self.services['char'] = []
 
-            prm = struct.pack('<H', self.connection['cyBle_connHandle'])
-            prm += struct.pack('<2H', sehu['starth'], sehu['endh'])
-            if self._send_command_and_wait(
-                    self.Cmd_Discover_All_Characteristics_Api, prm=prm, to=to):
+            prm = (self.connection['cyBle_connHandle'], sehu['starth'], sehu['endh'])
+            if (yield _COMMAND(
+                    self.Cmd_Discover_All_Characteristics_Api, prm=prm, to=to)):
                 if any(self.services['char']):
                     return self.services['char']
 
         return None
 
+    @_operazione
     def discover_characteristic_descriptors(self, charh, to=10):
         """
         find all the characteristic descriptors
@@ -1275,17 +1610,17 @@ class CY567x(threading.Thread):
 
             self.services['char'] = []
 
-            prm = struct.pack('<3H', self.connection['cyBle_connHandle'],
-                              charh, charh)
-            if self._send_command_and_wait(
+            prm = (self.connection['cyBle_connHandle'], charh, charh)
+            if (yield _COMMAND(
                     self.Cmd_Discover_All_Characteristic_Descriptors_Api,
                     prm=prm,
-                    to=to):
+                    to=to)):
                 if any(self.services['char']):
                     return self.services['char']
 
         return None
 
+    @_operazione
     def exchange_gatt_mtu_size(self, mtu=512):
         """
         try to change mtu size
@@ -1297,9 +1632,9 @@ class CY567x(threading.Thread):
 
         if self.connection['cyBle_connHandle'] is not None:
             self.diario.debug('exchange_gatt_mtu_size')
-            prm = struct.pack('<2H', self.connection['cyBle_connHandle'], mtu)
-            if self._send_command_and_wait(self.Cmd_Exchange_GATT_MTU_Size_Api,
-                                           prm=prm):
+            prm = (self.connection['cyBle_connHandle'], mtu)
+            if (yield _COMMAND(self.Cmd_Exchange_GATT_MTU_Size_Api,
+                               prm=prm)):
                 return self.connection['mtu']
 
         return 0
@@ -1315,11 +1650,10 @@ class CY567x(threading.Thread):
         if len(dati) > mtu - 3:
             dati = dati[:mtu - 3]
 
-        prm = struct.pack('<3H', self.connection['cyBle_connHandle'], crt,
-                          len(dati))
-        prm += dati
-        return self._send_command_and_wait(cmd, prm=prm, to=to)
+        prm = (self.connection['cyBle_connHandle'], crt, len(dati))
+        return (yield _COMMAND(cmd, prm=prm, to=to, dati=dati))
 
+    @_operazione
     def write_without_response(self, crt, dati):
         """
         bt 4.2 - vol 3 - part G - 4.9.1
@@ -1331,12 +1665,13 @@ class CY567x(threading.Thread):
         if self.connection['cyBle_connHandle'] is not None:
             self.diario.debug('write_without_response')
 
-            return self._write(
+            return (yield from self._write(
                 crt, dati,
-                self.Cmd_Characteristic_Value_Write_Without_Response_Api)
+                self.Cmd_Characteristic_Value_Write_Without_Response_Api))
 
         return False
 
+    @_operazione
     def write_characteristic_value(self, crt, dati, to=5):
         """
         bt 4.2 - vol 3 - part G - 4.9.3
@@ -1348,11 +1683,12 @@ class CY567x(threading.Thread):
         if self.connection['cyBle_connHandle'] is not None:
             self.diario.debug('write_characteristic_value')
 
-            return self._write(crt, dati,
-                               self.Cmd_Write_Characteristic_Value_Api, to)
+            return (yield from self._write(crt, dati,
+                                           self.Cmd_Write_Characteristic_Value_Api, to))
 
         return False
 
+    @_operazione
     def write_characteristic_descriptor(self, crt, ntf=False, ndc=False, to=5):
         """
         enable/disable notifications and/or indications
@@ -1370,12 +1706,13 @@ class CY567x(threading.Thread):
             if ndc:
                 dati += 2
 
-            return self._write(crt, bytearray([dati]),
-                               self.Cmd_Write_Characteristic_Descriptor_Api,
-                               to)
+            return (yield from self._write(crt, bytearray([dati]),
+                                           self.Cmd_Write_Characteristic_Descriptor_Api,
+                                           to))
 
         return False
 
+    @_operazione
     def write_long_characteristic_value(self, crt, dati, ofs=0, to=10):
         """
         bt 4.2 - vol 3 - part G - 4.9.4
@@ -1389,14 +1726,13 @@ class CY567x(threading.Thread):
         if self.connection['cyBle_connHandle'] is not None:
             self.diario.debug('write_long_characteristic_value')
 
-            prm = struct.pack('<4H', self.connection['cyBle_connHandle'], crt,
-                              ofs, len(dati))
-            prm += dati
-            return self._send_command_and_wait(
-                self.Cmd_Write_Long_Characteristic_Value_Api, prm=prm, to=to)
+            prm = (self.connection['cyBle_connHandle'], crt, ofs, len(dati))
+            return (yield _COMMAND(
+                self.Cmd_Write_Long_Characteristic_Value_Api, prm=prm, to=to, dati=dati))
 
         return False
 
+    @_operazione
     def write_char_best(self, crt, dati, to=10):
         """
         write a characteristic with simple write or write long
@@ -1409,12 +1745,13 @@ class CY567x(threading.Thread):
         if self.connection['cyBle_connHandle'] is not None:
             mtu = self.connection['mtu']
             if len(dati) > mtu - 3:
-                return self.write_long_characteristic_value(crt, dati, to=to)
+                return (yield from self.write_long_characteristic_value.operazione(self, crt, dati, to=to))
 
-            return self.write_characteristic_value(crt, dati, to=to)
+            return (yield from self.write_characteristic_value.operazione(self, crt, dati, to=to))
 
         return False
 
+    @_operazione
     def ctrl_notify_indicate(self, char, notif=True, indic=True):
         BLE_ABIL_NOTIF = (1 << 0)
         BLE_ABIL_INDIC = (1 << 1)
@@ -1426,8 +1763,9 @@ class CY567x(threading.Thread):
             ctrl += BLE_ABIL_INDIC
 
         msg = struct.pack('<H', ctrl)
-        return self.write_characteristic_value(char, msg)
+        return (yield from self.write_characteristic_value.operazione(self, char, msg))
 
+    @_operazione
     def read_characteristic_value(self, crt, to=10):
         """
         bt 4.2 - vol 3 - part G - 4.8.1
@@ -1444,15 +1782,16 @@ class CY567x(threading.Thread):
         if self.connection['cyBle_connHandle'] is not None:
             self.diario.debug('read_characteristic_value')
 
-            prm = struct.pack('<2H', self.connection['cyBle_connHandle'], crt)
+            prm = (self.connection['cyBle_connHandle'], crt)
 
-            res = self._send_command_and_wait(
-                self.Cmd_Read_Characteristic_Value_Api, prm=prm, to=to)
+            res = (yield _COMMAND(
+                self.Cmd_Read_Characteristic_Value_Api, prm=prm, to=to))
             if not isinstance(res, bool):
                 return res
 
         return None
 
+    @_operazione
     def read_long_characteristic_value(self, crt, ofs=0, to=10):
         """
         bt 4.2 - vol 3 - part G - 4.8.3
@@ -1465,16 +1804,16 @@ class CY567x(threading.Thread):
         if self.connection['cyBle_connHandle'] is not None:
             self.diario.debug('read_long_characteristic_value')
 
-            prm = struct.pack('<3H', self.connection['cyBle_connHandle'], crt,
-                              ofs)
+            prm = (self.connection['cyBle_connHandle'], crt, ofs)
 
-            res = self._send_command_and_wait(
-                self.Cmd_Read_Long_Characteristic_Values_Api, prm=prm, to=to)
+            res = (yield _COMMAND(
+                self.Cmd_Read_Long_Characteristic_Values_Api, prm=prm, to=to))
             if not isinstance(res, bool):
                 return res
 
         return None
 
+    @_operazione
     def read_char_best(self, crt, dim, to=10):
         """
         uses read or read long depending on the expected dimension
@@ -1487,12 +1826,13 @@ class CY567x(threading.Thread):
         if self.connection['cyBle_connHandle'] is not None:
             mtu = self.connection['mtu']
             if dim <= mtu - 1:
-                return self.read_characteristic_value(crt, to=to)
+                return (yield from self.read_characteristic_value.operazione(self, crt, to=to))
 
-            return self.read_long_characteristic_value(crt, to=to)
+            return (yield from self.read_long_characteristic_value.operazione(self, crt, to=to))
 
         return None
 
+    @_operazione
     def read_characteristic_descriptor(self, crt, to=5):
         """
         read notifications and indications state
@@ -1503,10 +1843,10 @@ class CY567x(threading.Thread):
         if self.connection['cyBle_connHandle'] is not None:
             self.diario.debug('read_characteristic_descriptor')
 
-            prm = struct.pack('<2H', self.connection['cyBle_connHandle'], crt)
+            prm = (self.connection['cyBle_connHandle'], crt)
 
-            res = self._send_command_and_wait(
-                self.Cmd_Read_Characteristic_Descriptor_Api, prm=prm, to=to)
+            res = (yield _COMMAND(
+                self.Cmd_Read_Characteristic_Descriptor_Api, prm=prm, to=to))
             if not isinstance(res, bool):
                 val = struct.unpack('<H', res)[0]
                 ntf = False
@@ -1519,6 +1859,7 @@ class CY567x(threading.Thread):
 
         return None
 
+    @_operazione
     def initiate_pairing_request(self):
         """
         Invoke after gap_auth_req_cb
@@ -1526,12 +1867,13 @@ class CY567x(threading.Thread):
         """
         if self.connection['cyBle_connHandle'] is not None:
             self.diario.debug('initiate_pairing_request')
-            prm = struct.pack('<H', self.connection['cyBle_connHandle'])
-            return self._send_command_and_wait(
-                self.Cmd_Initiate_Pairing_Request_Api, prm=prm)
+            prm = (self.connection['cyBle_connHandle'],)
+            return (yield _COMMAND(
+                self.Cmd_Initiate_Pairing_Request_Api, prm=prm))
 
         return False
 
+    @_operazione
     def pairing_passkey(self, pk: int):
         """
         Invoke after gap_passkey_entry_request_cb
@@ -1539,11 +1881,10 @@ class CY567x(threading.Thread):
         :return: bool
         """
         if self.connection['cyBle_connHandle'] is not None:
-            self.diario.debug('pairing_passkey({})'.format(pk))
-            prm = struct.pack(
-                '<HIB', self.connection['cyBle_connHandle'], pk, 1)
-            return self._send_command_and_wait(
-                self.Cmd_Pairing_PassKey_Api, prm=prm)
+            self.diario.debug('pairing_passkey(%s)', pk)
+            prm = (self.connection['cyBle_connHandle'], pk, 1)
+            return (yield _COMMAND(
+                self.Cmd_Pairing_PassKey_Api, prm=prm))
 
         return False
 
@@ -1554,11 +1895,13 @@ class CY567x(threading.Thread):
         :param adv: bytearray
         :return: n.a.
         """
-        self.diario.debug('scan_progress_cb: ' + utili.stringa_da_ba(adv, ' '))
+        if not self.diario.abilitato(logging.DEBUG):
+            return
+        self.diario.debug('scan_progress_cb: %s', utili.Esa(adv))
         sr = scan_report(adv)
-        self.diario.debug('    ' + str(sr))
+        self.diario.debug('    %s', sr)
         adv = scan_advertise(sr['data'])
-        self.diario.debug('    ' + str(adv))
+        self.diario.debug('    %s', adv)
 
     def gap_auth_req_cb(self, ai):
         """
@@ -0,0 +1,998 @@
+"""
+Micro benchmarks for the host side of the CY5677 driver
+(nothing here needs the dongle)
+"""
+import asyncio
+import io
+import logging
+import os
+import random
+import resource
+import sqlite3
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import CY567x
+import scan_util
+import sniff
+import utili
+from cyasync import AsyncCY567x
+from cyarchivio import ARCHIVIO
+from cycattura import CATTURA, file_della_cattura
+from cyesecutore import ESECUTORE
+from cyregistro import REGISTRO
+from cymanager import DongleManager
+from cysim import SIMULATORE
+from cyproto import PROTO_RX, PROTO_TX
+from cycost import EVT_CHARACTERISTIC_VALUE_NOTIFICATION
+
+
+def _frame_rx(evn, prm):
+    return struct.pack('<3H', 0xA7BD, len(prm) + 2, evn) + prm
+
+
+def _frame_tx(cmd, prm):
+    return struct.pack('<3H', 0x5943, cmd, len(prm)) + prm
+
+
+def flusso_rx(quanti, dim_max=247, seme=0):
+    """
+    a stream of notifications as the dongle would send them
+    :param quanti: number of frames
+    :param dim_max: maximum payload
+    :param seme: random seed
+    :return: bytes
+    """
+    rnd = random.Random(seme)
+    flusso = bytearray()
+    for _ in range(quanti):
+        dim = rnd.randint(1, dim_max)
+        prm = struct.pack('<3H', 4, 0x12, dim) + bytes(rnd.getrandbits(8) for _ in range(dim))
+        flusso += _frame_rx(EVT_CHARACTERISTIC_VALUE_NOTIFICATION, prm)
+    return bytes(flusso)
+
+
+def flusso_tx(quanti, dim_max=247, seme=0):
+    """
+    a stream of write commands as the host would send them
+    :param quanti: number of frames
+    :param dim_max: maximum payload
+    :param seme: random seed
+    :return: bytes
+    """
+    rnd = random.Random(seme)
+    flusso = bytearray()
+    for _ in range(quanti):
+        dim = rnd.randint(1, dim_max)
+        prm = struct.pack('<3H', 4, 0x12, dim) + bytes(rnd.getrandbits(8) for _ in range(dim))
+        flusso += _frame_tx(0x020B, prm)
+    return bytes(flusso)
+
+
+def a_pezzi(flusso, dim):
+    """
+    split a stream as the uart would do
+    :param flusso: bytes
+    :param dim: chunk size
+    :return: list of bytes
+    """
+    return [flusso[i:i + dim] for i in range(0, len(flusso), dim)]
+
+
+def bench_examine(proto, pezzi, giri=3):
+    """
+    throughput of PROTO.examine
+    :param proto: PROTO_RX or PROTO_TX
+    :param pezzi: chunks to feed
+    :param giri: repetitions
+    :return: (MB/s, frames)
+    """
+    tot = sum(len(_) for _ in pezzi)
+    migliore = None
+    msg = 0
+    for _ in range(giri):
+        proto.reinit()
+        msg = 0
+        inizio = time.perf_counter()
+        for pezzo in pezzi:
+            proto.examine(pezzo)
+            while proto.get_msg() is not None:
+                msg += 1
+        durata = time.perf_counter() - inizio
+        if migliore is None or durata < migliore:
+            migliore = durata
+    return tot / migliore / 1e6, msg
+
+
+def stress_burst(quanti):
+    """
+    tens of thousands of back-to-back frames in one examine call
+    :param quanti: number of frames
+    :return: (seconds, frames)
+    """
+    flusso = flusso_rx(quanti, dim_max=20)
+    proto = PROTO_RX()
+
+    inizio = time.perf_counter()
+    msg = 0
+    for _ in proto.iter_msgs(flusso):
+        msg += 1
+    durata = time.perf_counter() - inizio
+
+    assert msg == quanti, msg
+    assert not proto.msg_list and not proto.partial
+    return durata, msg
+
+
+class _MUTO(CY567x.CY567x):
+    """
+    a driver without serial port: only the event handlers are used
+    """
+
+    def __init__(self):
+        CY567x.CY567x.__init__(self, porta='')
+        self.ricevuti = 0
+
+    def gattc_handle_value_ntf_cb(self, crt, ntf):
+        self.ricevuti += len(ntf)
+
+
+def _dispatch(dongle, pezzi):
+    proto = dongle.proto['rx']
+    for pezzo in pezzi:
+        proto.examine(pezzo)
+        while True:
+            msg = proto.get_msg()
+            if msg is None:
+                break
+            dec = proto.decompose(msg)
+            if dec is not None:
+                dongle.events[dec.evn](dec)
+
+
+def bench_dispatch(pezzi, giri=3):
+    """
+    from the uart to gattc_handle_value_ntf_cb
+    :param pezzi: chunks to feed
+    :param giri: repetitions
+    :return: MB/s
+    """
+    tot = sum(len(_) for _ in pezzi)
+    migliore = None
+    for _ in range(giri):
+        dongle = _MUTO()
+        inizio = time.perf_counter()
+        _dispatch(dongle, pezzi)
+        durata = time.perf_counter() - inizio
+        if migliore is None or durata < migliore:
+            migliore = durata
+    return tot / migliore / 1e6
+
+
+def _percentile(campioni, perc):
+    campioni = sorted(campioni)
+    return campioni[min(len(campioni) - 1, int(len(campioni) * perc / 100))]
+
+
+def bench_rtt(quanti=500):
+    """
+    command round trip against a simulated dongle
+    :param quanti: number of commands
+    :return: (p50, p99) in ms
+    """
+    dongle = SIMULATORE()
+    cy = CY567x.CY567x(porta=dongle.porta)
+    assert cy.is_ok()
+    tempi = []
+    for _ in range(quanti):
+        inizio = time.perf_counter()
+        assert cy.init_ble_stack()
+        tempi.append(time.perf_counter() - inizio)
+    cy.close()
+    dongle.close()
+    return _percentile(tempi, 50) * 1e3, _percentile(tempi, 99) * 1e3
+
+
+def bench_finestra(finestra, chiamanti=8, quanti=100):
+    """
+    write_without_response from many threads against a dongle
+    that acknowledges after 1 ms and completes after 1 ms more
+    :param finestra: commands in flight
+    :param chiamanti: threads
+    :param quanti: commands for each thread
+    :return: commands per second
+    """
+    dongle = SIMULATORE(esecuzione=0.001)
+    cy = CY567x.CY567x(porta=dongle.porta, finestra=finestra)
+    assert cy.is_ok()
+    cy.connection['cyBle_connHandle'] = 4
+
+    def scrivi():
+        for _ in range(quanti):
+            assert cy.write_without_response(0x12, b'0123456789')
+
+    thd = [threading.Thread(target=scrivi) for _ in range(chiamanti)]
+    inizio = time.perf_counter()
+    for _ in thd:
+        _.start()
+    for _ in thd:
+        _.join()
+    durata = time.perf_counter() - inizio
+
+    cy.close()
+    dongle.close()
+    return chiamanti * quanti / durata
+
+
+def bench_async(dongle=2, quanti=4000, finestra=8):
+    """
+    write_without_response as coroutines spread over some dongles
+    all pending at the same time, driven by one event loop
+    :param dongle: number of simulated dongles
+    :param quanti: number of coroutines
+    :param finestra: commands in flight for each dongle
+    :return: (commands per second, threads during the run)
+    """
+
+    async def prova():
+        simulati = [SIMULATORE(esecuzione=0.001) for _ in range(dongle)]
+        acy = []
+        for sim in simulati:
+            cy = CY567x.CY567x(porta=sim.porta, finestra=finestra)
+            cy.connection['cyBle_connHandle'] = 4
+            acy.append(AsyncCY567x(cy))
+
+        inizio = time.perf_counter()
+        ris = await asyncio.gather(
+            *(acy[_ % dongle].write_without_response(0x12, b'0123456789') for _ in range(quanti)))
+        durata = time.perf_counter() - inizio
+        thd = threading.active_count()
+        assert all(ris)
+
+        for _ in acy:
+            _.close()
+        for _ in simulati:
+            _.close()
+        return quanti / durata, thd
+
+    return asyncio.run(prova())
+
+
+def bench_comando(quanti=100000):
+    """
+    life of a _COMMAND: creation, completion with and without data,
+    collection of the result
+    :param quanti: number of commands
+    :return: (us for a plain command, us for a command with 4 data events)
+    """
+    pezzo = memoryview(bytes(range(200)))[10:160]
+
+    inizio = time.perf_counter()
+    for _ in range(quanti):
+        cmd = CY567x._COMMAND(0xFE06, (4, 0x12))
+        cmd.set_result(True)
+        cmd.get_result(1)
+    semplice = (time.perf_counter() - inizio) / quanti * 1e6
+
+    inizio = time.perf_counter()
+    for _ in range(quanti):
+        cmd = CY567x._COMMAND(0xFE08, (4, 0x12, 0))
+        for _ in range(4):
+            cmd.save(pezzo)
+        cmd.set_result(True)
+        cmd.get_result(1)
+    con_dati = (time.perf_counter() - inizio) / quanti * 1e6
+
+    return semplice, con_dati
+
+
+def bench_pool(dongle, lavori=4, quanti=200):
+    """
+    jobs that lease a dongle from a DongleManager and send commands
+    :param dongle: number of simulated dongles
+    :param lavori: number of jobs (threads)
+    :param quanti: commands for each job
+    :return: (commands per second, threads serving the dongles)
+    """
+    simulati = [SIMULATORE(esecuzione=0.001) for _ in range(dongle)]
+    prima = threading.active_count()
+    gestore = DongleManager(porte=[_.porta for _ in simulati])
+    servitori = threading.active_count() - prima
+
+    def lavoro():
+        with gestore.leased() as cy:
+            for _ in range(quanti):
+                assert cy.init_ble_stack()
+
+    thd = [threading.Thread(target=lavoro) for _ in range(lavori)]
+    inizio = time.perf_counter()
+    for _ in thd:
+        _.start()
+    for _ in thd:
+        _.join()
+    durata = time.perf_counter() - inizio
+
+    gestore.close()
+    for _ in simulati:
+        _.close()
+    return lavori * quanti / durata, servitori
+
+
+class _CONTA(CY567x.CY567x):
+    """
+    counts what the callbacks receive
+    """
+
+    def __init__(self, porta):
+        self.ricevuti = {'adv': 0, 'ntf': 0, 'byte': 0}
+        CY567x.CY567x.__init__(self, porta=porta)
+
+    def scan_progress_cb(self, adv):
+        self.ricevuti['adv'] += 1
+
+    def gattc_handle_value_ntf_cb(self, crt, ntf):
+        self.ricevuti['ntf'] += 1
+        self.ricevuti['byte'] += len(ntf)
+
+
+def bench_flusso(adv=0, ntf=0, ntf_dim=20, durata=1.0):
+    """
+    advertisements or notifications from a simulated dongle at 921600 baud
+    :param adv: advertisements per second
+    :param ntf: notifications per second
+    :param ntf_dim: size of the notifications
+    :param durata: seconds
+    :return: (adv per second, ntf per second) received by the callbacks
+    """
+    sim = SIMULATORE(adv=adv, ntf=ntf, ntf_dim=ntf_dim)
+    cy = _CONTA(sim.porta)
+    if adv:
+        assert cy.scan_start()
+    else:
+        assert cy.connect('00:11:22:33:44:55')
+    prima = dict(cy.ricevuti)
+    time.sleep(durata)
+    dopo = dict(cy.ricevuti)
+    cy.close()
+    sim.close()
+    return (dopo['adv'] - prima['adv']) / durata, (dopo['ntf'] - prima['ntf']) / durata
+
+
+class _LUMACA(CY567x.CY567x):
+    """
+    a scan callback that takes its time (e.g. it prints)
+    """
+
+    def __init__(self, porta, esecutore):
+        self.ricevuti = 0
+        CY567x.CY567x.__init__(self, porta=porta, esecutore=esecutore)
+
+    def scan_progress_cb(self, adv):
+        self.ricevuti += 1
+        time.sleep(0.0005)
+
+
+def bench_richiami(esecutore, adv=1000, durata=2.0):
+    """
+    command round trip while a slow scan callback receives adv/s
+    :param esecutore: cyesecutore.ESECUTORE or None (callbacks in the thread of the dongle)
+    :param adv: advertisements per second
+    :param durata: seconds of commands
+    :return: (p50, p99) in ms, advertisements received, advertisements dropped
+    """
+    sim = SIMULATORE(adv=adv, baud=None)
+    cy = _LUMACA(sim.porta, esecutore)
+    assert cy.scan_start()
+    tempi = []
+    fine = time.perf_counter() + durata
+    while time.perf_counter() < fine:
+        inizio = time.perf_counter()
+        assert cy.init_ble_stack()
+        tempi.append(time.perf_counter() - inizio)
+    cy.scan_stop()
+    cy.close()
+    sim.close()
+    persi = 0
+    if esecutore is not None:
+        esecutore.close()
+        persi = esecutore.contatori['scan']['persi']
+    return _percentile(tempi, 50) * 1e3, _percentile(tempi, 99) * 1e3, cy.ricevuti, persi
+
+
+class _UART:
+    """
+    what _read_uart needs of a serial port, fed with chunks
+    """
+
+    def __init__(self, pezzi):
+        self.pezzi = list(reversed(pezzi))
+
+    @property
+    def in_waiting(self):
+        return len(self.pezzi[-1]) if self.pezzi else 0
+
+    def read(self, _):
+        return self.pezzi.pop()
+
+
+def bench_log(pezzi, livello=None, giri=3):
+    """
+    uart -> callbacks with the log of the driver
+    :param pezzi: chunks to feed
+    :param livello: None (no logger) or the level of the logger
+    :param giri: repetitions
+    :return: MB/s
+    """
+    tot = sum(len(_) for _ in pezzi)
+    registro = logging.getLogger('bench')
+    registro.propagate = False
+    registro.handlers = [logging.NullHandler()]
+    migliore = None
+    for _ in range(giri):
+        dongle = _MUTO()
+        if livello is not None:
+            registro.setLevel(livello)
+            # the handlers in this thread, as the dongle did
+            utili.IN_CODA = False
+            dongle.diario = utili.LOGGA('bench')
+            utili.IN_CODA = True
+        dongle.uart = _UART(pezzi)
+        inizio = time.perf_counter()
+        while dongle.uart.pezzi:
+            dongle._read_uart()
+            dongle._manage_events()
+        durata = time.perf_counter() - inizio
+        dongle.uart = None
+        if migliore is None or durata < migliore:
+            migliore = durata
+    return tot / migliore / 1e6
+
+
+def bench_cattura(pezzi, cartella):
+    """
+    uart -> callbacks with the binary capture, compared with the DEBUG text
+    :param pezzi: chunks to feed
+    :param cartella: where to write the files
+    :return: (MB/s, bytes of the capture, bytes of the text)
+    """
+    tot = sum(len(_) for _ in pezzi)
+
+    nome = os.path.join(cartella, 'bench')
+    cattura = CATTURA(nome)
+    dongle = _MUTO()
+    dongle.cattura = cattura
+    dongle.uart = _UART(pezzi)
+    inizio = time.perf_counter()
+    while dongle.uart.pezzi:
+        dongle._read_uart()
+        dongle._manage_events()
+    cattura.close()
+    durata = time.perf_counter() - inizio
+    dongle.uart = None
+    binario = sum(os.path.getsize(_) for _ in file_della_cattura(nome))
+
+    testo = os.path.join(cartella, 'bench.txt')
+    registro = logging.getLogger('bench.testo')
+    registro.propagate = False
+    registro.setLevel(logging.DEBUG)
+    gestore = logging.FileHandler(testo)
+    gestore.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    registro.handlers = [gestore]
+    dongle = _MUTO()
+    utili.IN_CODA = False
+    dongle.diario = utili.LOGGA('bench.testo')
+    utili.IN_CODA = True
+    dongle.uart = _UART(pezzi)
+    while dongle.uart.pezzi:
+        dongle._read_uart()
+        dongle._manage_events()
+    dongle.uart = None
+    gestore.close()
+    registro.handlers = []
+
+    return tot / durata / 1e6, binario, os.path.getsize(testo)
+
+
+def log_sintetico(nome, mb):
+    """
+    a DEBUG log of the driver (as sniff.py reads it) of about mb MB
+    :param nome: file to write
+    :param mb: size
+    :return: n.a.
+    """
+    righe = []
+    for pezzo in a_pezzi(flusso_tx(200), 300):
+        righe.append('2022-08-05 09:59:06,027 - DEBUG - IRP_MJ_WRITE Data: '
+                     + utili.stringa_da_ba(pezzo, ' ') + '\n')
+        righe.append('2022-08-05 09:59:06,028 - DEBUG - EVT_COMMAND_STATUS: cmd=020B stt=0\n')
+    for pezzo in a_pezzi(flusso_rx(200), 512):
+        righe.append('2022-08-05 09:59:06,030 - DEBUG - IRP_MJ_READ Data: '
+                     + utili.stringa_da_ba(pezzo, ' ') + '\n')
+    blocco = ''.join(righe).encode('ascii')
+
+    with open(nome, 'wb') as usc:
+        usc.write(b'2022-08-05 09:59:06,000 - DEBUG - IRP_MJ_CREATE\n')
+        for _ in range(mb * 1024 * 1024 // len(blocco) + 1):
+            usc.write(blocco)
+        usc.write(b'2022-08-05 09:59:06,000 - DEBUG - IRP_MJ_CLOSE\n')
+
+
+def bench_sniff(nome, lavori=1):
+    """
+    sniff.py on a log, in a process of its own
+    :param nome: the log
+    :param lavori: --jobs
+    :return: (MB/s, peak RSS in MB)
+    """
+    inizio = time.perf_counter()
+    subprocess.run([sys.executable, 'sniff.py', '--jobs', str(lavori), nome], check=True,
+                   cwd=os.path.dirname(os.path.abspath(__file__)))
+    durata = time.perf_counter() - inizio
+    # linux: KB
+    picco = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return os.path.getsize(nome) / durata / 1e6, picco
+
+
+def bench_indice(nome, **kwargs):
+    """
+    sniff.cerca on a log: the first time builds the index
+    :param nome: the log
+    :param kwargs: for sniff.cerca
+    :return: (s of the first query, ms of the next ones)
+    """
+    if os.path.exists(sniff.nome_indice(nome)):
+        os.remove(sniff.nome_indice(nome))
+    tempi = []
+    for _ in range(4):
+        inizio = time.perf_counter()
+        sniff.cerca(nome, io.StringIO(), **kwargs)
+        tempi.append(time.perf_counter() - inizio)
+    return tempi[0], min(tempi[1:]) * 1000
+
+
+class _REGISTRA(CY567x.CY567x):
+    # keeps the advertisements
+    def __init__(self, porta):
+        self.corpus = []
+        CY567x.CY567x.__init__(self, porta=porta)
+
+    def scan_progress_cb(self, adv):
+        self.corpus.append(adv)
+
+
+def corpus_adv(durata=1.0):
+    """
+    the advertisements received from the simulator in a scan
+    :param durata: seconds of the scan
+    :return: list of bytearray
+    """
+    sim = SIMULATORE(adv=5000, baud=None)
+    dongle = _REGISTRA(sim.porta)
+    dongle.scan_start()
+    time.sleep(durata)
+    dongle.scan_stop()
+    dongle.close()
+    sim.close()
+    return dongle.corpus
+
+
+def bench_adv(corpus, giri=3):
+    """
+    what a scan callback does with every advertisement: bda, rssi and
+    the uuids of the service data
+    :param corpus: list of bytearray
+    :param giri: repetitions
+    :return: (us with scan_report/scan_advertise, us with RAPPORTO)
+    """
+    def vecchio(adv):
+        sr = scan_util.scan_report(adv)
+        for elem in scan_util.scan_advertise(sr['data']):
+            if elem[0] == 'srvd128':
+                return sr['bda'], sr['rssi'], elem[1]
+        return sr['bda'], sr['rssi'], None
+
+    def nuovo(adv):
+        rapporto = scan_util.RAPPORTO(adv)
+        for elem in rapporto.trova(0x21):
+            return rapporto.bda, rapporto.rssi, elem.uuid
+        return rapporto.bda, rapporto.rssi, None
+
+    esito = []
+    for funz in (vecchio, nuovo):
+        migliore = None
+        for _ in range(giri):
+            inizio = time.perf_counter()
+            for adv in corpus:
+                funz(adv)
+            durata = time.perf_counter() - inizio
+            if migliore is None or durata < migliore:
+                migliore = durata
+        esito.append(migliore / len(corpus) * 1e6)
+    return esito
+
+
+def bench_filtro(corpus, giri=3):
+    """
+    host cost of an advertisement for a GHOST-like callback, that wants
+    only the 128 bit service data of two services
+    :param corpus: list of bytearray (none of them is wanted)
+    :param giri: repetitions
+    :return: (us decoding everything, us with a scan_util.FILTRO)
+    """
+    servizi = ('4A7A3045-BCD8-4ACA-B5AE-95FB82EEB222', 'C18594D9-DFF5-4552-89F8-0F2940D1E32D')
+    filtro = scan_util.FILTRO(adv=[0x00], srvd=[scan_util.ba_from_stringuuid(_) for _ in servizi])
+    trovati = []
+
+    def tutto(evt):
+        sr = scan_util.scan_report(bytearray(evt))
+        if sr['adv_type'] != 'Connectable undirected advertising':
+            return
+        for elem in scan_util.scan_advertise(sr['data']):
+            if elem[0] == 'srvd128' and elem[1] in servizi:
+                trovati.append(sr)
+
+    def filtrato(evt):
+        if filtro(evt):
+            tutto(evt)
+
+    # as _evt_scan_progress_result sees them
+    code = [memoryview(bytes(_)) for _ in corpus]
+    esito = []
+    for funz in (tutto, filtrato):
+        migliore = None
+        for _ in range(giri):
+            inizio = time.perf_counter()
+            for evt in code:
+                funz(evt)
+            durata = time.perf_counter() - inizio
+            if migliore is None or durata < migliore:
+                migliore = durata
+        esito.append(migliore / len(code) * 1e6)
+    return esito
+
+
+def bench_tabella(corpus, adv=5000, intervallo=1.0):
+    """
+    advertisements that reach the callback through a scan_util.TABELLA
+    :param corpus: list of bytearray (the same devices over and over)
+    :param adv: advertisements per second of the corpus
+    :param intervallo: see TABELLA
+    :return: (us per advertisement, how many passed)
+    """
+    # the time of the corpus, not of the bench
+    ora = [0.0]
+    tabella = scan_util.TABELLA(intervallo=intervallo, orologio=lambda: ora[0])
+
+    code = [memoryview(bytes(_)) for _ in corpus]
+    inizio = time.perf_counter()
+    for evt in code:
+        ora[0] += 1.0 / adv
+        tabella(evt)
+    durata = time.perf_counter() - inizio
+    return durata / len(code) * 1e6, tabella.passati
+
+
+def bench_registro(corpus, giri=20):
+    """
+    memory of a survey: a cyregistro.REGISTRO against a scan_report per advertisement
+    :param corpus: list of bytearray
+    :param giri: how many times the corpus is recorded
+    :return: (us per advertisement, bytes per advertisement, bytes per scan_report)
+    """
+    registro = REGISTRO()
+    code = [memoryview(bytes(_)) for _ in corpus]
+    inizio = time.perf_counter()
+    for _ in range(giri):
+        for evt in code:
+            registro(evt)
+    durata = time.perf_counter() - inizio
+
+    tracemalloc.start()
+    rapporti = [scan_util.scan_report(bytearray(_)) for _ in code]
+    dizionari = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del rapporti
+
+    return durata / len(registro) * 1e6, registro.memoria() / len(registro), \
+        dizionari / len(code)
+
+
+def bench_archivio(corpus, cartella, produttori=4, giri=5):
+    """
+    sightings from many dongles into a cyarchivio.ARCHIVIO
+    :param corpus: list of bytearray
+    :param cartella: where the databases are created
+    :param produttori: threads that add
+    :param giri: how many times each thread adds the corpus
+    :return: (us of aggiungi, rows/s of ARCHIVIO, rows/s with a commit per row)
+    """
+    rapporti = [scan_util.scan_report(bytearray(_)) for _ in corpus]
+    archivio = ARCHIVIO(os.path.join(cartella, 'archivio.db'))
+
+    def aggiungi():
+        for _ in range(giri):
+            for sr in rapporti:
+                archivio.aggiungi(sr)
+
+    thd = [threading.Thread(target=aggiungi) for _ in range(produttori)]
+    inizio = time.perf_counter()
+    for _ in thd:
+        _.start()
+    for _ in thd:
+        _.join()
+    messi = time.perf_counter() - inizio
+    archivio.close()
+    scritti = time.perf_counter() - inizio
+    righe = archivio.contatori['righe']
+
+    # one by one, as a callback would do
+    nomefile = os.path.join(cartella, 'uno.db')
+    ARCHIVIO(nomefile).close()
+    con = sqlite3.connect(nomefile)
+    quanti = min(2000, len(rapporti))
+    inizio = time.perf_counter()
+    for sr in rapporti[:quanti]:
+        with con:
+            con.execute('INSERT INTO avvistamenti VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                        (time.time(), sr['bda'], sr['bda_type'], sr['adv_type'], sr['rssi'],
+                         bytes(sr['data']), None, None))
+    uno = quanti / (time.perf_counter() - inizio)
+    con.close()
+
+    return messi / righe * produttori * 1e6, righe / scritti, uno
+
+
+class _CERCA(CY567x.CY567x):
+    """
+    signals the first advertisement that passes the filter
+    """
+
+    def __init__(self, porta):
+        self.visto = threading.Event()
+        CY567x.CY567x.__init__(self, porta=porta)
+
+    def scan_progress_cb(self, adv):
+        self.visto.set()
+
+
+def bench_rubrica(quanti=10, adv=50):
+    """
+    connection to a known device: straight to its address against a scan
+    that waits for it first (as GHOST.find does)
+    :param quanti: connections of each kind
+    :param adv: advertisements per second of the 50 simulated devices
+    :return: (ms straight, ms after a scan)
+    """
+    sim = SIMULATORE(adv=adv)
+    cy = _CERCA(sim.porta)
+    bda = utili.stringa_da_mac(sim.dispositivi[7][0])
+    cy.set_scan_filter(scan_util.FILTRO(bda=[bda]))
+
+    diretta = []
+    for _ in range(quanti):
+        inizio = time.perf_counter()
+        assert cy.connect(bda, public=False, to=2)
+        diretta.append(time.perf_counter() - inizio)
+        assert cy.disconnect()
+
+    scansione = []
+    for _ in range(quanti):
+        inizio = time.perf_counter()
+        cy.visto.clear()
+        assert cy.scan_start()
+        assert cy.visto.wait(10)
+        assert cy.scan_stop()
+        assert cy.connect(bda, public=False)
+        scansione.append(time.perf_counter() - inizio)
+        assert cy.disconnect()
+
+    cy.close()
+    sim.close()
+    return sum(diretta) / quanti * 1e3, sum(scansione) / quanti * 1e3
+
+
+def bench_cifratura(quanti=5):
+    """
+    from the passkey to an encrypted link, waiting for the events of the
+    stack (connect_to slept 2 s); the simulator encrypts after 50 ms
+    :param quanti: connections
+    :return: ms
+    """
+    sim = SIMULATORE()
+    cy = CY567x.CY567x(porta=sim.porta)
+    tempi = []
+    for _ in range(quanti):
+        assert cy.connect('00:11:22:33:44:55', public=False)
+        inizio = time.perf_counter()
+        assert cy.pairing_passkey(123456)
+        assert cy.wait_encryption(5)
+        tempi.append(time.perf_counter() - inizio)
+        assert cy.disconnect()
+        assert not cy.sincro['encrypt'].is_set()
+    cy.close()
+    sim.close()
+    return sum(tempi) / quanti * 1e3
+
+
+def bench_problema(quanti=20000):
+    """
+    raise and catch of utili.Problema
+    :param quanti: how many
+    :return: (us with the position, us without)
+    """
+    esito = []
+    for posizione in (True, False):
+        utili.POSIZIONE = posizione
+        inizio = time.perf_counter()
+        for _ in range(quanti):
+            try:
+                raise utili.Problema('bench')
+            except utili.Problema:
+                pass
+        esito.append((time.perf_counter() - inizio) / quanti * 1e6)
+    utili.POSIZIONE = True
+    return esito
+
+
+class _LENTO(logging.Handler):
+    # a disk or a console that takes its time
+    def emit(self, record):
+        self.format(record)
+        time.sleep(0.0002)
+
+
+def bench_diario(coda, quanti=2000):
+    """
+    latency of LOGGA.debug for the caller with a slow handler
+    :param coda: False to keep the handler in the thread of the caller
+    :param quanti: records
+    :return: (p50, p99) in us
+    """
+    registro = logging.getLogger('bench.diario')
+    registro.propagate = False
+    registro.setLevel(logging.DEBUG)
+    registro.handlers = [_LENTO()]
+    utili.IN_CODA = coda
+    diario = utili.LOGGA('bench.diario')
+    utili.IN_CODA = True
+    ascolta = utili.diario_in_coda('bench.diario') if coda else None
+    dati = bytes(range(64))
+
+    campioni = []
+    for _ in range(quanti):
+        inizio = time.perf_counter()
+        diario.debug('IRP_MJ_READ Data: %s', utili.Esa(dati))
+        campioni.append((time.perf_counter() - inizio) * 1e6)
+
+    if ascolta is not None:
+        ascolta.stop()
+    registro.handlers = []
+    return _percentile(campioni, 50), _percentile(campioni, 99)
+
+
+def main():
+    quanti = 20000
+    if len(sys.argv) == 2:
+        quanti = int(sys.argv[1])
+    if len(sys.argv) >= 3 and sys.argv[1] == 'sniff':
+        # python bench.py sniff 1024 [jobs...]
+        with tempfile.TemporaryDirectory() as cartella:
+            nome = os.path.join(cartella, 'sniff.log')
+            log_sintetico(nome, int(sys.argv[2]))
+            for lavori in [int(_) for _ in sys.argv[3:]] or [1]:
+                mbs, picco = bench_sniff(nome, lavori)
+                print('sniff {} MB log, jobs {}: {:8.2f} MB/s, peak RSS {:.0f} MB'.format(
+                    sys.argv[2], lavori, mbs, picco))
+            primo, poi = bench_indice(nome, eventi=['EVT_COMMAND_STATUS'])
+            print('sniff {} MB log, query: {:.2f} s with the index build, then {:.1f} ms'.format(
+                sys.argv[2], primo, poi))
+        return
+
+    rx = flusso_rx(quanti)
+    tx = flusso_tx(quanti)
+    # every write is a whole frame
+    tx_pezzi = []
+    pos = 0
+    while pos < len(tx):
+        dim = 6 + struct.unpack('<H', tx[pos + 4:pos + 6])[0]
+        tx_pezzi.append(tx[pos:pos + dim])
+        pos += dim
+
+    for dim in (64, 512, 4096):
+        mbs, msg = bench_examine(PROTO_RX(), a_pezzi(rx, dim))
+        print('examine RX chunk {:5d}: {:8.2f} MB/s ({} msg)'.format(dim, mbs, msg))
+    mbs, msg = bench_examine(PROTO_TX(), tx_pezzi)
+    print('examine TX frame     : {:8.2f} MB/s ({} msg)'.format(mbs, msg))
+
+    for mille in (10, 50, 100):
+        durata, msg = stress_burst(mille * 1000)
+        print('burst of {:6d} frames: {:8.3f} s'.format(msg, durata))
+
+    mbs = bench_dispatch(a_pezzi(flusso_rx(quanti, dim_max=500), 4096))
+    print('dispatch ntf mtu 512 : {:8.2f} MB/s'.format(mbs))
+
+    pezzi = a_pezzi(flusso_rx(quanti), 512)
+    for livello, nome in ((None, 'no logger'), (logging.INFO, 'INFO'), (logging.DEBUG, 'DEBUG')):
+        print('uart loop, {:9s} : {:8.2f} MB/s'.format(nome, bench_log(pezzi, livello)))
+
+    with tempfile.TemporaryDirectory() as cartella:
+        mbs, binario, testo = bench_cattura(pezzi, cartella)
+    print('uart loop, capture   : {:8.2f} MB/s, {} B on disk (DEBUG text {} B)'.format(
+        mbs, binario, testo))
+
+    with tempfile.TemporaryDirectory() as cartella:
+        nome = os.path.join(cartella, 'sniff.log')
+        log_sintetico(nome, 64)
+        mbs, picco = bench_sniff(nome)
+    print('sniff 64 MB log      : {:8.2f} MB/s, peak RSS {:.0f} MB'.format(mbs, picco))
+
+    vecchio, nuovo = bench_adv(corpus_adv())
+    print('advertisement        : {:.2f} us scan_report, {:.2f} us RAPPORTO'.format(vecchio, nuovo))
+
+    tutto, filtrato = bench_filtro(corpus_adv())
+    print('ghost callback       : {:.2f} us decoding all, {:.2f} us with FILTRO'.format(
+        tutto, filtrato))
+
+    corpus = corpus_adv(2.0)
+    for intervallo in (None, 1.0):
+        costo, passati = bench_tabella(corpus, intervallo=intervallo)
+        print('TABELLA every {:4}   : {:.2f} us, {} of {} to the callback'.format(
+            str(intervallo), costo, passati, len(corpus)))
+
+    costo, colonne, dizionari = bench_registro(corpus)
+    print('REGISTRO             : {:.2f} us, {:.0f} B per adv (scan_report {:.0f} B)'.format(
+        costo, colonne, dizionari))
+
+    with tempfile.TemporaryDirectory() as cartella:
+        messo, lotti, uno = bench_archivio(corpus, cartella)
+    print('ARCHIVIO, 4 dongles  : {:.2f} us to add, {:.0f} rows/s (one by one {:.0f} rows/s)'.format(
+        messo, lotti, uno))
+
+    diretta, scansione = bench_rubrica()
+    print('connect known device : {:.1f} ms to the address, {:.1f} ms after a scan'.format(
+        diretta, scansione))
+
+    print('passkey to encryption: {:.1f} ms (was a sleep of 2000 ms)'.format(bench_cifratura()))
+
+    con, senza = bench_problema()
+    print('Problema             : {:.2f} us, without position {:.2f} us'.format(con, senza))
+    for coda, nome in ((False, 'sync'), (True, 'queue')):
+        p50, p99 = bench_diario(coda)
+        print('slow handler, {:5s}  : p50 {:.1f} us, p99 {:.1f} us'.format(nome, p50, p99))
+
+    for adv in (1000, 5000):
+        ricevuti, _ = bench_flusso(adv=adv)
+        print('adv {:5d}/s          : {:8.0f}/s received'.format(adv, ricevuti))
+    for ntf in (100, 1000):
+        _, ricevuti = bench_flusso(ntf=ntf, ntf_dim=244)
+        print('ntf 244 B {:5d}/s    : {:8.0f}/s received'.format(ntf, ricevuti))
+
+    for nome, esecutore in (('inline', None), ('ESECUTORE', ESECUTORE())):
+        p50, p99, ricevuti, persi = bench_richiami(esecutore)
+        print('rtt, slow scan cb, {:9s}: p50 {:.3f} ms, p99 {:.3f} ms, {} adv, {} dropped'.format(
+            nome, p50, p99, ricevuti, persi))
+
+    p50, p99 = bench_rtt()
+    print('command rtt          : p50 {:.3f} ms, p99 {:.3f} ms'.format(p50, p99))
+
+    for finestra in (1, 2, 4, 8):
+        print('window {}             : {:8.0f} cmd/s'.format(finestra, bench_finestra(finestra)))
+
+    semplice, con_dati = bench_comando()
+    print('_COMMAND             : {:.2f} us, with 4 data events {:.2f} us'.format(semplice, con_dati))
+
+    for dongle in (1, 2, 4):
+        cps, thd = bench_pool(dongle)
+        print('pool of {} dongle     : {:8.0f} cmd/s, {} I/O thread'.format(dongle, cps, thd))
+
+    cps, thd = bench_async()
+    print('async 4000 on 2 dongle: {:7.0f} cmd/s, {} threads'.format(cps, thd))
+
+
+if __name__ == '__main__':
+    main()
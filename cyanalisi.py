@@ -0,0 +1,315 @@
+"""
+Latency and throughput of a session, from a log (see sniff.py)
+or from a capture (see cycattura.py)
+"""
+import argparse
+import datetime
+
+import numpy as np
+
+import cycattura
+import sniff
+from cycost import EVT_COMMAND_STATUS, EVT_COMMAND_COMPLETE, \
+    EVT_CHARACTERISTIC_VALUE_NOTIFICATION, EVT_CHARACTERISTIC_VALUE_INDICATION, \
+    quale_comando, quale_evento
+from cyproto import PROTO_RX, PROTO_TX
+
+# verso
+TX = 0
+RX = 1
+
+_NOTIFICHE = (EVT_CHARACTERISTIC_VALUE_NOTIFICATION, EVT_CHARACTERISTIC_VALUE_INDICATION)
+
+PERCENTILI = (50, 90, 99)
+
+
+class _SECONDI:
+    """
+    "2022-08-05 09:59:06,027" -> seconds since the epoch
+    (the date is parsed once per second of the log)
+    """
+
+    def __init__(self):
+        self.visti = {}
+
+    def __call__(self, quando):
+        base = quando[:19]
+        sec = self.visti.get(base)
+        if sec is None:
+            sec = datetime.datetime.strptime(base, '%Y-%m-%d %H:%M:%S').timestamp()
+            self.visti[base] = sec
+        return sec + int(quando[20:23] or 0) / 1000
+
+
+def _dal_diario(nomefile):
+    secondi = _SECONDI()
+    for riga in sniff.righe(nomefile):
+        oper = sniff.operazione(riga)
+        if oper is not None and oper[0] in ('w', 'r'):
+            yield secondi(oper[1]), TX if oper[0] == 'w' else RX, oper[2]
+
+
+def _dalla_cattura(nome):
+    for nomefile in cycattura.file_della_cattura(nome):
+        for quando, verso, dati in cycattura.leggi(nomefile):
+            yield quando / 1e9, TX if verso == cycattura.TX else RX, dati
+
+
+def _e_cattura(nome):
+    if cycattura.file_della_cattura(nome):
+        return True
+    try:
+        with open(nome, 'rb') as ing:
+            return ing.read(len(cycattura.MAGIA)) == cycattura.MAGIA
+    except OSError:
+        return False
+
+
+def carica(nome):
+    """
+    the frames of a log or of a capture as arrays
+    :param nome: log, file of a capture or name of a capture
+    :return: dict of numpy arrays (one element per frame):
+             tempo (s), verso (TX, RX), codice (command or event),
+             comando (of status and complete, else -1), dim (bytes with the header),
+             attributo (of notifications and indications, else -1)
+    """
+    if _e_cattura(nome):
+        if cycattura.file_della_cattura(nome):
+            sorgente = _dalla_cattura(nome)
+        else:
+            sorgente = ((q / 1e9, TX if v == cycattura.TX else RX, d)
+                        for q, v, d in cycattura.leggi(nome))
+    else:
+        sorgente = _dal_diario(nome)
+
+    proto = {TX: PROTO_TX(), RX: PROTO_RX()}
+    # one flat list per field: the arrays are built in one go
+    tempo = []
+    verso = []
+    codice = []
+    comando = []
+    dim = []
+    attributo = []
+    for quando, vrs, dati in sorgente:
+        for msg in proto[vrs].iter_msgs(dati):
+            if vrs == TX:
+                if len(msg) < 2:
+                    continue
+                cod = int.from_bytes(msg[:2], 'little')
+                cmd = -1
+                att = -1
+            else:
+                if len(msg) < 4:
+                    continue
+                cod = int.from_bytes(msg[2:4], 'little')
+                cmd = -1
+                att = -1
+                if cod in (EVT_COMMAND_STATUS, EVT_COMMAND_COMPLETE) and len(msg) >= 6:
+                    cmd = int.from_bytes(msg[4:6], 'little')
+                elif cod in _NOTIFICHE and len(msg) >= 8:
+                    att = int.from_bytes(msg[6:8], 'little')
+            tempo.append(quando)
+            verso.append(vrs)
+            codice.append(cod)
+            comando.append(cmd)
+            dim.append(len(msg) + 2)
+            attributo.append(att)
+
+    return {
+        'tempo': np.array(tempo, dtype=np.float64),
+        'verso': np.array(verso, dtype=np.uint8),
+        'codice': np.array(codice, dtype=np.uint16),
+        'comando': np.array(comando, dtype=np.int32),
+        'dim': np.array(dim, dtype=np.uint32),
+        'attributo': np.array(attributo, dtype=np.int32),
+    }
+
+
+def _accoppia(inizio, fine, scadenza):
+    # as the driver does: the answers of an opcode come in the order of the commands,
+    # so every answer is for the oldest command still waiting, sent before it;
+    # a command that waited more than scadenza was lost (the driver gave up)
+    # and an answer with no command before it is an orphan (e.g. the log rotated)
+    prima = np.searchsorted(inizio, fine, side='right').tolist()
+    vivi = np.searchsorted(inizio, fine - scadenza, side='left').tolist()
+    inviati = inizio.tolist()
+    durata = []
+    prossimo = 0
+    for quando, num, primo in zip(fine.tolist(), prima, vivi):
+        prossimo = max(prossimo, primo)
+        if prossimo < num:
+            durata.append(quando - inviati[prossimo])
+            prossimo += 1
+    return np.array(durata, dtype=np.float64)
+
+
+def latenze(frame, scadenza=5.0):
+    """
+    pair every command with its EVT_COMMAND_STATUS and EVT_COMMAND_COMPLETE
+    :param frame: see carica
+    :param scadenza: seconds after which a command without answer is lost
+                     (cfr the timeout of the commands)
+    :return: dict opcode -> (seconds to the status, seconds to the complete)
+    """
+    tx = frame['verso'] == TX
+    rx = ~tx
+    stato = rx & (frame['codice'] == EVT_COMMAND_STATUS)
+    completo = rx & (frame['codice'] == EVT_COMMAND_COMPLETE)
+
+    # sorted by opcode, then by time: one split per opcode
+    def per_opcode(scelti, chiave):
+        ordine = np.lexsort((frame['tempo'][scelti], chiave[scelti]))
+        codici = chiave[scelti][ordine]
+        tempi = frame['tempo'][scelti][ordine]
+        quali, dove = np.unique(codici, return_index=True)
+        return dict(zip(quali.tolist(), np.split(tempi, dove[1:])))
+
+    comandi = per_opcode(tx, frame['codice'].astype(np.int32))
+    stati = per_opcode(stato, frame['comando'])
+    completi = per_opcode(completo, frame['comando'])
+
+    vuoto = np.empty(0)
+    risul = {}
+    for cod, inviati in comandi.items():
+        risul[cod] = (_accoppia(inviati, stati.get(cod, vuoto), scadenza),
+                      _accoppia(inviati, completi.get(cod, vuoto), scadenza))
+    return risul
+
+
+def ritmi(frame):
+    """
+    bytes/s per direction and notifications/s per attribute
+    :param frame: see carica
+    :return: dict
+    """
+    tempo = frame['tempo']
+    if len(tempo) == 0:
+        return {'durata': 0.0, 'byte': {}, 'picco': {}, 'notifiche': {}}
+
+    inizio = tempo.min()
+    durata = max(tempo.max() - inizio, 1e-9)
+    secondo = (tempo - inizio).astype(np.int64)
+
+    byte = {}
+    picco = {}
+    for vrs, nome in ((TX, 'TX'), (RX, 'RX')):
+        scelti = frame['verso'] == vrs
+        byte[nome] = frame['dim'][scelti].sum() / durata
+        per_secondo = np.bincount(secondo[scelti], weights=frame['dim'][scelti])
+        picco[nome] = per_secondo.max() if len(per_secondo) else 0.0
+
+    notifiche = {}
+    att = frame['attributo'][frame['attributo'] >= 0]
+    if len(att):
+        quali, quanti = np.unique(att, return_counts=True)
+        notifiche = dict(zip(quali.tolist(), (quanti / durata).tolist()))
+
+    return {'durata': durata, 'byte': byte, 'picco': picco, 'notifiche': notifiche}
+
+
+def pause(frame, soglia=1.0, quante=5):
+    """
+    the periods without traffic
+    :param frame: see carica
+    :param soglia: seconds
+    :param quante: how many of the longest to return
+    :return: (number of pauses longer than soglia, total seconds,
+              list of (start, seconds) of the longest)
+    """
+    tempo = np.sort(frame['tempo'])
+    if len(tempo) < 2:
+        return 0, 0.0, []
+    salto = np.diff(tempo)
+    lunghe = np.flatnonzero(salto > soglia)
+    ordine = lunghe[np.argsort(salto[lunghe])[::-1][:quante]]
+    return len(lunghe), float(salto[lunghe].sum()), \
+        [(float(tempo[_]), float(salto[_])) for _ in ordine]
+
+
+def _ms(durate):
+    if len(durate) == 0:
+        return ['-'] * (len(PERCENTILI) + 1)
+    valori = np.percentile(durate, PERCENTILI).tolist() + [durate.max()]
+    return ['{:.1f}'.format(_ * 1000) for _ in valori]
+
+
+def tabella(frame, soglia=1.0):
+    """
+    the report of a session
+    :param frame: see carica
+    :param soglia: seconds of a pause
+    :return: string
+    """
+    righe = ['latencies in ms: S to EVT_COMMAND_STATUS, C to EVT_COMMAND_COMPLETE']
+    colonne = ['p{}'.format(_) for _ in PERCENTILI] + ['max']
+    righe.append('{:50s} {:>7s} {:>9s}  {}  {}'.format(
+        'command', 'n', 'total s',
+        ' '.join('{:>6s}'.format('S ' + _) for _ in colonne),
+        ' '.join('{:>6s}'.format('C ' + _) for _ in colonne)))
+
+    # who takes most of the time first
+    lat = latenze(frame)
+
+    def totale(cod):
+        stato, completo = lat[cod]
+        return completo.sum() if len(completo) else stato.sum()
+
+    for cod in sorted(lat, key=totale, reverse=True):
+        stato, completo = lat[cod]
+        inviati = np.count_nonzero((frame['verso'] == TX) & (frame['codice'] == cod))
+        righe.append('{:50s} {:7d} {:9.3f}  {}  {}'.format(
+            quale_comando(cod), inviati, totale(cod),
+            ' '.join('{:>6s}'.format(_) for _ in _ms(stato)),
+            ' '.join('{:>6s}'.format(_) for _ in _ms(completo))))
+
+    rit = ritmi(frame)
+    righe.append('')
+    righe.append('duration {:.3f} s, {} frames'.format(rit['durata'], len(frame['tempo'])))
+    for nome in rit['byte']:
+        righe.append('{}: {:.0f} B/s (peak {:.0f} B in a second)'.format(
+            nome, rit['byte'][nome], rit['picco'][nome]))
+    for att, freq in sorted(rit['notifiche'].items()):
+        righe.append('{} {:04X}: {:.1f}/s'.format(
+            quale_evento(EVT_CHARACTERISTIC_VALUE_NOTIFICATION), att, freq))
+
+    quante, totali, lunghe = pause(frame, soglia)
+    righe.append('{} pauses longer than {} s, {:.3f} s in total'.format(quante, soglia, totali))
+    for inizio, durata in lunghe:
+        righe.append('    {} {:.3f} s'.format(
+            datetime.datetime.fromtimestamp(inizio).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3],
+            durata))
+    return '\n'.join(righe)
+
+
+def salva(nomefile, frame):
+    """
+    the frames and the latencies in a .npz
+    :param nomefile: name of the file
+    :param frame: see carica
+    :return: n.a.
+    """
+    lat = latenze(frame)
+    cod_stato = [np.full(len(lat[_][0]), _, dtype=np.uint16) for _ in lat]
+    cod_fine = [np.full(len(lat[_][1]), _, dtype=np.uint16) for _ in lat]
+    vuoto = [np.empty(0)]
+    np.savez_compressed(
+        nomefile,
+        stato_codice=np.concatenate(cod_stato or vuoto).astype(np.uint16),
+        stato_durata=np.concatenate([lat[_][0] for _ in lat] or vuoto),
+        fine_codice=np.concatenate(cod_fine or vuoto).astype(np.uint16),
+        fine_durata=np.concatenate([lat[_][1] for _ in lat] or vuoto),
+        **frame)
+
+
+if __name__ == '__main__':
+    ARGOMENTI = argparse.ArgumentParser(description='Latency and throughput of a session')
+    ARGOMENTI.add_argument('diario', help='log of the driver or capture')
+    ARGOMENTI.add_argument('--npz', help='save frames and latencies here')
+    ARGOMENTI.add_argument('--gap', type=float, default=1.0, help='seconds of a pause')
+    ARG = ARGOMENTI.parse_args()
+
+    FRAME = carica(ARG.diario)
+    print(tabella(FRAME, ARG.gap))
+    if ARG.npz:
+        salva(ARG.npz, FRAME)
@@ -0,0 +1,223 @@
+"""
+Keeps the sightings of a scan in a SQLite database (WAL), so a long
+scan survives a restart: who receives the advertisements only puts
+them in a queue, a thread inserts them in batches
+The table rubrica keeps the last address of every serial number
+"""
+import queue
+import sqlite3
+import sys
+import threading
+import time
+
+import utili
+
+# the keys of scan_report, plus the ones of GHOST
+CAMPI = ('bda', 'bda_type', 'adv_type', 'rssi', 'data', 'prod', 'fase')
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS avvistamenti ('
+    'tempo REAL, bda TEXT, bda_type TEXT, adv_type TEXT, rssi INTEGER, '
+    'data BLOB, prod TEXT, fase TEXT)',
+    'CREATE INDEX IF NOT EXISTS avvistamenti_bda ON avvistamenti (bda, tempo)',
+    'CREATE INDEX IF NOT EXISTS avvistamenti_prod ON avvistamenti (prod, tempo)',
+    'CREATE TABLE IF NOT EXISTS rubrica ('
+    'prod TEXT PRIMARY KEY, bda TEXT, bda_type TEXT, fase TEXT, tempo REAL)',
+)
+
+_INSERISCI = 'INSERT INTO avvistamenti VALUES (?, ?, ?, ?, ?, ?, ?, ?)'
+
+# the batch is not in order of time
+_AGGIORNA = 'INSERT INTO rubrica VALUES (?, ?, ?, ?, ?) ON CONFLICT (prod) DO UPDATE ' \
+            'SET bda = excluded.bda, bda_type = excluded.bda_type, fase = excluded.fase, ' \
+            'tempo = excluded.tempo WHERE excluded.tempo >= rubrica.tempo'
+
+RUBRICA = ('prod', 'bda', 'bda_type', 'fase', 'tempo')
+
+# the thread waited enough
+_SCADUTO = object()
+
+
+def _apri(nomefile):
+    con = sqlite3.connect(nomefile)
+    con.execute('PRAGMA journal_mode=WAL')
+    # in WAL mode a crash loses at most the last transactions, never the database
+    con.execute('PRAGMA synchronous=NORMAL')
+    return con
+
+
+class ARCHIVIO(threading.Thread):
+    """
+    aggiungi() only puts the sighting in a queue: the thread inserts
+    them in one transaction every righe sightings or ms milliseconds
+    and updates rubrica with the ones that have a serial number
+    """
+
+    def __init__(self, nomefile, righe=1000, ms=200, storico=True, logga=False):
+        """
+        :param nomefile: the database (created if missing)
+        :param righe: sightings of a transaction
+        :param ms: max milliseconds a sighting waits
+        :param storico: False to keep only rubrica
+        :param logga: bool
+        """
+        threading.Thread.__init__(self, daemon=True)
+
+        if logga:
+            self.diario = utili.LOGGA('archivio')
+        else:
+            self.diario = utili.LOGGA()
+
+        self.nomefile = nomefile
+        self.righe = righe
+        self.attesa = ms / 1000
+        self.storico = storico
+
+        self.contatori = {'righe': 0, 'transazioni': 0, 'errori': 0}
+
+        self._coda = queue.SimpleQueue()
+
+        # errors of the schema are the caller's
+        con = _apri(nomefile)
+        with con:
+            for istr in _SCHEMA:
+                con.execute(istr)
+        con.close()
+
+        self.start()
+
+    def aggiungi(self, sr):
+        """
+        a sighting
+        :param sr: dict (cfr scan_report and CAMPI, not modified later)
+        :return: n.a.
+        """
+        self._coda.put((time.time(), sr))
+
+    def _scrivi(self, con, lotto):
+        righe = []
+        voci = []
+        for quando, sr in lotto:
+            if self.storico:
+                data = sr.get('data')
+                righe.append((quando, sr.get('bda'), sr.get('bda_type'), sr.get('adv_type'),
+                              sr.get('rssi'), None if data is None else bytes(data),
+                              sr.get('prod'), sr.get('fase')))
+            if sr.get('prod') is not None:
+                voci.append((sr['prod'], sr.get('bda'), sr.get('bda_type'), sr.get('fase'),
+                             quando))
+        try:
+            with con:
+                con.executemany(_INSERISCI, righe)
+                con.executemany(_AGGIORNA, voci)
+            self.contatori['righe'] += len(lotto)
+            self.contatori['transazioni'] += 1
+        except sqlite3.Error as err:
+            self.diario.error(str(err))
+            self.contatori['errori'] += len(lotto)
+
+    def run(self):
+        con = _apri(self.nomefile)
+        lotto = []
+        limite = 0.0
+        fine = False
+        while not fine:
+            attesa = None if not lotto else max(0.0, limite - time.monotonic())
+            try:
+                elem = self._coda.get(True, attesa)
+            except queue.Empty:
+                elem = _SCADUTO
+
+            # everything that is in the queue, up to a batch
+            while elem is not _SCADUTO:
+                if elem is None:
+                    fine = True
+                    break
+                if not lotto:
+                    limite = time.monotonic() + self.attesa
+                lotto.append(elem)
+                if len(lotto) >= self.righe:
+                    break
+                try:
+                    elem = self._coda.get_nowait()
+                except queue.Empty:
+                    break
+
+            if lotto and (fine or len(lotto) >= self.righe or time.monotonic() >= limite):
+                self._scrivi(con, lotto)
+                lotto = []
+
+        con.close()
+
+    def indirizzo(self, prod):
+        """
+        where a serial number was last seen (what is still in the queue is not there)
+        :param prod: serial number
+        :return: dict (RUBRICA) or None
+        """
+        return indirizzo(self.nomefile, prod)
+
+    def close(self):
+        """
+        write what is pending and close the database
+        :return: n.a.
+        """
+        if self.is_alive():
+            self._coda.put(None)
+            self.join()
+
+
+def leggi(nomefile, bda=None, prod=None, da=None, a=None):
+    """
+    the sightings in a database
+    :param nomefile: the database
+    :param bda: only of this address (string)
+    :param prod: only of this serial number (string)
+    :param da: epoch, from
+    :param a: epoch, to
+    :return: list of dict (CAMPI and 'tempo'), in order of time
+    """
+    dove = []
+    valori = []
+    for colonna, valore, confronto in (('bda', bda, '='), ('prod', prod, '='),
+                                       ('tempo', da, '>='), ('tempo', a, '<=')):
+        if valore is not None:
+            dove.append('{} {} ?'.format(colonna, confronto))
+            valori.append(valore)
+    istr = 'SELECT tempo, ' + ', '.join(CAMPI) + ' FROM avvistamenti'
+    if dove:
+        istr += ' WHERE ' + ' AND '.join(dove)
+    istr += ' ORDER BY tempo'
+
+    con = sqlite3.connect(nomefile)
+    try:
+        return [dict(zip(('tempo',) + CAMPI, _)) for _ in con.execute(istr, valori)]
+    finally:
+        con.close()
+
+
+def indirizzo(nomefile, prod):
+    """
+    where a serial number was last seen
+    :param nomefile: the database
+    :param prod: serial number
+    :return: dict (RUBRICA) or None
+    """
+    con = sqlite3.connect(nomefile)
+    try:
+        riga = con.execute('SELECT ' + ', '.join(RUBRICA) + ' FROM rubrica WHERE prod = ?',
+                           (prod,)).fetchone()
+    finally:
+        con.close()
+    return None if riga is None else dict(zip(RUBRICA, riga))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 2:
+        PROD = sys.argv[2] if len(sys.argv) == 3 else None
+        for elem in leggi(sys.argv[1], prod=PROD):
+            print('{} {} {} {:4d} {} {}'.format(
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(elem['tempo'])),
+                elem['bda'], elem['adv_type'], elem['rssi'], elem['prod'] or '', elem['fase'] or ''))
+    else:
+        print('Passare il database [e il numero di serie]')
@@ -0,0 +1,242 @@
+"""
+asyncio front-end for the CY567x dongles
+"""
+import asyncio
+import collections
+
+import CY567x as cy
+
+
+class _FLUSSO:
+    """
+    async iterator over what a callback of the dongle receives
+    when the consumer is slow, the oldest elements are dropped
+    """
+
+    def __init__(self, iscritti, dim):
+        self._iscritti = iscritti
+        self._coda = collections.deque(maxlen=dim)
+        self._pronto = asyncio.Event()
+        self._chiuso = False
+        self.persi = 0
+        iscritti.append(self)
+
+    def metti(self, cosa):
+        """
+        called in the event loop
+        :param cosa: element
+        :return: n.a.
+        """
+        if len(self._coda) == self._coda.maxlen:
+            self.persi += 1
+        self._coda.append(cosa)
+        self._pronto.set()
+
+    def close(self):
+        """
+        stop receiving: the iteration ends after what is already here
+        :return: n.a.
+        """
+        if self in self._iscritti:
+            self._iscritti.remove(self)
+        self._chiuso = True
+        self._pronto.set()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._coda:
+            if self._chiuso:
+                raise StopAsyncIteration
+            self._pronto.clear()
+            await self._pronto.wait()
+        return self._coda.popleft()
+
+
+class AsyncCY567x:
+    """
+    The methods of CY567x as coroutines: the dongle's thread resolves
+    futures of the event loop, so no thread is blocked by the pending
+    operations
+    Must be created inside the event loop
+    """
+
+    def __init__(self, dongle: cy.CY567x):
+        self.dongle = dongle
+        self.loop = asyncio.get_running_loop()
+
+        self._iscritti = {'adv': [], 'ntf': [], 'ind': []}
+        # name of the event in dongle.sincro -> futures
+        self._segnali = {}
+
+        self._aggancia('scan_progress_cb', self._distribuisci, 'adv')
+        self._aggancia('gattc_handle_value_ntf_cb', self._distribuisci, 'ntf')
+        self._aggancia('gattc_handle_value_ind_cb', self._distribuisci, 'ind')
+        self._aggancia('gap_auth_req_cb', self._sveglia, 'authReq')
+        self._aggancia('gap_passkey_entry_request_cb', self._sveglia, 'passkeyReq')
+        # encrypt, keyinfo
+        self.dongle.add_signal_listener(self._segnalato)
+
+    def _al_loop(self, funz, *args):
+        # from the thread of the dongle: the loop can be already closed
+        try:
+            self.loop.call_soon_threadsafe(funz, *args)
+        except RuntimeError:
+            pass
+
+    def _segnalato(self, nome):
+        self._al_loop(self._sveglia, nome, ())
+
+    def _aggancia(self, nome_cb, reazione, chi):
+        originale = getattr(self.dongle, nome_cb)
+
+        def callback(*args):
+            originale(*args)
+            self._al_loop(reazione, chi, args)
+
+        setattr(self.dongle, nome_cb, callback)
+
+    def _distribuisci(self, chi, args):
+        cosa = args[0] if len(args) == 1 else args
+        for flusso in self._iscritti[chi]:
+            flusso.metti(cosa)
+
+    def _sveglia(self, chi, _):
+        for fut in self._segnali.pop(chi, ()):
+            if not fut.done():
+                fut.set_result(True)
+
+    def _risolvi(self, fut, res):
+        if not fut.done():
+            fut.set_result(res)
+
+    async def _comando(self, cmd):
+        fut = self.loop.create_future()
+        cmd.fine = lambda res: self._al_loop(self._risolvi, fut, res)
+        self.dongle.submit(cmd)
+        try:
+            return await asyncio.wait_for(fut, cmd.to)
+        except asyncio.TimeoutError:
+            self.dongle.abort(cmd)
+            return False
+        except asyncio.CancelledError:
+            # nobody waits for it anymore: the dongle must not either
+            self.dongle.abort(cmd)
+            raise
+
+    async def _segnale(self, seg):
+        # the dongle sets the event before waking up the loop,
+        # so nothing is lost between the check and the registration
+        if self.dongle.sincro[seg.nome].is_set():
+            return True
+
+        fut = self.loop.create_future()
+        self._segnali.setdefault(seg.nome, []).append(fut)
+        try:
+            return await asyncio.wait_for(fut, seg.to)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            attesa = self._segnali.get(seg.nome, [])
+            if fut in attesa:
+                attesa.remove(fut)
+
+    async def _esegui(self, oper):
+        """
+        drive an operation without blocking the loop
+        :param oper: generator (cfr CY567x._operazione)
+        :return: what the operation returns
+        """
+        try:
+            cosa = next(oper)
+            while True:
+                if isinstance(cosa, cy._SEGNALE):
+                    res = await self._segnale(cosa)
+                else:
+                    res = await self._comando(cosa)
+                cosa = oper.send(res)
+        except StopIteration as fine:
+            return fine.value
+
+    def adverts(self, dim=1000):
+        """
+        the advertisements received while scanning (cfr scan_progress_cb)
+        :param dim: max elements waiting for the consumer
+        :return: async iterator of bytearray
+        """
+        return _FLUSSO(self._iscritti['adv'], dim)
+
+    def notifications(self, dim=1000):
+        """
+        the notifications received (cfr gattc_handle_value_ntf_cb)
+        :param dim: max elements waiting for the consumer
+        :return: async iterator of (handle, bytearray)
+        """
+        return _FLUSSO(self._iscritti['ntf'], dim)
+
+    def indications(self, dim=1000):
+        """
+        the indications received (cfr gattc_handle_value_ind_cb)
+        :param dim: max elements waiting for the consumer
+        :return: async iterator of (handle, result, bytearray)
+        """
+        return _FLUSSO(self._iscritti['ind'], dim)
+
+    def close(self):
+        """
+        give back the callbacks, end the streams and close the dongle
+        :return: n.a.
+        """
+        for nome_cb in ('scan_progress_cb', 'gattc_handle_value_ntf_cb',
+                        'gattc_handle_value_ind_cb', 'gap_auth_req_cb',
+                        'gap_passkey_entry_request_cb'):
+            self.dongle.__dict__.pop(nome_cb, None)
+        self.dongle.remove_signal_listener(self._segnalato)
+        for iscritti in self._iscritti.values():
+            for flusso in list(iscritti):
+                flusso.close()
+        self.dongle.close()
+
+
+def _coroutine(nome):
+    oper = getattr(cy.CY567x, nome).operazione
+
+    async def metodo(self, *args, **kwargs):
+        return await self._esegui(oper(self.dongle, *args, **kwargs))
+
+    metodo.__name__ = nome
+    metodo.__qualname__ = 'AsyncCY567x.' + nome
+    metodo.__doc__ = oper.__doc__
+    return metodo
+
+
+for _nome, _metodo in list(vars(cy.CY567x).items()):
+    if hasattr(_metodo, 'operazione'):
+        setattr(AsyncCY567x, _nome, _coroutine(_nome))
+
+
+if __name__ == '__main__':
+
+    async def main():
+        dongle = cy.CY567x()
+        if not dongle.is_ok():
+            print('uart error')
+            return
+
+        acy = AsyncCY567x(dongle)
+        print('init: ' + str(await acy.init_ble_stack()))
+
+        adv = acy.adverts()
+        print('start: ' + str(await acy.scan_start()))
+        try:
+            while True:
+                print(await asyncio.wait_for(adv.__anext__(), 5))
+        except asyncio.TimeoutError:
+            pass
+        adv.close()
+        print('stop: ' + str(await acy.scan_stop()))
+
+        acy.close()
+
+    asyncio.run(main())
@@ -0,0 +1,250 @@
+"""
+Binary capture of the traffic of the dongle
+
+The file starts with TESTA (magic, epoch and monotonic time of the start,
+both in ns), then a record for every RX chunk and TX frame:
+    u64 monotonic ns, u8 direction, u32 size, the bytes
+"""
+import mmap
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+
+import utili
+
+MAGIA = b'CYCAP001'
+TESTA = struct.Struct('<8sQQ')
+RECORD = struct.Struct('<QBI')
+
+# direction
+RX = 0
+TX = 1
+
+
+def nome_file(nome, indice):
+    """
+    the files of a capture: nome.0000, nome.0001, ...
+    :param nome: name of the capture
+    :param indice: number of the rotation
+    :return: string
+    """
+    return '{}.{:04d}'.format(nome, indice)
+
+
+class CATTURA(threading.Thread):
+    """
+    Who has the data only puts them in a queue: a thread packs the
+    records and writes them with a buffered file, opening a new
+    file when the current one exceeds dim_max
+    The dongle never waits: when the queue is full, or after an error
+    of the file (the capture stops), the records are dropped and counted
+    """
+
+    def __init__(self, nome, dim_max=64 * 1024 * 1024, file_max=None, tampone=1024 * 1024,
+                 coda_max=100000, logga=False):
+        """
+        :param nome: name of the capture (see nome_file)
+        :param dim_max: size of a file before the rotation
+        :param file_max: how many files to keep (None: all)
+        :param tampone: size of the buffer of the file
+        :param coda_max: records waiting for the thread
+        :param logga: bool
+        """
+        threading.Thread.__init__(self, daemon=True)
+
+        if logga:
+            self.diario = utili.LOGGA('cattura')
+        else:
+            self.diario = utili.LOGGA()
+
+        self.nome = nome
+        self.dim_max = dim_max
+        self.file_max = file_max
+        self.tampone = tampone
+
+        self.contatori = {'record': 0, 'byte': 0, 'file': 0, 'persi': 0}
+        # the records are dropped by the dongle and by the thread
+        self._mutex = threading.Lock()
+
+        # False after an error of the file
+        self.attiva = True
+
+        self._coda = queue.Queue(coda_max)
+        self._file = None
+        self._dim = 0
+        self._indice = 0
+
+        self._apri()
+        self.start()
+
+    def rx(self, dati):
+        """
+        bytes received from the dongle
+        :param dati: bytes (not modified later)
+        :return: n.a.
+        """
+        self._metti((time.monotonic_ns(), RX, dati))
+
+    def tx(self, dati):
+        """
+        bytes sent to the dongle
+        :param dati: bytes (not modified later)
+        :return: n.a.
+        """
+        self._metti((time.monotonic_ns(), TX, dati))
+
+    def _metti(self, elem):
+        if self.attiva:
+            try:
+                self._coda.put_nowait(elem)
+                return
+            except queue.Full:
+                pass
+        self._perso()
+
+    def _perso(self):
+        with self._mutex:
+            self.contatori['persi'] += 1
+
+    def _guasto(self, err):
+        # the records that follow are dropped
+        self.diario.error('{}: {!r}'.format(self.nome, err))
+        self.attiva = False
+        try:
+            self._file.close()
+        except OSError:
+            pass
+        self._file = None
+
+    def _apri(self):
+        if self._file is not None:
+            self._file.close()
+            self._indice += 1
+            if self.file_max is not None and self._indice >= self.file_max:
+                try:
+                    os.remove(nome_file(self.nome, self._indice - self.file_max))
+                except OSError:
+                    pass
+
+        self._file = open(nome_file(self.nome, self._indice), 'wb', buffering=self.tampone)
+        self._file.write(TESTA.pack(MAGIA, time.time_ns(), time.monotonic_ns()))
+        self._dim = TESTA.size
+        self.contatori['file'] += 1
+
+    def run(self):
+        fine = False
+        while not fine:
+            # everything that is in the queue in one go
+            lotto = [self._coda.get()]
+            while True:
+                try:
+                    lotto.append(self._coda.get_nowait())
+                except queue.Empty:
+                    break
+
+            for elem in lotto:
+                if elem is None:
+                    fine = True
+                    break
+
+                if not self.attiva:
+                    self._perso()
+                    continue
+
+                quando, verso, dati = elem
+                try:
+                    if self._dim >= self.dim_max:
+                        self._apri()
+
+                    self._file.write(RECORD.pack(quando, verso, len(dati)))
+                    self._file.write(dati)
+                except OSError as err:
+                    self._guasto(err)
+                    self._perso()
+                    continue
+                dim = RECORD.size + len(dati)
+                self._dim += dim
+                self.contatori['record'] += 1
+                self.contatori['byte'] += dim
+
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError as err:
+                self.diario.error('{}: {!r}'.format(self.nome, err))
+            self._file = None
+
+    def close(self):
+        """
+        write what is pending and close the file
+        :return: n.a.
+        """
+        if self.is_alive():
+            # the thread always empties the queue, even after an error
+            self._coda.put(None)
+            self.join()
+        self.attiva = False
+
+
+def leggi(nomefile):
+    """
+    the records of a file of a capture
+    :param nomefile: name of the file
+    :return: generator of (epoch ns, direction, bytes)
+    """
+    with open(nomefile, 'rb') as ing:
+        if os.fstat(ing.fileno()).st_size < TESTA.size:
+            return
+        with mmap.mmap(ing.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            magia, epoca, inizio = TESTA.unpack_from(mm)
+            if magia != MAGIA:
+                raise ValueError(nomefile + ' is not a capture')
+            # from monotonic to epoch
+            delta = epoca - inizio
+
+            pos = TESTA.size
+            fine = len(mm)
+            while pos + RECORD.size <= fine:
+                quando, verso, dim = RECORD.unpack_from(mm, pos)
+                pos += RECORD.size
+                if pos + dim > fine:
+                    # truncated by a crash
+                    break
+                yield quando + delta, verso, mm[pos:pos + dim]
+                pos += dim
+
+
+def file_della_cattura(nome):
+    """
+    the files of a capture that are on the disk, in order
+    :param nome: name of the capture
+    :return: list of string
+    """
+    cartella = os.path.dirname(nome) or '.'
+    base = os.path.basename(nome) + '.'
+    lista = []
+    for elem in os.listdir(cartella):
+        if elem.startswith(base) and elem[len(base):].isdigit():
+            lista.append(os.path.join(os.path.dirname(nome), elem))
+    return sorted(lista)
+
+
+if __name__ == '__main__':
+    from cyproto import PROTO_RX, PROTO_TX
+
+    if len(sys.argv) == 2:
+        CY_RX = PROTO_RX()
+        CY_TX = PROTO_TX()
+
+        for nf in file_della_cattura(sys.argv[1]):
+            for ns, vrs, bts in leggi(nf):
+                tempo = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ns // 1000000000))
+                tempo += ',{:03d} '.format((ns // 1000000) % 1000)
+                proto = CY_RX if vrs == RX else CY_TX
+                for msg in proto.iter_msgs(bts):
+                    print(tempo + proto.msg_to_string(msg))
+    else:
+        print('Passare il nome della cattura')
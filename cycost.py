@@ -190,6 +190,45 @@ DESC_EVN = {
     EVT_CBFC_DATA_WRITE_INDICATION: 'EVT_CBFC_DATA_WRITE_INDICATION',
 }
 
+# Layout of the events: struct format and names of the fixed part of the
+# parameters (what follows is left to the handler, cfr cyproto.FRAME.tail)
+# Add a line here to have an event decoded
+EVT_LAYOUT = {
+    EVT_COMMAND_STATUS: ('<2H', ('cmd', 'status')),
+    EVT_COMMAND_COMPLETE: ('<2H', ('cmd', 'status')),
+    EVT_REPORT_STACK_MISC_STATUS: ('<2H', ('event', 'dim')),
+    EVT_GET_RSSI_RESPONSE: ('<H', ('cmd',)),
+    EVT_GET_TX_POWER_RESPONSE: ('<H', ('cmd',)),
+    EVT_DISCOVER_ALL_PRIMARY_SERVICES_RESULT_PROGRESS: ('<2H', ('cmd', 'conn')),
+    EVT_DISCOVER_PRIMARY_SERVICES_BY_UUID_RESULT_PROGRESS: ('<4H', ('cmd', 'conn', 'starth', 'endh')),
+    EVT_DISCOVER_ALL_CHARACTERISTICS_RESULT_PROGRESS: ('<2H', ('cmd', 'conn')),
+    EVT_DISCOVER_CHARACTERISTICS_BY_UUID_RESULT_PROGRESS: ('<2H', ('cmd', 'conn')),
+    EVT_DISCOVER_ALL_CHARACTERISTIC_DESCRIPTORS_RESULT_PROGRESS: ('<2H', ('cmd', 'conn')),
+    EVT_READ_CHARACTERISTIC_VALUE_RESPONSE: ('<3H', ('cmd', 'conn', 'dim')),
+    EVT_READ_LONG_CHARACTERISTIC_VALUE_RESPONSE: ('<3H', ('cmd', 'conn', 'dim')),
+    EVT_READ_CHARACTERISTIC_DESCRIPTOR_RESPONSE: ('<3H', ('cmd', 'conn', 'dim')),
+    EVT_CHARACTERISTIC_VALUE_NOTIFICATION: ('<3H', ('conn', 'attr', 'dim')),
+    EVT_CHARACTERISTIC_VALUE_INDICATION: ('<4H', ('conn', 'attr', 'result', 'dim')),
+    EVT_GATT_ERROR_NOTIFICATION: ('<2HBHB', ('cmd', 'conn', 'pdu', 'attr', 'error')),
+    EVT_EXCHANGE_GATT_MTU_SIZE_RESPONSE: ('<3H', ('cmd', 'conn', 'mtu')),
+    EVT_GET_BLUETOOTH_DEVICE_ADDRESS_RESPONSE: ('<H', ('cmd',)),
+    EVT_GET_CONNECTION_PARAMETERS_RESPONSE: ('<H', ('cmd',)),
+    EVT_GET_SCAN_PARAMETERS_RESPONSE: ('<H', ('cmd',)),
+    EVT_SCAN_PROGRESS_RESULT: ('<H', ('cmd',)),
+    EVT_PASSKEY_ENTRY_REQUEST: ('<2H', ('cmd', 'conn')),
+    EVT_ESTABLISH_CONNECTION_RESPONSE: ('<2H', ('cmd', 'conn')),
+    EVT_CONNECTION_TERMINATED_NOTIFICATION: ('<HB', ('conn', 'reason')),
+    EVT_SCAN_STOPPED_NOTIFICATION: ('<', ()),
+    EVT_PAIRING_REQUEST_RECEIVED_NOTIFICATION:
+        ('<H5B', ('conn', 'security', 'bonding', 'ekeySize', 'authErr', 'pairingProperties')),
+    EVT_AUTHENTICATION_ERROR_NOTIFICATION: ('<2HB', ('cmd', 'conn', 'reason')),
+    EVT_DATA_LENGTH_CHANGED_NOTIFICATION:
+        ('<5H', ('conn', 'connMaxTxOctets', 'connMaxTxTime', 'connMaxRxOctets', 'connMaxRxTime')),
+    EVT_ENHANCED_CONNECTION_COMPLETE: ('<HBHB', ('cmd', 'status', 'conn', 'role')),
+    EVT_NEGOTIATED_PAIRING_PARAMETERS:
+        ('<H6B', ('conn', 'reason', 'security', 'bonding', 'ekeySize', 'authErr', 'pairingProperties')),
+}
+
 # CySmt_protocol.c
 # ====================================================================
 
@@ -301,6 +340,42 @@ GRUPPO_5 = (
     'Cmd_GenerateSecuredConnectionOobData_Api',
 )
 
+_GRUPPI = {
+    0: GRUPPO_0,
+    2: GRUPPO_2,
+    4: GRUPPO_4,
+    5: GRUPPO_5
+}
+
+# Layout of the parameters of the commands (struct format): variable data
+# (e.g. the value to write) follows. Commands not listed have no parameters
+CMD_LAYOUT = {
+    'Cmd_Get_TxPowerLevel_Api': '<B',
+    'Cmd_Set_TxPowerLevel_Api': '<BB',
+    'Cmd_Get_Bluetooth_Device_Address_Api': '<B',
+    'Cmd_Set_Connection_Parameters_Api': '<HHB6sBBHHHHHH',
+    'Cmd_Set_Scan_Parameters_Api': '<BBHHBBHB',
+    'Cmd_Set_Local_Device_Security_Api': '<6B',
+    'Cmd_Set_Device_Io_Capabilities_Api': '<B',
+    'Cmd_Establish_Connection_Api': '<6sB',
+    'Cmd_Terminate_Connection_Api': '<H',
+    'Cmd_Initiate_Pairing_Request_Api': '<H',
+    'Cmd_Pairing_PassKey_Api': '<HIB',
+    'Cmd_Discover_All_Primary_Services_Api': '<H',
+    'Cmd_Discover_Primary_Services_By_Uuid_Api': '<HB16s',
+    'Cmd_Discover_All_Characteristics_Api': '<3H',
+    'Cmd_Discover_Characteristics_By_Uuid_Api': '<HB16s2H',
+    'Cmd_Discover_All_Characteristic_Descriptors_Api': '<3H',
+    'Cmd_Read_Characteristic_Value_Api': '<2H',
+    'Cmd_Read_Long_Characteristic_Values_Api': '<3H',
+    'Cmd_Read_Characteristic_Descriptor_Api': '<2H',
+    'Cmd_Characteristic_Value_Write_Without_Response_Api': '<3H',
+    'Cmd_Write_Characteristic_Value_Api': '<3H',
+    'Cmd_Write_Long_Characteristic_Value_Api': '<4H',
+    'Cmd_Write_Characteristic_Descriptor_Api': '<3H',
+    'Cmd_Exchange_GATT_MTU_Size_Api': '<2H',
+}
+
 CYBLE_GATT_PDU_T = {
     1: 'CYBLE_GATT_ERROR_RSP',
     2: 'CYBLE_GATT_XCNHG_MTU_REQ',
@@ -379,18 +454,20 @@ CHAR_PROP = {
 }
 
 
-def quale_comando(cmd):
+def nome_comando(cmd):
     gruppo = (cmd >> 7) & 7
     comando = cmd & 0x7F
+    try:
+        return _GRUPPI[gruppo][comando]
+    except (KeyError, IndexError):
+        return None
+
+
+def quale_comando(cmd):
     funz = '{:04X}'.format(cmd)
-    if gruppo == 0:
-        funz = GRUPPO_0[comando] + ' ' + funz
-    elif gruppo == 2:
-        funz = GRUPPO_2[comando] + ' ' + funz
-    elif gruppo == 4:
-        funz = GRUPPO_4[comando] + ' ' + funz
-    elif gruppo == 5:
-        funz = GRUPPO_5[comando] + ' ' + funz
+    nome = nome_comando(cmd)
+    if nome is not None:
+        funz = nome + ' ' + funz
     return funz
 
 
@@ -0,0 +1,179 @@
+"""
+Runs the callbacks of CY567x out of the thread of the dongle:
+CY567x(esecutore=cyesecutore.ESECUTORE()) only puts them in a ring,
+so a slow callback does not delay the commands
+"""
+import collections
+import threading
+
+import utili
+
+# what to do when a ring is full
+DROP_OLDEST = 'DROP OLDEST'
+DROP_NEWEST = 'DROP NEWEST'
+BLOCK = 'BLOCK'
+
+# event classes -> (size of the ring, policy)
+CLASSI = {
+    # advertisements: the last ones are the interesting ones
+    'scan': (1024, DROP_OLDEST),
+    # notifications and indications: they are data, nothing is lost
+    'ntf': (4096, BLOCK),
+    # authentication, passkey, disconnection: few and important
+    'gap': (64, BLOCK),
+}
+
+
+class ESECUTORE:
+    """
+    A bounded ring for every event class, drained by lavoratori threads
+    With one thread the callbacks run in the order of the events; with
+    more, the ones of the same class can run at the same time
+    With BLOCK the thread of the dongle waits for room: a callback that
+    waits for a command must not fill its ring
+    """
+
+    def __init__(self, classi=None, lavoratori=1, logga=False):
+        """
+        :param classi: dict class -> (size, policy) that updates CLASSI
+        :param lavoratori: number of threads
+        :param logga: bool
+        """
+        if logga:
+            self.diario = utili.LOGGA('esecutore')
+        else:
+            self.diario = utili.LOGGA()
+
+        config = dict(CLASSI)
+        if classi is not None:
+            config.update(classi)
+        for dim, politica in config.values():
+            if dim < 1 or politica not in (DROP_OLDEST, DROP_NEWEST, BLOCK):
+                raise utili.Problema('wrong class ({}, {})'.format(dim, politica))
+
+        self.classi = config
+        self._code = {_: collections.deque() for _ in config}
+        # round robin among the classes
+        self._ordine = list(config)
+        self._turno = 0
+
+        # class -> counters
+        self.contatori = {
+            _: {'accodati': 0, 'persi': 0, 'eseguiti': 0, 'errori': 0, 'massimo': 0}
+            for _ in config
+        }
+
+        self._mutex = threading.Lock()
+        self._lavoro = threading.Condition(self._mutex)
+        self._spazio = threading.Condition(self._mutex)
+        self._vuoto = threading.Condition(self._mutex)
+        # callbacks running
+        self._attivi = 0
+        self._fine = False
+
+        self._lavoratori = [
+            threading.Thread(target=self._lavora, daemon=True, name='esecutore{}'.format(_))
+            for _ in range(lavoratori)]
+        for thd in self._lavoratori:
+            thd.start()
+
+    def esegui(self, classe, funz, *args):
+        """
+        put a callback in the ring of its class
+        :param classe: key of CLASSI
+        :param funz: callable
+        :param args: its arguments (the caller does not modify them anymore)
+        :return: bool (False if dropped)
+        """
+        dim, politica = self.classi[classe]
+        contatori = self.contatori[classe]
+        coda = self._code[classe]
+        with self._mutex:
+            if self._fine:
+                contatori['persi'] += 1
+                return False
+
+            if len(coda) >= dim:
+                if politica == DROP_NEWEST:
+                    contatori['persi'] += 1
+                    return False
+                if politica == DROP_OLDEST:
+                    coda.popleft()
+                    contatori['persi'] += 1
+                else:
+                    while len(coda) >= dim and not self._fine:
+                        self._spazio.wait()
+                    if self._fine:
+                        contatori['persi'] += 1
+                        return False
+
+            coda.append((funz, args))
+            contatori['accodati'] += 1
+            if len(coda) > contatori['massimo']:
+                contatori['massimo'] = len(coda)
+            self._lavoro.notify()
+        return True
+
+    def _prossimo(self):
+        # under mutex: the first class, after the last served, with something to do
+        for _ in range(len(self._ordine)):
+            classe = self._ordine[self._turno]
+            self._turno = (self._turno + 1) % len(self._ordine)
+            if self._code[classe]:
+                return classe
+        return None
+
+    def _lavora(self):
+        while True:
+            with self._mutex:
+                classe = self._prossimo()
+                while classe is None:
+                    if self._fine:
+                        return
+                    self._lavoro.wait()
+                    classe = self._prossimo()
+                funz, args = self._code[classe].popleft()
+                self._attivi += 1
+                self._spazio.notify()
+
+            try:
+                funz(*args)
+                esito = 'eseguiti'
+            except Exception as err:  # pylint: disable=broad-except
+                # a wrong callback must not stop the worker
+                self.diario.error('{}: {!r}'.format(classe, err))
+                esito = 'errori'
+
+            with self._mutex:
+                self.contatori[classe][esito] += 1
+                self._attivi -= 1
+                self._vuoto.notify_all()
+
+    def in_coda(self):
+        """
+        :return: dict class -> callbacks waiting
+        """
+        with self._mutex:
+            return {_: len(self._code[_]) for _ in self._code}
+
+    def svuota(self, to=None):
+        """
+        wait for the callbacks already in the rings
+        :param to: timeout in seconds (None: forever)
+        :return: bool (False if to expires)
+        """
+        with self._mutex:
+            return self._vuoto.wait_for(
+                lambda: self._attivi == 0 and not any(self._code.values()), to)
+
+    def close(self):
+        """
+        run what is in the rings and stop the threads
+        :return: n.a.
+        """
+        with self._mutex:
+            self._fine = True
+            self._lavoro.notify_all()
+            self._spazio.notify_all()
+        for thd in self._lavoratori:
+            thd.join()
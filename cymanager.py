@@ -0,0 +1,239 @@
+"""
+Serves all the CY5677 plugged into the pc from one thread
+and leases them to the jobs
+"""
+import contextlib
+import os
+import queue
+import selectors
+import threading
+import time
+
+import CY567x
+import utili
+
+# CY5677
+VID = 0x04B4
+PID = 0xF139
+
+
+def find_dongles(vid=VID, pid=PID):
+    """
+    the serial ports of the dongles
+    :param vid: usb vendor id
+    :param pid: usb product id
+    :return: list of string
+    """
+    porte = []
+    for porta, desc in utili.lista_seriali().items():
+        if len(desc) == 4 and desc[2] == vid and desc[3] == pid:
+            porte.append(porta)
+    return sorted(porte)
+
+
+class DongleManager(threading.Thread):
+    """
+    Opens the dongles and serves them with one thread (a selector
+    on the serial ports and on the doorbells of the dongles)
+    The dongles are leased to one job at a time
+    A dongle that raises is not served (nor leased) anymore, the others are
+    """
+
+    def __init__(self, porte=None, classe=CY567x.CY567x, logga=False, **kwargs):
+        """
+        :param porte: serial ports (None: find_dongles())
+        :param classe: CY567x or a subclass (its __init__ must accept
+                       gestore and give it to CY567x.__init__)
+        :param logga: bool
+        :param kwargs: for classe
+        """
+        threading.Thread.__init__(self, daemon=True)
+
+        if logga:
+            self.diario = utili.LOGGA('DongleManager')
+        else:
+            self.diario = utili.LOGGA()
+
+        self._selettore = selectors.DefaultSelector()
+        # dongles to (un)register, managed by the thread
+        self._nuovi = queue.Queue()
+        self._campanello = os.pipe()
+        os.set_blocking(self._campanello[0], False)
+        os.set_blocking(self._campanello[1], False)
+        self._selettore.register(self._campanello[0], selectors.EVENT_READ, (None, None))
+
+        self.start()
+
+        if porte is None:
+            porte = find_dongles()
+
+        self.dongle = []
+        self._liberi = queue.Queue()
+        # the ones that raised (cfr _guasto)
+        self._rotti = set()
+        for porta in porte:
+            dongle = classe(porta=porta, gestore=self, logga=logga, **kwargs)
+            if dongle.is_ok():
+                self.dongle.append(dongle)
+                self._liberi.put_nowait(dongle)
+            else:
+                self.diario.error('cannot open ' + porta)
+
+    def _suona(self):
+        try:
+            os.write(self._campanello[1], b'\x00')
+        except BlockingIOError:
+            pass
+
+    def add(self, dongle):
+        """
+        serve a dongle (called by CY567x)
+        :param dongle: CY567x
+        :return: n.a.
+        """
+        self._nuovi.put_nowait(dongle)
+        self._suona()
+
+    def _registra(self):
+        while True:
+            try:
+                dongle = self._nuovi.get_nowait()
+            except queue.Empty:
+                return True
+
+            if dongle is None:
+                return False
+
+            self._selettore.register(dongle.uart.fileno(), selectors.EVENT_READ, (dongle, 'uart'))
+            self._selettore.register(dongle.command['campanello'][0], selectors.EVENT_READ,
+                                     (dongle, 'campanello'))
+
+    def _togli(self, dongle):
+        for chiave in list(self._selettore.get_map().values()):
+            if chiave.data[0] is dongle:
+                self._selettore.unregister(chiave.fileobj)
+
+    def _guasto(self, dongle, err):
+        # only this dongle is not served anymore
+        self.diario.error('{}: {!r}'.format(dongle.uart.port, err))
+        self._togli(dongle)
+        try:
+            dongle.goodbye()
+        except Exception as err2:  # pylint: disable=broad-except
+            self.diario.error('{}: {!r}'.format(dongle.uart.port, err2))
+        # lease() skips it, release() does not give it back
+        self._rotti.add(dongle)
+        # close() must not wait for it
+        dongle.fermo.set()
+
+    def run(self):
+        while True:
+            toccati = {}
+            for chiave, _ in self._selettore.select():
+                dongle, cosa = chiave.data
+                if dongle is None:
+                    os.read(self._campanello[0], 512)
+                    if not self._registra():
+                        return
+                    continue
+                if dongle in toccati and toccati[dongle] is None:
+                    # failed with its other file
+                    continue
+                try:
+                    if cosa == 'campanello':
+                        dongle.bell_rung()
+                    elif not dongle.uart_ready():
+                        self._selettore.unregister(chiave.fileobj)
+                    toccati[dongle] = True
+                except Exception as err:  # pylint: disable=broad-except
+                    self._guasto(dongle, err)
+                    toccati[dongle] = None
+
+            for dongle, buono in toccati.items():
+                if buono is None:
+                    continue
+                try:
+                    if not dongle.work():
+                        self._togli(dongle)
+                        dongle.goodbye()
+                except Exception as err:  # pylint: disable=broad-except
+                    self._guasto(dongle, err)
+
+    def lease(self, to=None):
+        """
+        take an idle dongle
+        :param to: timeout (None: wait forever)
+        :return: CY567x or None
+        """
+        limite = None if to is None else time.monotonic() + to
+        while True:
+            attesa = None if limite is None else max(0.0, limite - time.monotonic())
+            try:
+                dongle = self._liberi.get(True, attesa)
+            except queue.Empty:
+                return None
+            if dongle not in self._rotti:
+                return dongle
+
+    def release(self, dongle):
+        """
+        give back a dongle taken with lease
+        :param dongle: CY567x
+        :return: n.a.
+        """
+        if dongle not in self._rotti:
+            self._liberi.put_nowait(dongle)
+
+    @contextlib.contextmanager
+    def leased(self, to=None):
+        """
+        with manager.leased() as dongle:
+            ...
+        :param to: timeout (None: wait forever)
+        :return: CY567x or None
+        """
+        dongle = self.lease(to)
+        try:
+            yield dongle
+        finally:
+            if dongle is not None:
+                self.release(dongle)
+
+    def close(self):
+        """
+        close the dongles and stop the thread
+        :return: n.a.
+        """
+        for dongle in self.dongle:
+            dongle.close()
+        self.dongle = []
+
+        self._nuovi.put_nowait(None)
+        self._suona()
+        self.join()
+
+        self._selettore.close()
+        os.close(self._campanello[0])
+        os.close(self._campanello[1])
+
+
+if __name__ == '__main__':
+    import time
+
+    GESTORE = DongleManager()
+    print('dongles: ' + str([_.uart.port for _ in GESTORE.dongle]))
+
+    def scansiona(indice):
+        with GESTORE.leased() as dongle:
+            print('{} init: {}'.format(indice, dongle.init_ble_stack()))
+            print('{} start: {}'.format(indice, dongle.scan_start()))
+            time.sleep(5)
+            print('{} stop: {}'.format(indice, dongle.scan_stop()))
+
+    LAVORI = [threading.Thread(target=scansiona, args=(_,)) for _ in range(len(GESTORE.dongle))]
+    for _ in LAVORI:
+        _.start()
+    for _ in LAVORI:
+        _.join()
+
+    GESTORE.close()
@@ -1,10 +1,82 @@
 """
 Collects classes for the CY5677 dongle
 """
+import collections
 import struct
 
 import utili
-from cycost import quale_evento, quale_comando
+from cycost import quale_evento, quale_comando, nome_comando, EVT_LAYOUT, CMD_LAYOUT
+
+
+class FRAME:
+    """
+    An event received from the dongle: the parameters are a view
+    of the buffer framed by PROTO.examine (no copies)
+    The events listed in cycost.EVT_LAYOUT are specializations
+    that have the fields of the layout as attributes
+    """
+    __slots__ = ('evn', 'prm')
+
+    # fixed part of the parameters
+    _layout = None
+    campi = ()
+
+    def __init__(self, evn, prm):
+        self.evn = evn
+        self.prm = prm
+        if self._layout is not None:
+            for campo, val in zip(self.campi, self._layout.unpack_from(prm)):
+                setattr(self, campo, val)
+
+    @property
+    def tail(self):
+        """
+        the parameters after the fixed part
+        :return: memoryview
+        """
+        if self._layout is None:
+            return self.prm
+        return self.prm[self._layout.size:]
+
+    def __repr__(self):
+        risul = quale_evento(self.evn)
+        for campo in self.campi:
+            val = getattr(self, campo)
+            if isinstance(val, int):
+                risul += ' {}={:04X}'.format(campo, val)
+            else:
+                risul += ' {}={}'.format(campo, val)
+        coda = self.tail
+        if len(coda):
+            risul += ' [{}]: '.format(len(coda)) + utili.stringa_da_ba(coda, ' ')
+        return risul
+
+
+def _compila_eventi():
+    eventi = {}
+    for evn, (fmt, campi) in EVT_LAYOUT.items():
+        eventi[evn] = type(
+            quale_evento(evn), (FRAME,), {
+                '__slots__': campi,
+                '_layout': struct.Struct(fmt),
+                'campi': campi
+            })
+    return eventi
+
+
+def _compila_comandi():
+    comandi = {}
+    for nome, fmt in CMD_LAYOUT.items():
+        # header, command, parameters length + parameters
+        comandi[nome] = struct.Struct('<3H' + fmt[1:])
+    return comandi
+
+
+# event code -> FRAME
+_EVENTI = _compila_eventi()
+
+# command name -> layout of the whole command
+_COMANDI = _compila_comandi()
 
 
 class PROTO:
@@ -12,6 +84,9 @@ class PROTO:
     Knows the communication protocol of CY5677 dongle
     """
 
+    # length field
+    _U16 = struct.Struct('<H')
+
     def _print(self, msg):
         if self.can_print:
             print(msg)
@@ -26,50 +101,20 @@ class PROTO:
         self.second = secondo
 
         # messages are stored here (without header)
-        self.msg_list = []
-
-        # protocol state
-        self.partial = bytearray()
-
-        self.dim = -1
-        self.stati = {
-            0: self._stato_0,
-            1: self._stato_1,
-            2: self._stato_2,
-            3: self._stato_3
-        }
-        self.stato = 0
-
-    def _stato_0(self, rx):
-        if rx == self.first:
-            self.stato = 1
-
-    def _stato_1(self, rx):
-        if rx == self.second:
-            self.stato = 2
-        else:
-            if len(self.partial):
-                self._print(
-                    '_stato_1 elimino {}'.format(
-                        utili.stringa_da_ba(
-                            self.partial, '-')))
-            self.reinit()
-
-    def _stato_2(self, rx):
-        self.partial.append(rx)
-        if len(self.partial) == 2:
-            self.dim = 2 + struct.unpack('<H', self.partial)[0]
-            self.stato = 3
-
-    def _stato_3(self, rx):
-        self.partial.append(rx)
-        if len(self.partial) == self.dim:
-            self.dim = -1
-            self.check_packet(False)
-
-    def _dim_pkt(self):
-        tot, _ = struct.unpack('<2H', self.partial[:4])
-        return tot + 2
+        self.msg_list = collections.deque()
+
+        # bytes received but not yet framed (a message starts here)
+        self.partial = b''
+
+    def _dim_pkt(self, buf, ofs):
+        """
+        size of the message (without header): the length comes first and
+        counts the two bytes that follow it (PROTO_TX overrides this)
+        :param buf: received bytes
+        :param ofs: where the message starts (at least 4 bytes are available)
+        :return: int
+        """
+        return self._U16.unpack_from(buf, ofs)[0] + 2
 
     def who_are_you(self):
         """
@@ -81,13 +126,26 @@ class PROTO:
     def get_msg(self):
         """
         retrieve a message if present
-        :return: a bytearray or None
+        :return: a memoryview or None
         """
-        if any(self.msg_list):
-            return self.msg_list.pop(0)
+        if self.msg_list:
+            return self.msg_list.popleft()
 
         return None
 
+    def iter_msgs(self, questi=None):
+        """
+        retrieve the messages in a single pass
+        :param questi: bytes to examine before (optional)
+        :return: generator of memoryview
+        """
+        if questi is not None:
+            self.examine(questi)
+
+        msg_list = self.msg_list
+        while msg_list:
+            yield msg_list.popleft()
+
     def msg_to_string(self, cosa):
         """
         convert the message to a human readable string: override this
@@ -96,44 +154,64 @@ class PROTO:
         """
 
     # Packet analysis
-    def reinit(self, start=False):
+    def reinit(self):
         """
         Come back to the initial state
         :return: n.a.
         """
-        self.partial = bytearray()
-        if start:
-            # the first byte is arrived
-            self.stato = 1
-        else:
-            self.stato = 0
-
-    def check_packet(self, start=False):
-        def empty_partial():
-            # a new packet starts
-            if len(self.partial):
-                self._print('scarto ' + utili.stringa_da_ba(self.partial, '-'))
-                self.reinit(True)
-
-        if len(self.partial) >= 4:
-            tot = self._dim_pkt()
-            if tot == len(self.partial):
-                # got it!
-                self.msg_list.append(bytearray(self.partial))
-
-                self.reinit(start)
-            elif start:
-                empty_partial()
-            else:
-                pass
-        elif start:
-            empty_partial()
+        self.partial = b''
 
     def examine(self, questi):
-        for cosa in questi:
-            self.stati[self.stato](cosa)
-
-        self.check_packet()
+        """
+        extract the messages from the received bytes
+        every call copies the chunk (after what was left by the previous one)
+        in a new buffer: the messages are views of it, that is never modified
+        :param questi: bytes (a chunk of the stream)
+        :return: n.a.
+        """
+        if len(self.partial):
+            buf = self.partial + questi
+        else:
+            buf = bytes(questi)
+        vista = memoryview(buf)
+        dim = len(buf)
+
+        pos = 0
+        while True:
+            ini = buf.find(self.first, pos)
+            if ini < 0:
+                pos = dim
+                break
+            if ini + 1 == dim:
+                # the second byte of the header will come
+                pos = ini
+                break
+            if buf[ini + 1] != self.second:
+                # both are discarded
+                pos = ini + 2
+                continue
+            if ini + 2 + 4 > dim:
+                # the length will come
+                pos = ini
+                break
+
+            tot = self._dim_pkt(buf, ini + 2)
+            if tot < 4:
+                self._print(self.name + ' scarto ' + utili.stringa_da_ba(buf[ini:ini + 6], '-'))
+                pos = ini + 2
+                continue
+
+            fine = ini + 2 + tot
+            if fine > dim:
+                # the rest will come
+                pos = ini
+                break
+
+            # got it!
+            self.msg_list.append(vista[ini + 2:fine])
+            pos = fine
+
+        self.partial = buf[pos:]
 
 
 class PROTO_RX(PROTO):
@@ -141,36 +219,44 @@ class PROTO_RX(PROTO):
     specialization for messages received from CY5677
     """
 
+    # length, event
+    _EVN = struct.Struct('<2H')
+
     def __init__(self):
         PROTO.__init__(self, 'RX', 0xBD, 0xA7)
 
     def decompose(self, cosa):
         """
         extract event and parameters from a message
-        :param cosa: bytearray (message)
-        :return: dictionary with 'evn', 'prm' (or empty)
+        :param cosa: memoryview (message)
+        :return: FRAME (or a specialization) or None
         """
-        msg = {}
         if len(cosa) >= 4:
-            tot, evn = struct.unpack('<2H', cosa[:4])
-            prm = cosa[4:]
+            tot, evn = self._EVN.unpack_from(cosa)
             tot -= 2
 
-            if tot != len(prm):
-                self._print(self.name +
-                            ' ERR DIM {:04X}[{} != {}]: '.format(evn, tot, len(
-                                prm)) + utili.stringa_da_ba(prm, ' '))
-            else:
-                msg['evn'] = evn
-                msg['prm'] = prm
+            if tot != len(cosa) - 4:
+                if self.can_print:
+                    self._print(self.name +
+                                ' ERR DIM {:04X}[{} != {}]: '.format(evn, tot, len(
+                                    cosa) - 4) + utili.stringa_da_ba(cosa[4:], ' '))
+                return None
 
+            if self.can_print:
                 self._print(
                     self.name +
                     ' {:04X}[{}]: '.format(evn, tot) +
-                    utili.stringa_da_ba(prm, ' '))
-        else:
+                    utili.stringa_da_ba(cosa[4:], ' '))
+            try:
+                return _EVENTI.get(evn, FRAME)(evn, cosa[4:])
+            except struct.error:
+                if self.can_print:
+                    self._print(self.name + ' ERR LAYOUT {:04X}'.format(evn))
+                return None
+
+        if self.can_print:
             self._print(self.name + ' ????: ' + utili.stringa_da_ba(cosa, ' '))
-        return msg
+        return None
 
     def msg_to_string(self, cosa):
         risul = self.name + ' '
@@ -204,25 +290,26 @@ class PROTO_TX(PROTO):
 
     _HEADER_CMD = 0x5943
 
+    # header, command, parameters length
+    _TESTA = struct.Struct('<3H')
+
     def __init__(self):
         PROTO.__init__(self, 'TX', 0x43, 0x59)
 
-    def _stato_2(self, rx):
-        self.partial.append(rx)
-        if len(self.partial) == 2:
-            self.stato = 3
+        # opcode -> layout of the command
+        self._layout = {}
 
-    def _stato_3(self, rx):
-        self.partial.append(rx)
-        if len(self.partial) == 4:
-            self.dim = struct.unpack('<H', self.partial[2:])[0]
-        elif len(self.partial) == self.dim:
-            self.dim = -1
-            self.check_packet(False)
+    def _layout_di(self, cod):
+        try:
+            return self._layout[cod]
+        except KeyError:
+            lay = _COMANDI.get(nome_comando(cod), self._TESTA)
+            self._layout[cod] = lay
+            return lay
 
-    def _dim_pkt(self):
-        _, tot = struct.unpack('<2H', self.partial[:4])
-        return tot + 4
+    def _dim_pkt(self, buf, ofs):
+        # command, parameters length
+        return self._U16.unpack_from(buf, ofs + 2)[0] + 4
 
     def msg_to_string(self, cosa):
         risul = self.name + ' '
@@ -246,14 +333,20 @@ class PROTO_TX(PROTO):
     def compose(self, cmd):
         """
         create a command to be sent to the dongle
-        :param cmd: dict with parameters
-        :return: bytearray
+        :param cmd: dict with 'cod', 'prm' (values for cycost.CMD_LAYOUT or None)
+                    and 'dati' (bytes that follow them or None)
+        :return: bytes
         """
-        dim = 0
-        if cmd['prm'] is not None:
-            dim = len(cmd['prm'])
-        msg = struct.pack('<3H', self._HEADER_CMD, cmd['cod'], dim)
-        if dim:
-            msg += cmd['prm']
-
-        return msg
+        cod = cmd['cod']
+        prm = cmd['prm']
+        if prm is None:
+            lay = self._TESTA
+            prm = ()
+        else:
+            lay = self._layout_di(cod)
+
+        dati = cmd['dati']
+        if dati is None:
+            return lay.pack(self._HEADER_CMD, cod, lay.size - self._TESTA.size, *prm)
+
+        return lay.pack(self._HEADER_CMD, cod, lay.size - self._TESTA.size + len(dati), *prm) + dati
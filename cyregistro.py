@@ -0,0 +1,182 @@
+"""
+Records the advertisements by column (CY567x.set_scan_recorder):
+one array per field and the data of all of them in one bytearray,
+so millions of advertisements take tens of bytes each
+"""
+import array
+import struct
+import sys
+import threading
+import time
+
+import numpy as np
+
+import utili
+
+# cfr Send_advt_report: the address as two integers
+_TESTA = struct.Struct('<BIHBbB')
+
+# column -> (typecode of array, dtype of numpy)
+COLONNE = {
+    # epoch, seconds
+    'tempo': ('d', np.float64),
+    # address as an integer (cfr stringa_da_bda)
+    'bda': ('Q', np.uint64),
+    'tipo_bda': ('B', np.uint8),
+    'adv': ('B', np.uint8),
+    'rssi': ('b', np.int8),
+    # where the data start in the arena
+    'inizio': ('Q', np.uint64),
+}
+
+
+def stringa_da_bda(bda):
+    """
+    :param bda: address as an integer (cfr REGISTRO)
+    :return: string "zz:..:xx"
+    """
+    return utili.stringa_da_mac(int(bda).to_bytes(6, 'little'))
+
+
+class REGISTRO:
+    """
+    Appends the fields of every advertisement to its column and the data
+    to the arena: the thread of the dongle appends, colonne() gives a copy
+    as numpy arrays to the others
+    """
+
+    def __init__(self, orologio=time.time):
+        """
+        :param orologio: seconds (the epoch by default)
+        """
+        self.orologio = orologio
+        self._colonne = {_: array.array(cod) for _, (cod, _dt) in COLONNE.items()}
+        self._arena = bytearray()
+        # numpy does not let an array grow while it is viewed
+        self._mutex = threading.Lock()
+
+    def __call__(self, rapporto):
+        """
+        :param rapporto: bytes, bytearray or memoryview (cfr Send_advt_report)
+        :return: n.a.
+        """
+        if len(rapporto) < _TESTA.size:
+            return
+        adv, basso, alto, tipo_bda, rssi, dim = _TESTA.unpack_from(rapporto)
+        col = self._colonne
+        with self._mutex:
+            col['tempo'].append(self.orologio())
+            col['bda'].append(basso | alto << 32)
+            col['tipo_bda'].append(tipo_bda)
+            col['adv'].append(adv)
+            col['rssi'].append(rssi)
+            col['inizio'].append(len(self._arena))
+            self._arena += rapporto[_TESTA.size:_TESTA.size + dim]
+
+    def __len__(self):
+        return len(self._colonne['tempo'])
+
+    def memoria(self):
+        """
+        :return: bytes used by the columns and by the arena
+        """
+        with self._mutex:
+            return len(self._arena) + sum(
+                len(_) * _.itemsize for _ in self._colonne.values())
+
+    def colonne(self):
+        """
+        a copy of what has been recorded
+        :return: dict of numpy arrays (cfr COLONNE), plus 'arena' (uint8)
+                 and 'fine' (where the data of each advertisement end)
+        """
+        with self._mutex:
+            risul = {
+                nome: np.frombuffer(self._colonne[nome], dtype=dtype).copy()
+                for nome, (_cod, dtype) in COLONNE.items()
+            }
+            risul['arena'] = np.frombuffer(self._arena, dtype=np.uint8).copy()
+        # each one ends where the next starts, the last one with the arena
+        fine = risul['inizio'].copy()
+        fine[:-1] = risul['inizio'][1:]
+        fine[-1:] = len(risul['arena'])
+        risul['fine'] = fine
+        return risul
+
+    def salva(self, nomefile):
+        """
+        everything in a .npz (cfr carica)
+        :param nomefile: name of the file
+        :return: n.a.
+        """
+        np.savez_compressed(nomefile, **self.colonne())
+
+
+def carica(nomefile):
+    """
+    :param nomefile: .npz saved by REGISTRO.salva
+    :return: dict of numpy arrays (cfr REGISTRO.colonne)
+    """
+    with np.load(nomefile) as npz:
+        return {_: npz[_] for _ in npz.files}
+
+
+def dati(col, indice):
+    """
+    the data of an advertisement
+    :param col: cfr REGISTRO.colonne
+    :param indice: of the advertisement
+    :return: bytes
+    """
+    return col['arena'][int(col['inizio'][indice]):int(col['fine'][indice])].tobytes()
+
+
+def dispositivi(col):
+    """
+    statistics of every address
+    :param col: cfr REGISTRO.colonne
+    :return: dict of numpy arrays (one element per address): bda, quanti,
+             primo, ultimo (seconds), ritmo (advertisements per second),
+             rssi_min, rssi_max, rssi_medio
+    """
+    if len(col['bda']) == 0:
+        vuoto = np.empty(0)
+        return {_: vuoto for _ in ('bda', 'quanti', 'primo', 'ultimo', 'ritmo',
+                                   'rssi_min', 'rssi_max', 'rssi_medio')}
+
+    # sorted by address, then by time: one reduceat per statistic
+    ordine = np.lexsort((col['tempo'], col['bda']))
+    bda = col['bda'][ordine]
+    tempo = col['tempo'][ordine]
+    rssi = col['rssi'][ordine].astype(np.int32)
+
+    quali, dove, quanti = np.unique(bda, return_index=True, return_counts=True)
+    primo = tempo[dove]
+    ultimo = tempo[dove + quanti - 1]
+    durata = ultimo - primo
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ritmo = np.where(durata > 0, (quanti - 1) / durata, 0.0)
+
+    return {
+        'bda': quali,
+        'quanti': quanti,
+        'primo': primo,
+        'ultimo': ultimo,
+        'ritmo': ritmo,
+        'rssi_min': np.minimum.reduceat(rssi, dove),
+        'rssi_max': np.maximum.reduceat(rssi, dove),
+        'rssi_medio': np.add.reduceat(rssi, dove) / quanti,
+    }
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 2:
+        COL = carica(sys.argv[1])
+        DISP = dispositivi(COL)
+        print('{} advertisements, {} devices'.format(len(COL['bda']), len(DISP['bda'])))
+        for i in np.argsort(DISP['quanti'])[::-1]:
+            print('{} {:7d} {:8.1f}/s rssi {:4d} {:4d} {:6.1f}'.format(
+                stringa_da_bda(DISP['bda'][i]), DISP['quanti'][i], DISP['ritmo'][i],
+                DISP['rssi_min'][i], DISP['rssi_max'][i], DISP['rssi_medio'][i]))
+    else:
+        print('Passare il file .npz')
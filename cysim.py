@@ -0,0 +1,336 @@
+"""
+A CY5677 simulated on a pty: CY567x(porta=SIMULATORE().porta)
+works on any linux box, without the dongle
+"""
+import heapq
+import os
+import pty
+import random
+import select
+import struct
+import threading
+import time
+import tty
+
+import cycost as cc
+import utili
+from cyproto import PROTO_TX
+from CY567x import CY567x, BAUD_CY5677
+
+_TESTA = struct.Struct('<3H')
+_CMD = struct.Struct('<2H')
+
+_CONN = 0x0004
+
+
+def evento(evn, prm):
+    """
+    frame an event as the dongle does
+    :param evn: event code
+    :param prm: parameters (bytes)
+    :return: bytes
+    """
+    return _TESTA.pack(0xA7BD, len(prm) + 2, evn) + prm
+
+
+class SIMULATORE(threading.Thread):
+    """
+    Answers the commands with the events of the dongle:
+        - every command: EVT_COMMAND_STATUS after ritardo and
+          EVT_COMMAND_COMPLETE after esecuzione more
+        - scan: EVT_SCAN_PROGRESS_RESULT (adv per second) until stop, from
+          the random peripherals and the ones in altri
+        - connection: EVT_ESTABLISH_CONNECTION_RESPONSE,
+          EVT_ENHANCED_CONNECTION_COMPLETE and the security request of the
+          peripheral (EVT_PAIRING_REQUEST_RECEIVED_NOTIFICATION), then
+          EVT_CHARACTERISTIC_VALUE_NOTIFICATION (ntf per second) until
+          disconnection (nothing if the address is in assenti: the attempt
+          lasts until it is cancelled, then it fails)
+        - read/write of the attributes in self.attributi
+          (EVT_GATT_ERROR_NOTIFICATION for the missing ones)
+        - mtu exchange
+        - address of the dongle (indirizzo)
+        - every connection attempt in self.tentativi (address, type)
+        - pairing: EVT_PASSKEY_ENTRY_REQUEST, then, after the passkey,
+          encryption on and key exchange complete after cifratura
+    Commands are served in parallel
+    With baud, the bytes take the time of the serial line in both directions
+    """
+
+    def __init__(self, ritardo=0.001, esecuzione=0.0, baud=BAUD_CY5677,
+                 adv=0, dispositivi=50, ntf=0, ntf_attr=0x0012, ntf_dim=20,
+                 mtu=512, seme=0, assenti=(), cifratura=0.05, altri=(),
+                 indirizzo='00:A0:50:00:00:01'):
+        """
+        :param ritardo: seconds before EVT_COMMAND_STATUS
+        :param esecuzione: seconds between EVT_COMMAND_STATUS and EVT_COMMAND_COMPLETE
+        :param baud: speed of the line (None: infinite)
+        :param adv: advertisements per second while scanning
+        :param dispositivi: how many peripherals advertise
+        :param ntf: notifications per second while connected
+        :param ntf_attr: handle of the notifications
+        :param ntf_dim: size of the notifications
+        :param mtu: max mtu accepted
+        :param seme: random seed
+        :param assenti: addresses (string) that never answer a connection
+        :param cifratura: seconds from the passkey to the encryption
+        :param altri: more peripherals, (address as string, advertising data)
+        :param indirizzo: address of the dongle (string)
+        """
+        threading.Thread.__init__(self, daemon=True)
+
+        self.ritardo = ritardo
+        self.esecuzione = esecuzione
+        # seconds for a byte
+        self.byte = 0.0 if baud is None else 10.0 / baud
+        self.adv = adv
+        self.ntf = ntf
+        self.ntf_attr = ntf_attr
+        self.ntf_dim = ntf_dim
+        self.mtu = mtu
+        self.assenti = {bytes(utili.mac_da_stringa(_)) for _ in assenti}
+        self.cifratura = cifratura
+        self.indirizzo = bytes(utili.mac_da_stringa(indirizzo))
+
+        self.rnd = random.Random(seme)
+        self.dispositivi = [self._dispositivo(_) for _ in range(dispositivi)]
+        self.dispositivi += [(bytes(utili.mac_da_stringa(bda)), bytes(dati))
+                             for bda, dati in altri]
+
+        # handle -> value
+        self.attributi = {ntf_attr: bytearray(ntf_dim)}
+
+        self.contatori = {'cmd': 0, 'adv': 0, 'ntf': 0, 'tx': 0}
+        # (address as string, 0 public / 1 random) of the connections
+        self.tentativi = []
+
+        # (when, number, frame): what the dongle will send
+        self._uscita = []
+        self._num = 0
+        # when the lines will be free
+        self._linea_rx = 0.0
+        self._linea_tx = 0.0
+
+        self._scansione = None
+        self._connesso = None
+        # when the encryption will be on
+        self._cifrato = None
+        # a connection to one of assenti is waiting
+        self._tentativo = False
+
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.porta = os.ttyname(self.slave)
+
+        self.start()
+
+    def _dispositivo(self, indice):
+        bda = bytes(self.rnd.getrandbits(8) for _ in range(6))
+        nome = 'SIM{:04d}'.format(indice).encode('ascii')
+        if indice % 3 == 1:
+            # flags, 128 bit service data
+            return bda, b'\x02\x01\x06' + \
+                   b'\x17\x21' + bytes(self.rnd.getrandbits(8) for _ in range(22))
+        if indice % 3 == 2:
+            # flags, complete list of 16 bit uuids, tx power, complete local name
+            return bda, b'\x02\x01\x06' + \
+                   b'\x05\x03\x0F\x18\x0A\x18' + \
+                   b'\x02\x0A\x04' + \
+                   bytes([len(nome) + 1, 0x09]) + nome
+        # flags, manufacturer data, complete local name
+        dati = b'\x02\x01\x06' + \
+               b'\x09\xFF\x31\x01' + bytes(self.rnd.getrandbits(8) for _ in range(6)) + \
+               bytes([len(nome) + 1, 0x09]) + nome
+        return bda, dati
+
+    def _manda(self, quando, frame):
+        # the line sends one frame after the other
+        inizio = max(quando, self._linea_tx)
+        self._linea_tx = inizio + len(frame) * self.byte
+        self._num += 1
+        heapq.heappush(self._uscita, (self._linea_tx, self._num, frame))
+
+    def _stato(self, quando, cod, stato=0):
+        self._manda(quando + self.ritardo, evento(cc.EVT_COMMAND_STATUS, _CMD.pack(cod, stato)))
+
+    def _fine(self, quando, cod, stato=0):
+        self._manda(quando + self.ritardo + self.esecuzione,
+                    evento(cc.EVT_COMMAND_COMPLETE, _CMD.pack(cod, stato)))
+
+    def _risposta(self, quando, evn, prm):
+        self._manda(quando + self.ritardo + self.esecuzione / 2, evento(evn, prm))
+
+    def _comando(self, quando, cod, prm):
+        self.contatori['cmd'] += 1
+        self._stato(quando, cod)
+
+        if cod == CY567x.Cmd_Start_Scan_Api:
+            # the status closes the command
+            self._scansione = quando + self.ritardo
+            return
+
+        if cod == CY567x.Cmd_Stop_Scan_Api:
+            self._scansione = None
+            self._risposta(quando, cc.EVT_SCAN_STOPPED_NOTIFICATION, b'')
+        elif cod == CY567x.Cmd_Get_Bluetooth_Device_Address_Api:
+            # bda, public
+            self._risposta(quando, cc.EVT_GET_BLUETOOTH_DEVICE_ADDRESS_RESPONSE,
+                           struct.pack('<H', cod) + self.indirizzo + b'\x00')
+        elif cod == CY567x.Cmd_Establish_Connection_Api:
+            self.tentativi.append((utili.stringa_da_mac(prm[:6]), prm[6]))
+            if bytes(prm[:6]) in self.assenti:
+                self._tentativo = True
+                return
+            self._risposta(quando, cc.EVT_ESTABLISH_CONNECTION_RESPONSE, _CMD.pack(cod, _CONN))
+            self._risposta(quando, cc.EVT_ENHANCED_CONNECTION_COMPLETE,
+                           struct.pack('<HBHB', cod, 0, _CONN, 0))
+            # authenticated pairing with encryption, 16 bytes keys
+            self._risposta(quando, cc.EVT_PAIRING_REQUEST_RECEIVED_NOTIFICATION,
+                           struct.pack('<H5B', _CONN, 0x12, 0, 16, 0, 0))
+            self._connesso = quando + self.ritardo + self.esecuzione
+        elif cod == CY567x.Cmd_Terminate_Connection_Api:
+            self._connesso = None
+            self._cifrato = None
+            self._risposta(quando, cc.EVT_CONNECTION_TERMINATED_NOTIFICATION,
+                           struct.pack('<HB', _CONN, 0x16))
+        elif cod == CY567x.Cmd_Cancle_Connection_Api:
+            if self._tentativo:
+                # the attempt ends with an error
+                self._tentativo = False
+                self._fine(quando, CY567x.Cmd_Establish_Connection_Api, 1)
+        elif cod == CY567x.Cmd_Exchange_GATT_MTU_Size_Api:
+            _, mtu = struct.unpack_from('<2H', prm)
+            self._risposta(quando, cc.EVT_EXCHANGE_GATT_MTU_SIZE_RESPONSE,
+                           struct.pack('<3H', cod, _CONN, min(mtu, self.mtu)))
+        elif cod == CY567x.Cmd_Initiate_Pairing_Request_Api:
+            # the request closes the command
+            self._risposta(quando, cc.EVT_PASSKEY_ENTRY_REQUEST, _CMD.pack(cod, _CONN))
+            return
+        elif cod == CY567x.Cmd_Pairing_PassKey_Api:
+            # the line is free in the meantime
+            self._cifrato = quando + self.ritardo + self.esecuzione + self.cifratura
+        elif cod in (CY567x.Cmd_Read_Characteristic_Value_Api,
+                     CY567x.Cmd_Read_Characteristic_Descriptor_Api):
+            _, crt = struct.unpack_from('<2H', prm)
+            if crt in self.attributi:
+                evn = cc.EVT_READ_CHARACTERISTIC_VALUE_RESPONSE
+                if cod == CY567x.Cmd_Read_Characteristic_Descriptor_Api:
+                    evn = cc.EVT_READ_CHARACTERISTIC_DESCRIPTOR_RESPONSE
+                val = bytes(self.attributi[crt])
+                self._risposta(quando, evn, struct.pack('<3H', cod, _CONN, len(val)) + val)
+            else:
+                self._errore(quando, cod, 0x0A, crt)
+                return
+        elif cod in (CY567x.Cmd_Write_Characteristic_Value_Api,
+                     CY567x.Cmd_Characteristic_Value_Write_Without_Response_Api,
+                     CY567x.Cmd_Write_Characteristic_Descriptor_Api):
+            _, crt, dim = struct.unpack_from('<3H', prm)
+            self.attributi[crt] = bytearray(prm[6:6 + dim])
+
+        self._fine(quando, cod)
+
+    def _errore(self, quando, cod, pdu, crt):
+        # CYBLE_GATT_ERR_ATTRIBUTE_NOT_FOUND
+        self._risposta(quando, cc.EVT_GATT_ERROR_NOTIFICATION,
+                       struct.pack('<2HBHB', cod, _CONN, pdu, crt, 0x0A))
+
+    def _inietta(self, ora):
+        # advertisements and notifications due up to now
+        if self._scansione is not None and self.adv:
+            while self._scansione <= ora:
+                bda, dati = self.rnd.choice(self.dispositivi)
+                rssi = self.rnd.randint(-90, -30)
+                rapporto = struct.pack('<B6sBbB', 0, bda, 0, rssi, len(dati)) + dati
+                self._manda(self._scansione, evento(
+                    cc.EVT_SCAN_PROGRESS_RESULT,
+                    struct.pack('<H', CY567x.Cmd_Start_Scan_Api) + rapporto))
+                self.contatori['adv'] += 1
+                self._scansione += 1.0 / self.adv
+
+        if self._cifrato is not None and self._cifrato <= ora:
+            # CYBLE_EVT_GAP_ENCRYPT_CHANGE, CYBLE_EVT_GAP_KEYINFO_EXCHNGE_CMPLT
+            self._manda(self._cifrato, evento(cc.EVT_REPORT_STACK_MISC_STATUS,
+                                              struct.pack('<2HB', 0x0029, 1, 1)))
+            self._manda(self._cifrato, evento(cc.EVT_REPORT_STACK_MISC_STATUS,
+                                              struct.pack('<2H', 0x002C, 0)))
+            self._cifrato = None
+
+        if self._connesso is not None and self.ntf:
+            while self._connesso <= ora:
+                val = self.attributi.setdefault(self.ntf_attr, bytearray(self.ntf_dim))
+                self._manda(self._connesso, evento(
+                    cc.EVT_CHARACTERISTIC_VALUE_NOTIFICATION,
+                    struct.pack('<3H', _CONN, self.ntf_attr, len(val)) + val))
+                self.contatori['ntf'] += 1
+                self._connesso += 1.0 / self.ntf
+
+    def _prossimo(self):
+        prossimo = []
+        if self._uscita:
+            prossimo.append(self._uscita[0][0])
+        if self._scansione is not None and self.adv:
+            prossimo.append(self._scansione)
+        if self._connesso is not None and self.ntf:
+            prossimo.append(self._connesso)
+        if self._cifrato is not None:
+            prossimo.append(self._cifrato)
+        if prossimo:
+            return max(0.0, min(prossimo) - time.perf_counter())
+        return None
+
+    def run(self):
+        proto = PROTO_TX()
+        while True:
+            try:
+                pronti, _, _ = select.select([self.master], [], [], self._prossimo())
+                if pronti:
+                    dati = os.read(self.master, 4096)
+                    ora = time.perf_counter()
+                    # the command arrives when its last byte does
+                    self._linea_rx = max(ora, self._linea_rx) + len(dati) * self.byte
+                    for msg in proto.iter_msgs(dati):
+                        cod, dim = _CMD.unpack_from(msg)
+                        self._comando(self._linea_rx, cod, msg[4:4 + dim])
+
+                ora = time.perf_counter()
+                self._inietta(ora)
+
+                uscita = bytearray()
+                while self._uscita and self._uscita[0][0] <= ora:
+                    uscita += heapq.heappop(self._uscita)[2]
+                if uscita:
+                    os.write(self.master, uscita)
+                    self.contatori['tx'] += len(uscita)
+            except (OSError, ValueError):
+                break
+
+    def close(self):
+        """
+        unplug the dongle
+        :return: n.a.
+        """
+        # the master sees EIO and the thread ends
+        os.close(self.slave)
+        self.join(1)
+        os.close(self.master)
+
+
+if __name__ == '__main__':
+    SIM = SIMULATORE(adv=100, ntf=50)
+    DONGLE = CY567x(porta=SIM.porta)
+
+    print('init: ' + str(DONGLE.init_ble_stack()))
+    print('start: ' + str(DONGLE.scan_start()))
+    time.sleep(1)
+    print('stop: ' + str(DONGLE.scan_stop()))
+    print('conn: ' + str(DONGLE.connect('00:11:22:33:44:55')))
+    print('mtu: ' + str(DONGLE.exchange_gatt_mtu_size(247)))
+    print('write: ' + str(DONGLE.write_characteristic_value(0x0020, b'ciao')))
+    print('read: ' + str(DONGLE.read_characteristic_value(0x0020)))
+    print('read: ' + str(DONGLE.read_characteristic_value(0x0030)))
+    time.sleep(1)
+    print('disc: ' + str(DONGLE.disconnect()))
+    print(SIM.contatori)
+
+    DONGLE.close()
+    SIM.close()
@@ -87,6 +87,15 @@ def service_data_from(numserprod):
     return gsd
 
 
+def indirizzo_pubblico(sr):
+    """
+    the type of the address, as the dongle wants it to connect
+    :param sr: dict (cfr scan_report) or an entry of the archive
+    :return: bool
+    """
+    return str(sr.get('bda_type')).startswith('Public')
+
+
 def dati_cpu(_rsp):
     giorni, secondi, reset, pon, gupo, ria, sta = struct.unpack('<7I', _rsp)
     return {
@@ -447,13 +456,13 @@ class GHOST(CY567x.CY567x, GHOST_CONF, GHOST_NORM, bl.CY_BL_SERVICE):
             except queue.Empty:
                 break
 
-    def __init__(self, porta=None, logga=False):
-        # prima di sincro!
-        bl.CY_BL_SERVICE.__init__(self)
-
+    def __init__(self, porta=None, logga=False, gestore=None):
+        """
+        :param porta: serial port (None: the first CY5677)
+        :param logga: bool
+        :param gestore: cymanager.DongleManager (None: the thread of the object)
+        """
         self.sincro = {
-            # cypress bootloader service
-            'blr': queue.Queue(),
             # list of devices
             'scan': queue.Queue(),
             # user list of devices
@@ -466,13 +475,29 @@ class GHOST(CY567x.CY567x, GHOST_CONF, GHOST_NORM, bl.CY_BL_SERVICE):
             'rsp': queue.Queue()
         }
 
+        # dopo sincro!
+        bl.CY_BL_SERVICE.__init__(self)
+
         self.priv = None
 
         self.crc = crcmod.Crc(0x11021, 0xC681, False, 0x0000)
 
         self.srvdata = None
 
-        CY567x.CY567x.__init__(self, porta=porta)
+        CY567x.CY567x.__init__(self, porta=porta, gestore=gestore)
+
+        # only the ghosts reach scan_progress_cb
+        self.set_scan_filter(self._filtro())
+
+        # the devices seen by start_find (cfr scan_util.TABELLA)
+        self.tabella = None
+
+        # seconds of each phase of the last connect_to
+        self.durate = {}
+
+        # cyarchivio.ARCHIVIO of the ghosts found by start_find and find
+        # (connect_to_serial looks there first)
+        self.archivio = None
 
         self.mio = None
 
@@ -538,17 +563,31 @@ class GHOST(CY567x.CY567x, GHOST_CONF, GHOST_NORM, bl.CY_BL_SERVICE):
         """
         self.disc = func
 
-    def start_find(self, coda):
+    def set_archive(self, archivio=None):
+        """
+        set where the ghosts found by start_find and find are also saved
+        :param archivio: cyarchivio.ARCHIVIO (closed by its owner) or None
+        :return: n.a.
+        """
+        self.archivio = archivio
+
+    def start_find(self, coda, intervallo=1.0):
         """
         find all the ghosts around you
         :param coda: the queue that will receive ghost's info
+        :param intervallo: seconds between two infos of a ghost that has not changed
+                           (None: only the first one and the changes)
         :return: bool
         """
         if self.sincro['user'] is None:
             self.srvdata = None
             self.sincro['user'] = coda
+            # a ghost advertises many times per second
+            self.tabella = scan_util.TABELLA(filtro=self._filtro(), intervallo=intervallo)
+            self.set_scan_filter(self.tabella)
             if not self.scan_start():
                 self.sincro['user'] = None
+                self.set_scan_filter(self._filtro())
 
             return self.sincro['user'] is not None
 
@@ -562,6 +601,7 @@ class GHOST(CY567x.CY567x, GHOST_CONF, GHOST_NORM, bl.CY_BL_SERVICE):
         if self.sincro['user'] is not None:
             if self.scan_stop():
                 self.sincro['user'] = None
+                self.set_scan_filter(self._filtro())
                 return True
             return False
         return True
@@ -578,20 +618,22 @@ class GHOST(CY567x.CY567x, GHOST_CONF, GHOST_NORM, bl.CY_BL_SERVICE):
         self.logger.info('find <' + cp + '> => ' + utili.stringa_da_ba(sdata, ' '))
 
         self.srvdata = sdata
+        self.set_scan_filter(self._filtro(sdata))
 
         # empty scan queue
         self._reset('SCAN')
 
         # find it
+        ud = None
         if self.scan_start():
             try:
                 ud = self.sincro['scan'].get(True, to)
-                self.scan_stop()
-                return ud
             except queue.Empty:
-                self.scan_stop()
+                pass
+            self.scan_stop()
 
-        return None
+        self.set_scan_filter(self._filtro())
+        return ud
 
     def _compute_passkey(self, bda, secret):
         """
@@ -605,13 +647,16 @@ class GHOST(CY567x.CY567x, GHOST_CONF, GHOST_NORM, bl.CY_BL_SERVICE):
         pqb = struct.unpack('<I', x[:4])
         return pqb[0] % 1000000
 
-    def connect_to(self, bda, mode, secret, to=20):
+    def connect_to(self, bda, mode, secret, to=20, to_conn=10, public=False):
         """
         execute connection with authentication and authorization
+        (the seconds of each phase are in self.durate)
         :param bda: mac address (bytearray)
         :param mode: 'CONF' o 'NORM'
         :param secret: bytearray
         :param to: timeout
+        :param to_conn: timeout of the connection
+        :param public: type of the address (cfr indirizzo_pubblico)
         :return: bool
         """
         self.logger.info('connect_to')
@@ -621,32 +666,54 @@ class GHOST(CY567x.CY567x, GHOST_CONF, GHOST_NORM, bl.CY_BL_SERVICE):
 
         self.sincro['authReq'].clear()
         self.sincro['pairReq'].clear()
+        self.sincro['encrypt'].clear()
+        self.sincro['keyinfo'].clear()
+
+        self.durate = {}
+        inizio = time.perf_counter()
+
+        def fatto(fase):
+            nonlocal inizio
+            ora = time.perf_counter()
+            self.durate[fase] = ora - inizio
+            inizio = ora
 
         try:
             # connection
-            if not self.connect(bda, public=False):
+            if not self.connect(bda, public=public, to=to_conn):
                 raise utili.Problema("err connect")
+            fatto('connect')
 
             # authentication
             if not self.sincro['authReq'].wait(to):
                 raise utili.Problema("err autReq")
+            fatto('authReq')
 
             mtu = self.exchange_gatt_mtu_size()
             if mtu == 0:
                 raise utili.Problema('err mtu')
             print('mtu {}'.format(mtu))
+            fatto('mtu')
 
             if not self.initiate_pairing_request():
                 raise utili.Problema('err pair req')
 
             if not self.sincro['pairReq'].wait(to):
                 raise utili.Problema("err pairReq")
+            fatto('pairReq')
 
             if not self.pairing_passkey(pk):
                 raise utili.Problema('err passkey')
+            fatto('passkey')
+
+            # the cy5677 is ready when the pairing is really over
+            if not self.sincro['encrypt'].wait(to):
+                raise utili.Problema('err encrypt')
+            fatto('encrypt')
 
-            # la cy5677 non funziona benissimo
-            time.sleep(2)
+            if not self.sincro['keyinfo'].wait(to):
+                raise utili.Problema('err keyinfo')
+            fatto('keyinfo')
 
             # authorization
             crt_ = CYBLE_SERVICE_AUTHOR_CHAR_HANDLE
@@ -654,6 +721,7 @@ class GHOST(CY567x.CY567x, GHOST_CONF, GHOST_NORM, bl.CY_BL_SERVICE):
                 crt_ = CYBLE_CONFIG_AUTHOR_CHAR_HANDLE
             if not self._authorize(crt_):
                 raise utili.Problema('err autor')
+            fatto('authorize')
 
             return True
 
@@ -661,6 +729,38 @@ class GHOST(CY567x.CY567x, GHOST_CONF, GHOST_NORM, bl.CY_BL_SERVICE):
             self.logger.error(str(err))
             return False
 
+        finally:
+            self.logger.info('connect_to: ' + ' '.join(
+                '{}={:.3f}'.format(k, v) for k, v in self.durate.items()))
+
+    def connect_to_serial(self, cp, secret, to=10, breve=2):
+        """
+        connect_to the ghost with a specific serial number: first where
+        the archive last saw it, then where find finds it
+        :param cp: serial number (i.e. 'XXXAT000000')
+        :param secret: bytearray
+        :param to: timeout of find and of the connection procedure
+        :param breve: timeout of the connection to the last address
+        :return: bool
+        """
+        voce = None
+        if self.archivio is not None:
+            voce = self.archivio.indirizzo(cp)
+
+        if voce is not None:
+            self.logger.info('connect_to_serial <' + cp + '> @ ' + voce['bda'])
+            if self.connect_to(voce['bda'], voce['fase'], secret, to, breve,
+                               indirizzo_pubblico(voce)):
+                return True
+            # moved, or someone else has that address now
+            self.disconnect()
+
+        ud = self.find(cp, to)
+        if ud is None:
+            return False
+        return self.connect_to(ud['bda'], ud['fase'], secret, to,
+                               public=indirizzo_pubblico(ud))
+
     def _authorize(self, car):
         """
         execute the challenge/response procedure
@@ -769,33 +869,42 @@ class GHOST(CY567x.CY567x, GHOST_CONF, GHOST_NORM, bl.CY_BL_SERVICE):
         msg = struct.pack('<H', 0x0003)
         return self.write_characteristic_value(char, msg)
 
+    @staticmethod
+    def _filtro(sdata=b''):
+        # connectable undirected advertising with the service data of a ghost
+        return scan_util.FILTRO(
+            adv=[0x00],
+            srvd=[scan_util.ba_from_stringuuid(_) + sdata for _ in (srv_norm, srv_conf)])
+
     def _find_all_ghosts(self, _sd, un_sr):
         un_sr['prod'] = nsp_from(_sd)
         self.logger.info('trovato ' + str(un_sr))
+        if self.archivio is not None:
+            self.archivio.aggiungi(un_sr)
         self.sincro['user'].put_nowait(un_sr)
 
     def scan_progress_cb(self, adv: bytearray):
-        sr = scan_util.scan_report(adv)
-        self.logger.debug(str(sr))
-        if sr['adv_type'] != 'Connectable undirected advertising':
+        rapporto = scan_util.RAPPORTO(adv)
+        self.logger.debug('%r', rapporto)
+        # Connectable undirected advertising
+        if rapporto.adv != 0x00:
             return
 
-        adv = scan_util.scan_advertise(sr['data'])
-        self.logger.debug(str(adv))
-        for _elem in adv:
-            if _elem[0] != 'srvd128':
-                continue
-
-            if _elem[1] in (srv_norm, srv_conf):
-                self.logger.info(str(adv))
-                sr['fase'] = 'NORM' if _elem[1] == srv_norm else 'CONF'
+        # 128 bit service data
+        for _elem in rapporto.trova(0x21):
+            if _elem.uuid in (srv_norm, srv_conf):
+                self.logger.info('%s', rapporto.strutture())
+                sr = rapporto.dizionario()
+                sr['fase'] = 'NORM' if _elem.uuid == srv_norm else 'CONF'
                 if self.srvdata is None:
-                    self._find_all_ghosts(_elem[2], sr)
+                    self._find_all_ghosts(bytearray(_elem.contenuto), sr)
                 else:
                     # find a ghost
-                    srvdata = _elem[2]
-                    if srvdata == self.srvdata:
+                    if _elem.contenuto == self.srvdata:
                         print(sr['bda'] + ' {} dB '.format(sr['rssi']))
+                        if self.archivio is not None:
+                            sr['prod'] = nsp_from(_elem.contenuto)
+                            self.archivio.aggiungi(sr)
                         self.sincro['scan'].put_nowait(sr)
 
     def gap_auth_req_cb(self, ai):
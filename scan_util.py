@@ -1,9 +1,13 @@
 """
 Collects utilities to break scan reports
 """
+import collections
+import re
 import struct
-import uuid
 import sys
+import threading
+import time
+import uuid
 
 import utili
 
@@ -55,12 +59,10 @@ def _at_service_data32(data):
 
 
 def _at_service_data128(data):
-    sid = data[:16]
+    sid = stringuuid_from_ba(data[:16])
     data = data[16:]
 
-    sid.reverse()
-    sid = uuid.UUID(bytes=bytes(sid))
-    return 'srvd128', str(sid).upper(), data
+    return 'srvd128', sid, data
 
 
 def _at_name(data):
@@ -93,12 +95,8 @@ def _at_service_class_uuid32(data):
 def _at_service_class_uuid128(data):
     lista = []
     while len(data) >= 16:
-        buid = data[:16]
+        lista.append(stringuuid_from_ba(data[:16]))
         data = data[16:]
-
-        buid.reverse()
-        srv = uuid.UUID(bytes=bytes(buid))
-        lista.append(str(srv).upper())
     return 'srv128', lista
 
 
@@ -108,24 +106,24 @@ def scan_advertise(data):
     references:
         bt 4.2, vol 3, part C, 11 (pag 2081)
         https://www.bluetooth.com/specifications/assigned-numbers/generic-access-profile
-    :param data: bytearray
+    :param data: bytearray (not modified)
     :return: list of tuples (type, ...)
     """
+    if not isinstance(data, bytearray):
+        data = bytearray(data)
     adv = []
-    while len(data):
+    fine = len(data)
+    pos = 0
+    while pos < fine:
         # structure length
-        slen = data.pop(0)
-        # structure data
-        if slen == 0:
-            break
-        if len(data) < slen:
+        slen = data[pos]
+        if slen == 0 or pos + 1 + slen > fine:
             break
-        sdata = data[:slen]
-        # next structures
-        data = data[slen:]
+        # structure type and data
+        stype = data[pos + 1]
+        sdata = data[pos + 2:pos + 1 + slen]
+        pos += 1 + slen
 
-        # structure type
-        stype = sdata.pop(0)
         try:
             adv.append(_ADV_TYPE[stype](sdata))
         except KeyError:
@@ -133,6 +131,438 @@ def scan_advertise(data):
     return adv
 
 
+class AD:
+    """
+    An AD structure of an advertise: the data are a view of the
+    received bytes, the strings are computed when asked
+    """
+    __slots__ = ('tipo', 'dati', '_uuid')
+
+    def __init__(self, tipo, dati):
+        """
+        :param tipo: AD type (see _ADV_TYPE)
+        :param dati: memoryview (without length and type)
+        """
+        self.tipo = tipo
+        self.dati = dati
+        self._uuid = None
+
+    @property
+    def uuid(self):
+        """
+        the uuid of service data (the company of manufacturer data)
+        :return: int (16/32 bit and company), string (128 bit) or None
+        """
+        if self._uuid is None:
+            dim = _DIM_UUID.get(self.tipo)
+            if dim is None or len(self.dati) < dim:
+                return None
+            if dim == 16:
+                self._uuid = stringuuid_from_ba(self.dati)
+            else:
+                self._uuid = int.from_bytes(self.dati[:dim], 'little')
+        return self._uuid
+
+    @property
+    def contenuto(self):
+        """
+        service or manufacturer data after the uuid
+        :return: memoryview
+        """
+        return self.dati[_DIM_UUID.get(self.tipo, 0):]
+
+    @property
+    def servizi(self):
+        """
+        the uuids of a list of service classes
+        :return: list of string
+        """
+        dim = _DIM_SERVIZI.get(self.tipo)
+        if dim is None:
+            return []
+        if dim == 16:
+            return [stringuuid_from_ba(self.dati[_:_ + 16])
+                    for _ in range(0, len(self.dati) - 15, 16)]
+        return [('{:0' + str(2 * dim) + 'X}').format(int.from_bytes(self.dati[_:_ + dim], 'little'))
+                for _ in range(0, len(self.dati) - dim + 1, dim)]
+
+    @property
+    def nome(self):
+        """
+        the local name
+        :return: string or None
+        """
+        if self.tipo in (0x08, 0x09):
+            return str(self.dati, 'ascii')
+        return None
+
+    def __repr__(self):
+        return '{:02X}: '.format(self.tipo) + utili.stringa_da_ba(self.dati, ' ')
+
+
+def strutture(data):
+    """
+    the AD structures of an advertise, without copies
+    :param data: bytes, bytearray or memoryview (not modified)
+    :return: list of AD
+    """
+    vista = memoryview(data)
+    fine = len(vista)
+    lista = []
+    pos = 0
+    while pos < fine:
+        # structure length
+        slen = vista[pos]
+        if slen == 0 or pos + 1 + slen > fine:
+            break
+        lista.append(AD(vista[pos + 1], vista[pos + 2:pos + 1 + slen]))
+        pos += 1 + slen
+    return lista
+
+
+def trova(data, tipo):
+    """
+    the AD structures of one type of an advertise (the others are
+    skipped without creating objects)
+    :param data: bytes, bytearray or memoryview (not modified)
+    :param tipo: AD type
+    :return: list of AD
+    """
+    vista = memoryview(data)
+    fine = len(vista)
+    lista = []
+    pos = 0
+    while pos < fine:
+        slen = vista[pos]
+        if slen == 0 or pos + 1 + slen > fine:
+            break
+        if vista[pos + 1] == tipo:
+            lista.append(AD(tipo, vista[pos + 2:pos + 1 + slen]))
+        pos += 1 + slen
+    return lista
+
+
+class RAPPORTO:
+    """
+    A scan report (cfr scan_report) as a view of the received bytes:
+    the strings are computed when asked
+    """
+    __slots__ = ('vista', 'adv', 'tipo_bda', 'rssi', 'dim', '_bda')
+
+    # event type, bda, bda type, rssi, data length
+    _TESTA = struct.Struct('<B6xBbB')
+
+    def __init__(self, data):
+        """
+        :param data: bytes or bytearray (cfr Send_advt_report)
+        """
+        self.vista = memoryview(data)
+        self.adv, self.tipo_bda, self.rssi, self.dim = self._TESTA.unpack_from(self.vista)
+        self._bda = None
+
+    @property
+    def bda(self):
+        """
+        :return: string (e.g. "zz:..:xx")
+        """
+        if self._bda is None:
+            self._bda = utili.stringa_da_mac(self.vista[1:7])
+        return self._bda
+
+    @property
+    def adv_type(self):
+        return _ADVERTISEMENT_EVENT_TYPE[self.adv]
+
+    @property
+    def bda_type(self):
+        return _ADDRESS_TYPE[self.tipo_bda]
+
+    @property
+    def data(self):
+        """
+        :return: memoryview
+        """
+        return self.vista[self._TESTA.size:]
+
+    def strutture(self):
+        """
+        :return: list of AD
+        """
+        return strutture(self.data)
+
+    def trova(self, tipo):
+        """
+        :param tipo: AD type
+        :return: list of AD
+        """
+        return trova(self.data, tipo)
+
+    def dizionario(self):
+        """
+        :return: the dict of scan_report
+        """
+        return scan_report(bytearray(self.vista))
+
+    def __repr__(self):
+        return '{} {} rssi={} [{}]: {}'.format(
+            self.bda, self.adv, self.rssi, self.dim, utili.stringa_da_ba(self.data, ' '))
+
+
+class FILTRO:
+    """
+    A filter on the raw bytes of a scan report (cfr Send_advt_report),
+    cheap enough for the thread of the dongle: an advertise passes if it
+    satisfies every criterion that was given (one of the values of each)
+    """
+
+    # AD types: lists of service classes and service data
+    _LISTA16 = (0x02, 0x03)
+    _LISTA128 = (0x06, 0x07)
+    _DATI = (0x16, 0x20, 0x21)
+
+    def __init__(self, adv=None, bda=None, uuid16=None, uuid128=None, manuf=None, srvd=None):
+        """
+        :param adv: event types (int, e.g. 0x00 for connectable undirected)
+        :param bda: addresses (string "zz:..:xx")
+        :param uuid16: 16 bit uuids (int) of a list of service classes or of service data
+        :param uuid128: 128 bit uuids (string) of a list of service classes or of service data
+        :param manuf: company identifiers (int) of manufacturer data
+        :param srvd: prefixes of service data (bytes, starting with the uuid
+                     as it is sent, cfr ba_from_stringuuid)
+        """
+        self._adv = None if adv is None else frozenset(adv)
+        self._bda = None if bda is None else frozenset(
+            bytes(utili.mac_da_stringa(_)) for _ in bda)
+
+        # name -> values (as they are sent)
+        self._ad = {}
+        if uuid16 is not None:
+            self._ad['uuid16'] = frozenset(struct.pack('<H', _) for _ in uuid16)
+        if uuid128 is not None:
+            self._ad['uuid128'] = frozenset(bytes(ba_from_stringuuid(_)) for _ in uuid128)
+        if manuf is not None:
+            self._ad['manuf'] = frozenset(struct.pack('<H', _) for _ in manuf)
+        if srvd is not None:
+            self._ad['srvd'] = tuple(bytes(_) for _ in srvd)
+
+        # the values of a criterion must be somewhere: one search each
+        self._ovunque = [
+            re.compile(b'|'.join(re.escape(_) for _ in valori)).search
+            for valori in self._ad.values()
+        ]
+
+        self.visti = 0
+        self.passati = 0
+
+    def _soddisfa(self, tipo, dati, mancano):
+        # the criteria satisfied by an AD structure
+        if 'uuid16' in mancano:
+            valori = self._ad['uuid16']
+            if tipo in self._LISTA16 and any(
+                    dati[_:_ + 2] in valori for _ in range(0, len(dati) - 1, 2)) \
+                    or tipo == 0x16 and dati[:2] in valori:
+                mancano.discard('uuid16')
+        if 'uuid128' in mancano:
+            valori = self._ad['uuid128']
+            if tipo in self._LISTA128 and any(
+                    dati[_:_ + 16] in valori for _ in range(0, len(dati) - 15, 16)) \
+                    or tipo == 0x21 and dati[:16] in valori:
+                mancano.discard('uuid128')
+        if 'manuf' in mancano and tipo == 0xFF and dati[:2] in self._ad['manuf']:
+            mancano.discard('manuf')
+        if 'srvd' in mancano and tipo in self._DATI and dati.startswith(self._ad['srvd']):
+            mancano.discard('srvd')
+
+    def __call__(self, rapporto):
+        """
+        :param rapporto: bytes, bytearray or memoryview (not modified)
+        :return: bool
+        """
+        self.visti += 1
+
+        if len(rapporto) < 10:
+            return False
+        if self._adv is not None and rapporto[0] not in self._adv:
+            return False
+        if self._bda is not None and bytes(rapporto[1:7]) not in self._bda:
+            return False
+
+        if self._ad:
+            # the values must be somewhere...
+            for cerca in self._ovunque:
+                if cerca(rapporto, 10) is None:
+                    return False
+
+            # ... and in the right place
+            dati = bytes(rapporto)
+            mancano = set(self._ad)
+            fine = len(dati)
+            pos = 10
+            while pos < fine and mancano:
+                slen = dati[pos]
+                if slen == 0 or pos + 1 + slen > fine:
+                    break
+                self._soddisfa(dati[pos + 1], dati[pos + 2:pos + 1 + slen], mancano)
+                pos += 1 + slen
+            if mancano:
+                return False
+
+        self.passati += 1
+        return True
+
+
+class DISPOSITIVO:
+    """
+    What TABELLA knows of a device
+    """
+    __slots__ = ('grezzo', 'primo', 'ultimo', 'visto', 'rssi_min', 'rssi_max', 'rssi',
+                 'impronte', 'consegnato')
+
+    def __init__(self, grezzo, quando, rssi):
+        """
+        :param grezzo: address as it is sent (6 bytes)
+        :param quando: time of the first advertise
+        :param rssi: dBm
+        """
+        self.grezzo = grezzo
+        self.primo = quando
+        self.ultimo = quando
+        self.visto = 1
+        self.rssi_min = rssi
+        self.rssi_max = rssi
+        # exponentially weighted moving average
+        self.rssi = float(rssi)
+        # event type -> hash of the data
+        self.impronte = {}
+        # time of the last advertise that passed
+        self.consegnato = quando
+
+    @property
+    def bda(self):
+        """
+        :return: string (e.g. "zz:..:xx")
+        """
+        return utili.stringa_da_mac(self.grezzo)
+
+    def dizionario(self):
+        """
+        :return: dict (a copy)
+        """
+        diz = {_: getattr(self, _) for _ in self.__slots__ if _ not in ('grezzo', 'impronte')}
+        diz['bda'] = self.bda
+        return diz
+
+    def __repr__(self):
+        return '{} x{} rssi={:.1f} [{}, {}]'.format(
+            self.bda, self.visto, self.rssi, self.rssi_min, self.rssi_max)
+
+
+class TABELLA:
+    """
+    Aggregates the advertisements by address. As a scan filter
+    (CY567x.set_scan_filter) it lets through only:
+        - the first advertise of a device
+        - the ones with different data (for the same event type)
+        - every intervallo seconds, the last one
+    so the callback gets a bounded stream
+    """
+
+    _RSSI = struct.Struct('<b')
+
+    def __init__(self, filtro=None, intervallo=None, alfa=0.2, dim_max=10000,
+                 orologio=time.monotonic):
+        """
+        :param filtro: FILTRO applied before (None: all)
+        :param intervallo: seconds between two advertises with the same data (None: never)
+        :param alfa: weight of the last rssi in the average
+        :param dim_max: devices remembered (the least recently seen are forgotten)
+        :param orologio: seconds
+        """
+        self.filtro = filtro
+        self.intervallo = intervallo
+        self.alfa = alfa
+        self.dim_max = dim_max
+        self.orologio = orologio
+
+        # address as it is sent -> DISPOSITIVO, the least recently seen first
+        self.dispositivi = collections.OrderedDict()
+        # the thread of the dongle writes, the others read
+        self._mutex = threading.Lock()
+
+        self.visti = 0
+        self.passati = 0
+
+    def __call__(self, rapporto):
+        """
+        :param rapporto: bytes, bytearray or memoryview (cfr Send_advt_report)
+        :return: bool
+        """
+        if self.filtro is not None and not self.filtro(rapporto):
+            return False
+        if len(rapporto) < 10:
+            return False
+
+        ora = self.orologio()
+        # one copy: the slices of bytes are cheaper than the ones of a memoryview
+        dati = bytes(rapporto)
+        grezzo = dati[1:7]
+        rssi = self._RSSI.unpack_from(dati, 8)[0]
+        impronta = hash(dati[10:])
+        adv = dati[0]
+
+        with self._mutex:
+            self.visti += 1
+            disp = self.dispositivi.get(grezzo)
+            if disp is None:
+                disp = DISPOSITIVO(grezzo, ora, rssi)
+                self.dispositivi[grezzo] = disp
+                if len(self.dispositivi) > self.dim_max:
+                    self.dispositivi.popitem(last=False)
+                passa = True
+            else:
+                self.dispositivi.move_to_end(grezzo)
+                disp.ultimo = ora
+                disp.visto += 1
+                if rssi < disp.rssi_min:
+                    disp.rssi_min = rssi
+                elif rssi > disp.rssi_max:
+                    disp.rssi_max = rssi
+                disp.rssi += self.alfa * (rssi - disp.rssi)
+                passa = disp.impronte.get(adv) != impronta or \
+                    self.intervallo is not None and ora - disp.consegnato >= self.intervallo
+            disp.impronte[adv] = impronta
+
+            if passa:
+                disp.consegnato = ora
+                self.passati += 1
+        return passa
+
+    def elenco(self):
+        """
+        the devices seen, the most recent first
+        :return: list of dict (cfr DISPOSITIVO.dizionario)
+        """
+        with self._mutex:
+            return [_.dizionario() for _ in reversed(self.dispositivi.values())]
+
+    def dimentica(self, secondi):
+        """
+        forget the devices not seen for a while (they will be new again)
+        :param secondi: age
+        :return: number of devices forgotten
+        """
+        limite = self.orologio() - secondi
+        quanti = 0
+        with self._mutex:
+            while self.dispositivi:
+                grezzo, disp = next(iter(self.dispositivi.items()))
+                if disp.ultimo >= limite:
+                    break
+                del self.dispositivi[grezzo]
+                quanti += 1
+        return quanti
+
+
 def ba_from_stringuuid(uid):
     """
     convert a string (e.g. 4A7A3045-BCD8-4ACA-B5AE-95FB82EEB222)
@@ -148,9 +578,13 @@ def ba_from_stringuuid(uid):
 
 
 def stringuuid_from_ba(data):
-    data.reverse()
-    srv = uuid.UUID(bytes=bytes(data))
-    return str(srv).upper()
+    """
+    convert 16 bytes (little endian, as sent by the dongle) to a string
+    :param data: bytearray or memoryview (not modified)
+    :return: string
+    """
+    cifre = bytes(data[15::-1]).hex().upper()
+    return '-'.join((cifre[:8], cifre[8:12], cifre[12:16], cifre[16:20], cifre[20:]))
 
 
 _ADV_TYPE = {
@@ -181,6 +615,24 @@ _ADV_TYPE = {
     0x16: _at_service_data16
 }
 
+# AD type -> size of the uuid before the data
+_DIM_UUID = {
+    0xFF: 2,
+    0x16: 2,
+    0x20: 4,
+    0x21: 16
+}
+
+# AD type -> size of the uuids of the list
+_DIM_SERVIZI = {
+    0x02: 2,
+    0x03: 2,
+    0x04: 4,
+    0x05: 4,
+    0x06: 16,
+    0x07: 16
+}
+
 _ADVERTISEMENT_EVENT_TYPE = {
     0x00: 'Connectable undirected advertising',
     0x01: 'Connectable directed advertising',
@@ -1,8 +1,21 @@
+import argparse
+import io
+import mmap
+import multiprocessing
+import os
+import pickle
+import shutil
+import struct
 import sys
+import tempfile
 
 import utili
+from cycost import EVT_COMMAND_STATUS, EVT_COMMAND_COMPLETE, nome_comando, quale_evento
 from cyproto import PROTO_RX, PROTO_TX
 
+# bytes of the log between two madvise (0: never)
+_SCARTA = 32 * 1024 * 1024 if hasattr(mmap, 'MADV_DONTNEED') else 0
+
 
 def leggi_dati(riga):
     # inizia con: "2022-08-05 09:59:06,027 - ..."
@@ -60,76 +73,506 @@ def stampa(cosa, dove, proto_rx, proto_tx):
     dove.write('???\n')
 
 
-def estrai(oper, proto, lista):
-    while True:
-        msg = proto.get_msg()
-        if msg is None:
-            break
-
-        lista.append((oper, msg))
+def estrai(oper, proto, dati):
+    for msg in proto.iter_msgs(dati):
+        yield oper, msg
+
+
+def righe(nfile, inizio=0, fine=None, posizioni=False):
+    """
+    the lines of the file, read through a mmap
+    :param nfile: name of the file
+    :param inizio: offset of the first line
+    :param fine: offset after the last line (None: end of file)
+    :param posizioni: also yield the offset of the lines
+    :return: generator of string (or of (offset, string))
+    """
+    with open(nfile, 'rb') as ing:
+        if os.fstat(ing.fileno()).st_size == 0:
+            return
+        with mmap.mmap(ing.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if fine is None:
+                fine = len(mm)
+            mm.seek(inizio)
+            scartato = inizio - inizio % mmap.PAGESIZE
+            while mm.tell() < fine:
+                pos = mm.tell()
+                riga = mm.readline()
+                # only the interesting ones are decoded
+                if b'IRP_MJ_' in riga or b'IOCTL_SERIAL_SET_BAUD_RATE' in riga:
+                    if posizioni:
+                        yield pos, riga.decode('latin-1')
+                    else:
+                        yield riga.decode('latin-1')
+
+                # the pages already read leave the memory
+                if _SCARTA and mm.tell() - scartato >= _SCARTA:
+                    letto = mm.tell() - mm.tell() % mmap.PAGESIZE
+                    mm.madvise(mmap.MADV_DONTNEED, scartato, letto - scartato)
+                    scartato = letto
+
+
+def operazione(riga):
+    """
+    what a line of the log says
+    :param riga: string
+    :return: None, ('w' or 'r', quando, bytes) or a tuple of stampa
+    """
+    if 'IRP_MJ_WRITE' in riga:
+        dati = leggi_dati(riga)
+        if dati is None:
+            return None
+
+        return 'w', dati[0], dati[1]
+
+    if 'IRP_MJ_READ' in riga:
+        dati = leggi_dati(riga)
+        if dati is None:
+            return None
+
+        return 'r', dati[0], dati[1]
+
+    if 'IRP_MJ_CREATE' in riga:
+        return ('o',)
+
+    if 'IOCTL_SERIAL_SET_BAUD_RATE' in riga:
+        pos = riga.find('Baud Rate:')
+        if pos == -1:
+            return None
+
+        pos += len('Baud Rate:')
+        riga = riga[pos:]
+        return 'b', int(riga)
+
+    if 'IRP_MJ_CLOSE' in riga:
+        return ('c',)
+
+    return None
 
 
 def leggi_ingresso(nfile, proto_rx, proto_tx):
-    lista_op = []
-    with open(nfile, 'rt') as ing:
-        while True:
-            riga = ing.readline()
-            if not any(riga):
-                break
-
-            if 'IRP_MJ_WRITE' in riga:
-                dati = leggi_dati(riga)
-                if dati is None:
-                    continue
-
-                proto_tx.examine(dati[1])
-                estrai(dati[0] + ' w', proto_tx, lista_op, )
+    """
+    the operations of the log, as they are decoded
+    :param nfile: name of the file
+    :param proto_rx: PROTO_RX
+    :param proto_tx: PROTO_TX
+    :return: generator of tuple (see stampa)
+    """
+    proto = {'w': proto_tx, 'r': proto_rx}
+    for riga in righe(nfile):
+        oper = operazione(riga)
+        if oper is None:
+            continue
+
+        if oper[0] in proto:
+            yield from estrai(oper[1] + ' ' + oper[0], proto[oper[0]], oper[2])
+        else:
+            yield oper
+
+
+def decodifica(nomeing, nomeusc):
+    """
+    write the messages of the log in a file, while reading it
+    :param nomeing: the log
+    :param nomeusc: the result
+    :return: n.a.
+    """
+    cy_rx = PROTO_RX()
+    cy_tx = PROTO_TX()
+
+    with open(nomeusc, 'wt') as usc:
+        for elem in leggi_ingresso(nomeing, cy_rx, cy_tx):
+            stampa(elem, usc, cy_rx, cy_tx)
+
+
+# --jobs: the log is split in pieces (at the start of a line) decoded by a
+# pool of processes, each with its framers
+# A framer has no state but the bytes of the incomplete frame: the frames
+# that straddle two pieces are found framing again the first lines of a
+# piece (until its framer emits something) with the state left by the
+# previous piece. If the two framers agree, the rest of the piece is right;
+# otherwise the piece is decoded again
+
+
+def pezzi(nfile, quanti):
+    """
+    split the file at the start of the lines
+    :param nfile: name of the file
+    :param quanti: number of pieces (at most)
+    :return: list of (start, end)
+    """
+    dim = os.path.getsize(nfile)
+    if dim == 0:
+        return []
+
+    confini = [0]
+    with open(nfile, 'rb') as ing:
+        with mmap.mmap(ing.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for num in range(1, quanti):
+                pos = mm.find(b'\n', max(confini[-1], dim * num // quanti))
+                if pos < 0:
+                    break
+                if pos + 1 < dim:
+                    confini.append(pos + 1)
+    confini.append(dim)
+    return [(confini[_], confini[_ + 1]) for _ in range(len(confini) - 1)
+            if confini[_] < confini[_ + 1]]
+
+
+def decodifica_pezzo(compito):
+    """
+    decode a piece of the log (in a process of the pool)
+    :param compito: (log, start, end, file of the result, incomplete frames
+                    {'w': bytes, 'r': bytes} or None)
+    :return: dict
+    """
+    nfile, inizio, fine, nomeusc, parziale = compito
+
+    proto = {'w': PROTO_TX(), 'r': PROTO_RX()}
+    if parziale is not None:
+        for verso in proto:
+            proto[verso].partial = parziale[verso]
+
+    # lines before (and with) the first frame: (offset in the result, line, quando, bytes)
+    testa = {'w': [], 'r': []}
+    # frames and incomplete frame of the last line of testa
+    primo = {'w': None, 'r': None}
+
+    with open(nomeusc, 'wt') as usc:
+        for indice, riga in enumerate(righe(nfile, inizio, fine)):
+            oper = operazione(riga)
+            if oper is None:
                 continue
 
-            if 'IRP_MJ_READ' in riga:
-                dati = leggi_dati(riga)
-                if dati is None:
-                    continue
-
-                proto_rx.examine(dati[1])
-                estrai(dati[0] + ' r', proto_rx, lista_op)
+            if oper[0] not in proto:
+                stampa(oper, usc, proto['r'], proto['w'])
                 continue
 
-            if 'IRP_MJ_CREATE' in riga:
-                lista_op.append(('o',))
-                continue
+            verso, quando, dati = oper
+            msgs = list(proto[verso].iter_msgs(dati))
+            if primo[verso] is None:
+                testa[verso].append((usc.tell(), indice, quando, bytes(dati)))
+                if msgs:
+                    primo[verso] = [bytes(_) for _ in msgs], proto[verso].partial
+
+            quando += ' ' + verso
+            for msg in msgs:
+                stampa((quando, msg), usc, proto['r'], proto['w'])
+
+    return {
+        'file': nomeusc,
+        'testa': testa,
+        'primo': primo,
+        'parziale': {_: proto[_].partial for _ in proto}
+    }
+
+
+def _testo(quando, verso, msgs, proto_rx, proto_tx):
+    # as stampa would write them in the result
+    tmp = io.StringIO()
+    for msg in msgs:
+        stampa((quando + ' ' + verso, msg), tmp, proto_rx, proto_tx)
+    return tmp.getvalue().replace('\n', os.linesep).encode()
+
+
+def ricuci(esito, parziale, proto_rx, proto_tx):
+    """
+    the frames that straddle the previous piece
+    :param esito: result of decodifica_pezzo
+    :param parziale: incomplete frames at the end of the previous piece
+    :return: (list of (offset in the result, line, bytes), incomplete frames
+             at the end of the piece) or None if the piece must be decoded again
+    """
+    aggiunte = []
+    dopo = {}
+    for verso, classe in (('w', PROTO_TX), ('r', PROTO_RX)):
+        proto = classe()
+        proto.partial = parziale[verso]
+        testa = esito['testa'][verso]
+        primo = esito['primo'][verso]
+
+        for num, (ofs, indice, quando, dati) in enumerate(testa):
+            msgs = [bytes(_) for _ in proto.iter_msgs(dati)]
+            if primo is not None and num == len(testa) - 1:
+                # the piece already has these
+                visti, resto = primo
+                if len(msgs) < len(visti) or msgs[len(msgs) - len(visti):] != visti \
+                        or proto.partial != resto:
+                    return None
+                msgs = msgs[:len(msgs) - len(visti)]
+            if msgs:
+                aggiunte.append((ofs, indice, _testo(quando, verso, msgs, proto_rx, proto_tx)))
+
+        if primo is None:
+            dopo[verso] = proto.partial
+        else:
+            dopo[verso] = esito['parziale'][verso]
+
+    aggiunte.sort(key=lambda _: _[:2])
+    return aggiunte, dopo
+
+
+def _unisci(nomeparte, aggiunte, usc):
+    with open(nomeparte, 'rb') as ing:
+        pos = 0
+        for ofs, _, testo in aggiunte:
+            usc.write(ing.read(ofs - pos))
+            usc.write(testo)
+            pos = ofs
+        shutil.copyfileobj(ing, usc, 1024 * 1024)
+
+
+def decodifica_parallela(nomeing, nomeusc, lavori):
+    """
+    as decodifica, with a pool of processes
+    :param nomeing: the log
+    :param nomeusc: the result
+    :param lavori: number of processes
+    :return: n.a.
+    """
+    cy_rx = PROTO_RX()
+    cy_tx = PROTO_TX()
+
+    cartella = os.path.dirname(os.path.abspath(nomeusc))
+    with tempfile.TemporaryDirectory(dir=cartella) as tmp, \
+            multiprocessing.Pool(lavori) as pool, \
+            open(nomeusc, 'wb') as usc:
+        compiti = [
+            (nomeing, inizio, fine, os.path.join(tmp, '{:06d}'.format(num)), None)
+            for num, (inizio, fine) in enumerate(pezzi(nomeing, lavori * 4))
+        ]
+
+        parziale = {'w': b'', 'r': b''}
+        for compito, esito in zip(compiti, pool.imap(decodifica_pezzo, compiti)):
+            cucito = ricuci(esito, parziale, cy_rx, cy_tx)
+            if cucito is None:
+                # with the real state
+                os.remove(esito['file'])
+                esito = decodifica_pezzo(compito[:4] + (parziale,))
+                cucito = [], esito['parziale']
+
+            aggiunte, parziale = cucito
+            _unisci(esito['file'], aggiunte, usc)
+            os.remove(esito['file'])
+
+
+# index: the sidecar diario.idx has, every _BLOCCO bytes of the log, the
+# state of the framers and the times, and for every command/event the
+# blocks where it is, so a query decodes only those blocks
+_BLOCCO = 64 * 1024
+_VERSIONE = 1
+_U16 = struct.Struct('<H')
+
+
+def chiavi(verso, msg):
+    """
+    what the index knows of a message
+    :param verso: 'w' or 'r'
+    :param msg: message (without header)
+    :return: list of ('w', command), ('r', event) and, for the status
+             of a command, ('s', command)
+    """
+    if verso == 'w':
+        if len(msg) < 2:
+            return []
+        return [('w', _U16.unpack_from(msg)[0])]
+
+    if len(msg) < 4:
+        return []
+    evn = _U16.unpack_from(msg, 2)[0]
+    if evn in (EVT_COMMAND_STATUS, EVT_COMMAND_COMPLETE) and len(msg) >= 6:
+        return [('r', evn), ('s', _U16.unpack_from(msg, 4)[0])]
+    return [('r', evn)]
+
+
+def nome_indice(nfile):
+    return nfile + '.idx'
+
+
+def _firma(nfile):
+    stato = os.stat(nfile)
+    return stato.st_size, stato.st_mtime_ns
+
+
+def indicizza(nfile):
+    """
+    build the index of the log and save it in the sidecar
+    :param nfile: name of the log
+    :return: dict (the index)
+    """
+    proto = {'w': PROTO_TX(), 'r': PROTO_RX()}
+
+    # (start, end, first time, last time, state of the framers at the start)
+    blocchi = []
+    # key (see chiavi) -> blocks
+    codici = {}
+
+    def chiudi(fine):
+        blocchi.append((inizio, fine, tempi[0], tempi[1], stato))
+        for chiave in visti:
+            codici.setdefault(chiave, []).append(len(blocchi) - 1)
+
+    inizio = 0
+    stato = {'w': b'', 'r': b''}
+    tempi = [None, None]
+    visti = set()
+    for pos, riga in righe(nfile, posizioni=True):
+        if pos - inizio >= _BLOCCO:
+            chiudi(pos)
+            inizio = pos
+            stato = {_: proto[_].partial for _ in proto}
+            tempi = [None, None]
+            visti = set()
+
+        oper = operazione(riga)
+        if oper is None or oper[0] not in proto:
+            continue
+
+        verso, quando, dati = oper
+        if tempi[0] is None or quando < tempi[0]:
+            tempi[0] = quando
+        if tempi[1] is None or quando > tempi[1]:
+            tempi[1] = quando
+        for msg in proto[verso].iter_msgs(dati):
+            visti.update(chiavi(verso, msg))
+
+    dim = os.path.getsize(nfile)
+    if dim > inizio:
+        chiudi(dim)
+
+    indice = {
+        'versione': _VERSIONE,
+        'firma': _firma(nfile),
+        'blocchi': blocchi,
+        'codici': codici
+    }
+    with open(nome_indice(nfile), 'wb') as usc:
+        pickle.dump(indice, usc, pickle.HIGHEST_PROTOCOL)
+    return indice
+
+
+def leggi_indice(nfile):
+    """
+    the index of the log (built if missing or old)
+    :param nfile: name of the log
+    :return: dict (see indicizza)
+    """
+    try:
+        with open(nome_indice(nfile), 'rb') as ing:
+            indice = pickle.load(ing)
+        if indice['versione'] == _VERSIONE and indice['firma'] == _firma(nfile):
+            return indice
+    except (OSError, EOFError, KeyError, TypeError, pickle.UnpicklingError):
+        pass
+    return indicizza(nfile)
+
+
+def _esadecimale(elem):
+    try:
+        return int(elem, 16)
+    except ValueError:
+        return None
 
-            if 'IOCTL_SERIAL_SET_BAUD_RATE' in riga:
-                pos = riga.find('Baud Rate:')
-                if pos == -1:
-                    continue
 
-                pos += len('Baud Rate:')
-                riga = riga[pos:]
-                lista_op.append(('b', int(riga)))
+def _scelte(indice, comandi, eventi):
+    scelte = set()
+    for verso, cod in indice['codici']:
+        if verso in ('w', 's'):
+            nomi = comandi
+            nome = nome_comando(cod)
+        else:
+            nomi = eventi
+            nome = quale_evento(cod)
+        for elem in nomi:
+            if elem == nome or _esadecimale(elem) == cod:
+                scelte.add((verso, cod))
+    return scelte
+
+
+def cerca(nfile, dove, da=None, a=None, comandi=(), eventi=()):
+    """
+    write the messages of the log that match, decoding only the blocks
+    that the index says
+    :param nfile: name of the log
+    :param dove: where to write (see stampa)
+    :param da: first time (e.g. '2022-08-05 09:59:06', compared as text)
+    :param a: last time (included at its precision)
+    :param comandi: names (Cmd_...) or hex codes of the commands: the
+                    commands and their EVT_COMMAND_STATUS/COMPLETE
+    :param eventi: names (EVT_...) or hex codes of the events
+    :return: number of messages written
+    """
+    indice = leggi_indice(nfile)
+    blocchi = indice['blocchi']
+
+    scelte = None
+    if comandi or eventi:
+        scelte = _scelte(indice, comandi, eventi)
+        numeri = sorted({_ for chiave in scelte for _ in indice['codici'][chiave]})
+    else:
+        numeri = range(len(blocchi))
+
+    def nel_tempo(quando):
+        if da is not None and quando < da:
+            return False
+        if a is not None and quando[:len(a)] > a:
+            return False
+        return True
+
+    quanti = 0
+    cy_rx = PROTO_RX()
+    cy_tx = PROTO_TX()
+    for num in numeri:
+        inizio, fine, primo, ultimo, stato = blocchi[num]
+        if da is not None or a is not None:
+            if primo is None:
                 continue
-
-            if 'IRP_MJ_CLOSE' in riga:
-                lista_op.append(('c',))
+            if da is not None and ultimo < da or a is not None and primo[:len(a)] > a:
                 continue
-    return lista_op
 
+        proto = {'w': PROTO_TX(), 'r': PROTO_RX()}
+        for verso in proto:
+            proto[verso].partial = stato[verso]
 
-if __name__ == '__main__':
-    if len(sys.argv) == 2:
-        nomeing = sys.argv[1]
-        nomeusc = nomeing + '.txrx'
+        for riga in righe(nfile, inizio, fine):
+            oper = operazione(riga)
+            if oper is None:
+                continue
 
-        cy_rx = PROTO_RX()
-        cy_tx = PROTO_TX()
+            if oper[0] not in proto:
+                if scelte is None and da is None and a is None:
+                    stampa(oper, dove, cy_rx, cy_tx)
+                continue
 
-        # recupero solo quello che serve
-        operazioni = leggi_ingresso(nomeing, cy_rx, cy_tx)
+            verso, quando, dati = oper
+            for msg in proto[verso].iter_msgs(dati):
+                if not nel_tempo(quando):
+                    continue
+                if scelte is not None and scelte.isdisjoint(chiavi(verso, msg)):
+                    continue
+                stampa((quando + ' ' + verso, msg), dove, cy_rx, cy_tx)
+                quanti += 1
+    return quanti
 
-        # salvo operazioni
-        with open(nomeusc, 'wt') as usc:
-            for elem in operazioni:
-                stampa(elem, usc, cy_rx, cy_tx)
 
+if __name__ == '__main__':
+    ARGOMENTI = argparse.ArgumentParser(description='Decode the log of the dongle')
+    ARGOMENTI.add_argument('diario', help='the log (the result is diario.txrx)')
+    ARGOMENTI.add_argument('--jobs', type=int, default=1, help='number of processes')
+    ARGOMENTI.add_argument('--index', action='store_true', help='(re)build diario.idx')
+    ARGOMENTI.add_argument('--from', dest='da', help='first time, e.g. "2022-08-05 09:59:06"')
+    ARGOMENTI.add_argument('--to', dest='a', help='last time')
+    ARGOMENTI.add_argument('--opcode', action='append', default=[],
+                           help='command (name or hex), with its status')
+    ARGOMENTI.add_argument('--event', action='append', default=[], help='event (name or hex)')
+    ARG = ARGOMENTI.parse_args()
+
+    if ARG.index:
+        indicizza(ARG.diario)
+    elif ARG.da or ARG.a or ARG.opcode or ARG.event:
+        # what is found goes on the standard output
+        cerca(ARG.diario, sys.stdout, ARG.da, ARG.a, ARG.opcode, ARG.event)
+    elif ARG.jobs > 1:
+        decodifica_parallela(ARG.diario, ARG.diario + '.txrx', ARG.jobs)
     else:
-        print('Passare il file del diario')
+        decodifica(ARG.diario, ARG.diario + '.txrx')
@@ -0,0 +1,93 @@
+"""
+CY567x against the simulated dongle (cysim)
+"""
+import os
+import pty
+import select
+import struct
+import threading
+import tty
+import unittest
+
+import cycost as cc
+import CY567x
+from cyproto import PROTO_TX
+from cysim import SIMULATORE, evento
+
+
+class TestComandi(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = SIMULATORE()
+        self.dongle = CY567x.CY567x(porta=self.sim.porta)
+        self.assertTrue(self.dongle.is_ok())
+
+    def tearDown(self):
+        self.dongle.close()
+        self.sim.close()
+
+    def test_parametri_sbagliati(self):
+        self.assertTrue(self.dongle.connect('00:11:22:33:44:55'))
+        # the handle does not fit in a u16: the caller gets the error
+        with self.assertRaises(struct.error):
+            self.dongle.write_characteristic_value(0x10000, b'x')
+        # and the thread of the dongle is still there
+        self.assertTrue(self.dongle.is_alive())
+        self.assertTrue(self.dongle.write_characteristic_value(0x0010, b'x'))
+        self.assertTrue(self.dongle.init_ble_stack())
+        self.assertEqual(self.dongle.command['volo'], {})
+
+
+class TestRisposteTardive(unittest.TestCase):
+    """
+    the test is the dongle: it answers when it wants
+    """
+
+    def setUp(self):
+        self.master, slave = pty.openpty()
+        tty.setraw(slave)
+        self.addCleanup(os.close, slave)
+        self.addCleanup(os.close, self.master)
+        self.dongle = CY567x.CY567x(porta=os.ttyname(slave))
+        self.addCleanup(self.dongle.close)
+        self.proto = PROTO_TX()
+
+    def _ricevi(self, to=2):
+        # the opcode of the next command sent by the dongle
+        while True:
+            msg = self.proto.get_msg()
+            if msg is not None:
+                return struct.unpack_from('<H', msg)[0]
+            pronti, _, _ = select.select([self.master], [], [], to)
+            if not pronti:
+                return None
+            self.proto.examine(os.read(self.master, 4096))
+
+    def _rispondi(self, cod, stato):
+        os.write(self.master, evento(cc.EVT_COMMAND_STATUS, struct.pack('<2H', cod, 0)) +
+                 evento(cc.EVT_COMMAND_COMPLETE, struct.pack('<2H', cod, stato)))
+
+    def test_risposta_tardiva(self):
+        cod = CY567x.CY567x.Cmd_Init_Ble_Stack_Api
+        primo = CY567x._COMMAND(cod, to=0.2)
+        self.assertFalse(self.dongle._send_command_and_wait(primo))
+        self.assertEqual(self._ricevi(), cod)
+
+        risul = []
+        secondo = threading.Thread(target=lambda: risul.append(self.dongle.init_ble_stack()))
+        secondo.start()
+        # the aborted one still has the window
+        self.assertIsNone(self._ricevi(0.2))
+
+        # the late answer (an error) is the first one's
+        self._rispondi(cod, 1)
+        self.assertEqual(self._ricevi(), cod)
+        self._rispondi(cod, 0)
+        secondo.join(2)
+        self.assertEqual(risul, [True])
+        self.assertEqual(self.dongle.command['volo'], {})
+        self.assertEqual(self.dongle.command['senza_stato'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
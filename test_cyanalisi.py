@@ -0,0 +1,65 @@
+"""
+cyanalisi: pairing of commands and answers
+"""
+import unittest
+
+import numpy as np
+
+import cyanalisi
+from cycost import EVT_COMMAND_STATUS, EVT_COMMAND_COMPLETE
+
+_CMD = 0xFE06
+
+
+def _frame(eventi):
+    """
+    :param eventi: list of (time, direction, code, command)
+    :return: cfr cyanalisi.carica
+    """
+    eventi = sorted(eventi)
+    return {
+        'tempo': np.array([_[0] for _ in eventi], dtype=np.float64),
+        'verso': np.array([_[1] for _ in eventi], dtype=np.uint8),
+        'codice': np.array([_[2] for _ in eventi], dtype=np.uint16),
+        'comando': np.array([_[3] for _ in eventi], dtype=np.int32),
+        'dim': np.full(len(eventi), 10, dtype=np.uint32),
+        'attributo': np.full(len(eventi), -1, dtype=np.int32),
+    }
+
+
+def _comando(quando, stato=0.002, fine=0.010):
+    eventi = [(quando, cyanalisi.TX, _CMD, -1)]
+    if stato is not None:
+        eventi.append((quando + stato, cyanalisi.RX, EVT_COMMAND_STATUS, _CMD))
+    if fine is not None:
+        eventi.append((quando + fine, cyanalisi.RX, EVT_COMMAND_COMPLETE, _CMD))
+    return eventi
+
+
+class TestLatenze(unittest.TestCase):
+
+    def test_orfano_e_perso(self):
+        # the log starts with the complete of a command of the previous file
+        eventi = [(0.5, cyanalisi.RX, EVT_COMMAND_COMPLETE, _CMD)]
+        for quando in (1.0, 2.0, 3.0):
+            eventi += _comando(quando)
+        # no complete: the driver gives up after 5 s and the next command comes
+        eventi += _comando(4.0, fine=None)
+        eventi += _comando(10.0)
+
+        stato, completo = cyanalisi.latenze(_frame(eventi))[_CMD]
+        np.testing.assert_allclose(stato, [0.002] * 5)
+        np.testing.assert_allclose(completo, [0.010] * 4)
+
+    def test_finestra(self):
+        # two commands in flight: the answers in the same order
+        eventi = [(1.0, cyanalisi.TX, _CMD, -1), (1.1, cyanalisi.TX, _CMD, -1),
+                  (1.2, cyanalisi.RX, EVT_COMMAND_COMPLETE, _CMD),
+                  (1.3, cyanalisi.RX, EVT_COMMAND_COMPLETE, _CMD)]
+
+        _, completo = cyanalisi.latenze(_frame(eventi))[_CMD]
+        np.testing.assert_allclose(completo, [0.2, 0.2])
+
+
+if __name__ == '__main__':
+    unittest.main()
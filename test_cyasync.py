@@ -0,0 +1,132 @@
+"""
+AsyncCY567x against the simulated dongle (cysim)
+"""
+import asyncio
+import time
+import unittest
+
+import CY567x
+from cyasync import AsyncCY567x
+from cysim import SIMULATORE
+
+
+class TestSegnali(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = SIMULATORE(cifratura=0.3)
+        self.dongle = CY567x.CY567x(porta=self.sim.porta)
+        self.assertTrue(self.dongle.is_ok())
+
+    def tearDown(self):
+        self.dongle.close()
+        self.sim.close()
+
+    def test_wait_encryption(self):
+        async def accoppia():
+            acy = AsyncCY567x(self.dongle)
+            try:
+                self.assertTrue(await acy.connect('00:11:22:33:44:55'))
+                self.assertTrue(await acy.pairing_passkey(123456))
+                # the dongle wakes up the loop: no timeout
+                inizio = time.monotonic()
+                self.assertTrue(await acy.wait_encryption(5))
+                return time.monotonic() - inizio
+            finally:
+                acy.close()
+
+        durata = asyncio.run(accoppia())
+        self.assertLess(durata, 2)
+        self.assertTrue(self.dongle.sincro['encrypt'].is_set())
+        self.assertTrue(self.dongle.sincro['keyinfo'].is_set())
+
+
+class TestComandi(unittest.TestCase):
+
+    def setUp(self):
+        # the answers come late
+        self.sim = SIMULATORE(esecuzione=0.5)
+        self.dongle = CY567x.CY567x(porta=self.sim.porta)
+        self.assertTrue(self.dongle.is_ok())
+
+    def tearDown(self):
+        self.dongle.close()
+        self.sim.close()
+
+    def test_cancellato(self):
+        async def cancella():
+            acy = AsyncCY567x(self.dongle)
+            compito = asyncio.ensure_future(acy.init_ble_stack())
+            await asyncio.sleep(0.1)
+            compito.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await compito
+            await asyncio.sleep(0.1)
+            # aborted, waiting for its answer
+            volo = self.dongle.command['volo'][CY567x.CY567x.Cmd_Init_Ble_Stack_Api]
+            self.assertTrue(volo[0].annullato)
+
+            # the answer takes it away
+            for _ in range(100):
+                if self.dongle.command['volo'] == {}:
+                    break
+                await asyncio.sleep(0.01)
+            self.assertEqual(self.dongle.command['volo'], {})
+            self.assertTrue(await acy.init_ble_stack())
+
+        asyncio.run(cancella())
+
+class TestFlussi(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = SIMULATORE(adv=1000)
+        self.dongle = CY567x.CY567x(porta=self.sim.porta)
+        self.assertTrue(self.dongle.is_ok())
+
+    def tearDown(self):
+        self.dongle.close()
+        self.sim.close()
+
+    def test_fine(self):
+        async def consuma(flusso):
+            quanti = 0
+            async for _ in flusso:
+                quanti += 1
+            return quanti
+
+        async def scansiona():
+            acy = AsyncCY567x(self.dongle)
+            primo = asyncio.ensure_future(consuma(acy.adverts()))
+            flusso = acy.adverts()
+            secondo = asyncio.ensure_future(consuma(flusso))
+            self.assertTrue(await acy.scan_start())
+            await asyncio.sleep(0.2)
+
+            # the consumers do not wait forever
+            flusso.close()
+            self.assertGreater(await asyncio.wait_for(secondo, 1), 0)
+            self.assertTrue(await acy.scan_stop())
+            acy.close()
+            self.assertGreater(await asyncio.wait_for(primo, 1), 0)
+
+        asyncio.run(scansiona())
+
+    def test_loop_chiuso(self):
+        async def abbandona():
+            acy = AsyncCY567x(self.dongle)
+            self.assertTrue(await acy.scan_start())
+            await asyncio.sleep(0.1)
+
+        # the loop is closed, the advertisements still come
+        asyncio.run(abbandona())
+        adv = self.sim.contatori['adv']
+        for _ in range(100):
+            if self.sim.contatori['adv'] > adv + 100:
+                break
+            time.sleep(0.01)
+        self.assertTrue(self.dongle.is_alive())
+        self.assertTrue(self.dongle.scan_stop())
+        self.assertTrue(self.dongle.init_ble_stack())
+
+
+if __name__ == '__main__':
+    unittest.main()
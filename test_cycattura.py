@@ -0,0 +1,54 @@
+"""
+CATTURA when the disk or the thread do not keep up
+"""
+import os
+import tempfile
+import unittest
+
+import cycattura
+
+
+class TestCattura(unittest.TestCase):
+
+    def setUp(self):
+        cartella = tempfile.TemporaryDirectory()
+        self.addCleanup(cartella.cleanup)
+        self.cartella = cartella.name
+
+    def test_coda_piena(self):
+        cattura = cycattura.CATTURA(os.path.join(self.cartella, 'piena'), coda_max=1)
+        for _ in range(10000):
+            cattura.rx(b'x' * 100)
+        cattura.close()
+
+        # nothing waits, nothing is lost without being counted
+        self.assertGreater(cattura.contatori['persi'], 0)
+        self.assertEqual(cattura.contatori['record'] + cattura.contatori['persi'], 10000)
+        scritti = sum(1 for nf in cycattura.file_della_cattura(cattura.nome)
+                      for _ in cycattura.leggi(nf))
+        self.assertEqual(scritti, cattura.contatori['record'])
+
+    def test_errore_del_file(self):
+        sotto = os.path.join(self.cartella, 'sotto')
+        os.mkdir(sotto)
+        cattura = cycattura.CATTURA(os.path.join(sotto, 'rotta'), dim_max=1000)
+        # the rotation cannot open the next file
+        os.remove(cycattura.nome_file(cattura.nome, 0))
+        os.rmdir(sotto)
+
+        for _ in range(100):
+            cattura.tx(b'x' * 100)
+        cattura.close()
+
+        self.assertFalse(cattura.attiva)
+        self.assertFalse(cattura.is_alive())
+        self.assertEqual(cattura.contatori['record'] + cattura.contatori['persi'], 100)
+        self.assertLess(cattura.contatori['record'], 100)
+
+        # after close too
+        cattura.rx(b'x')
+        self.assertEqual(cattura.contatori['persi'], 101 - cattura.contatori['record'])
+
+
+if __name__ == '__main__':
+    unittest.main()
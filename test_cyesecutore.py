@@ -0,0 +1,155 @@
+"""
+ESECUTORE: policies of the rings, counters, close
+"""
+import threading
+import time
+import unittest
+
+import CY567x
+import cyesecutore as ce
+from cysim import SIMULATORE
+
+
+class TestEsecutore(unittest.TestCase):
+
+    def _esecutore(self, dim, politica):
+        esecutore = ce.ESECUTORE(classi={'scan': (dim, politica)})
+        self.addCleanup(esecutore.close)
+        self.fatti = []
+        # the worker waits inside the first callback
+        self.via = threading.Event()
+        partito = threading.Event()
+
+        def tappo():
+            partito.set()
+            self.via.wait(5)
+
+        self.assertTrue(esecutore.esegui('scan', tappo))
+        self.assertTrue(partito.wait(2))
+        return esecutore
+
+    def test_drop_oldest(self):
+        esecutore = self._esecutore(3, ce.DROP_OLDEST)
+        for indice in range(5):
+            self.assertTrue(esecutore.esegui('scan', self.fatti.append, indice))
+        self.assertEqual(esecutore.in_coda()['scan'], 3)
+        self.via.set()
+        self.assertTrue(esecutore.svuota(2))
+
+        self.assertEqual(self.fatti, [2, 3, 4])
+        self.assertEqual(esecutore.contatori['scan'], {
+            'accodati': 6, 'persi': 2, 'eseguiti': 4, 'errori': 0, 'massimo': 3})
+
+    def test_drop_newest(self):
+        esecutore = self._esecutore(3, ce.DROP_NEWEST)
+        esiti = [esecutore.esegui('scan', self.fatti.append, _) for _ in range(5)]
+        self.assertEqual(esiti, [True, True, True, False, False])
+        self.via.set()
+        self.assertTrue(esecutore.svuota(2))
+
+        self.assertEqual(self.fatti, [0, 1, 2])
+        self.assertEqual(esecutore.contatori['scan']['persi'], 2)
+
+    def test_block(self):
+        esecutore = self._esecutore(2, ce.BLOCK)
+        esiti = []
+        produttore = threading.Thread(
+            target=lambda: esiti.extend(esecutore.esegui('scan', self.fatti.append, _)
+                                        for _ in range(3)))
+        produttore.start()
+        # the third waits for room
+        produttore.join(0.2)
+        self.assertTrue(produttore.is_alive())
+
+        self.via.set()
+        produttore.join(2)
+        self.assertTrue(esecutore.svuota(2))
+        self.assertEqual(esiti, [True, True, True])
+        self.assertEqual(self.fatti, [0, 1, 2])
+        self.assertEqual(esecutore.contatori['scan']['persi'], 0)
+
+    def test_close_con_produttore_bloccato(self):
+        esecutore = self._esecutore(2, ce.BLOCK)
+        esiti = []
+        produttore = threading.Thread(
+            target=lambda: esiti.extend(esecutore.esegui('scan', self.fatti.append, _)
+                                        for _ in range(3)))
+        produttore.start()
+        produttore.join(0.2)
+
+        chiudi = threading.Thread(target=esecutore.close)
+        chiudi.start()
+        # the producer does not wait anymore, its callback is lost
+        produttore.join(2)
+        self.assertFalse(produttore.is_alive())
+        self.assertEqual(esiti, [True, True, False])
+
+        # what is in the ring still runs
+        self.via.set()
+        chiudi.join(2)
+        self.assertFalse(chiudi.is_alive())
+        self.assertEqual(self.fatti, [0, 1])
+        self.assertEqual(esecutore.contatori['scan']['persi'], 1)
+        self.assertFalse(esecutore.esegui('scan', self.fatti.append, 3))
+
+    def test_errore(self):
+        esecutore = ce.ESECUTORE()
+        self.addCleanup(esecutore.close)
+        fatti = []
+
+        def rotta():
+            raise ValueError('rotta')
+
+        esecutore.esegui('gap', rotta)
+        esecutore.esegui('gap', fatti.append, 1)
+        self.assertTrue(esecutore.svuota(2))
+        # the worker is still there
+        self.assertEqual(fatti, [1])
+        self.assertEqual(esecutore.contatori['gap']['errori'], 1)
+        self.assertEqual(esecutore.contatori['gap']['eseguiti'], 1)
+
+    def test_classe_sbagliata(self):
+        with self.assertRaises(Exception):
+            ce.ESECUTORE(classi={'scan': (0, ce.BLOCK)})
+        with self.assertRaises(Exception):
+            ce.ESECUTORE(classi={'scan': (10, 'BOH')})
+
+
+class _CONTA(CY567x.CY567x):
+    """
+    remembers where its callbacks run
+    """
+
+    def __init__(self, **kwargs):
+        self.thread = set()
+        self.adv = 0
+        CY567x.CY567x.__init__(self, **kwargs)
+
+    def scan_progress_cb(self, adv):
+        self.thread.add(threading.current_thread().name)
+        self.adv += 1
+
+
+class TestDongle(unittest.TestCase):
+
+    def test_esecutore(self):
+        sim = SIMULATORE(adv=500)
+        esecutore = ce.ESECUTORE()
+        dongle = _CONTA(porta=sim.porta, esecutore=esecutore)
+        try:
+            self.assertTrue(dongle.scan_start())
+            time.sleep(0.3)
+            self.assertTrue(dongle.scan_stop())
+            self.assertTrue(esecutore.svuota(2))
+
+            self.assertGreater(dongle.adv, 0)
+            self.assertEqual(dongle.thread, {'esecutore0'})
+            self.assertEqual(esecutore.contatori['scan']['eseguiti'], dongle.adv)
+        finally:
+            dongle.close()
+            esecutore.close()
+            sim.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
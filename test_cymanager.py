@@ -0,0 +1,73 @@
+"""
+DongleManager with simulated dongles (cysim)
+"""
+import unittest
+
+import CY567x
+import ghost
+from cymanager import DongleManager
+from cysim import SIMULATORE
+
+
+class _ROTTO(CY567x.CY567x):
+    """
+    a dongle whose callback raises in the thread of the manager
+    """
+    rotto = False
+
+    def scan_progress_cb(self, adv):
+        if self.rotto:
+            raise ValueError('rotto')
+
+
+class TestGestore(unittest.TestCase):
+
+    def test_un_dongle_rotto(self):
+        sim = [SIMULATORE(adv=100), SIMULATORE()]
+        gestore = DongleManager(porte=[_.porta for _ in sim], classe=_ROTTO)
+        try:
+            self.assertEqual(len(gestore.dongle), 2)
+            rotto, buono = gestore.dongle
+            rotto.rotto = True
+
+            self.assertTrue(rotto.scan_start())
+            self.assertTrue(rotto.fermo.wait(2))
+
+            # the other one is still served
+            self.assertTrue(gestore.is_alive())
+            for _ in range(10):
+                self.assertTrue(buono.init_ble_stack())
+
+            # and it is the only one that can be leased
+            self.assertIs(gestore.lease(0.5), buono)
+            self.assertIsNone(gestore.lease(0.2))
+            gestore.release(buono)
+            gestore.release(rotto)
+            for _ in range(3):
+                with gestore.leased(0.5) as dongle:
+                    self.assertIs(dongle, buono)
+                    self.assertIsNone(gestore.lease(0.1))
+
+        finally:
+            gestore.close()
+            for _ in sim:
+                _.close()
+
+
+    def test_ghost(self):
+        sim = SIMULATORE()
+        gestore = DongleManager(porte=[sim.porta], classe=ghost.GHOST)
+        try:
+            with gestore.leased(1) as dongle:
+                self.assertIsInstance(dongle, ghost.GHOST)
+                self.assertIs(dongle.gestore, gestore)
+                # its __init__ talked to the dongle through the manager
+                self.assertIsNotNone(dongle.mio)
+                self.assertTrue(dongle.init_ble_stack())
+        finally:
+            gestore.close()
+            sim.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+"""
+Framing of the stream of the dongle
+"""
+import unittest
+
+import cyproto
+from cysim import evento
+
+
+class TestFrame(unittest.TestCase):
+
+    def test_pezzi(self):
+        flusso = b''.join(evento(0x0400 + _, bytes(range(_))) for _ in range(20))
+        # some garbage, then the frames split everywhere
+        flusso = b'\xBD\x00\x55' + flusso
+        for dim in (1, 3, 7, len(flusso)):
+            proto = cyproto.PROTO_RX()
+            msgs = []
+            for ini in range(0, len(flusso), dim):
+                msgs += [bytes(_) for _ in proto.iter_msgs(flusso[ini:ini + dim])]
+            self.assertEqual([proto.decompose(_).evn for _ in msgs],
+                             [0x0400 + _ for _ in range(20)])
+
+    def test_comandi(self):
+        proto = cyproto.PROTO_TX()
+        cmd = proto.compose({'cod': 0xFE99, 'prm': None, 'dati': b'\x04\x00'})
+        msgs = [bytes(_) for _ in proto.iter_msgs(cmd + cmd[:5])]
+        msgs += [bytes(_) for _ in proto.iter_msgs(cmd[5:])]
+        self.assertEqual(msgs, [cmd[2:], cmd[2:]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+"""
+REGISTRO: columns, statistics of the devices, .npz
+"""
+import os
+import struct
+import tempfile
+import unittest
+
+import numpy as np
+
+import cyregistro
+
+A = 0x0000C0000001
+B = 0x0000C0000002
+
+
+def rapporto(bda, rssi, dati=b'', adv=0, tipo_bda=0):
+    """
+    what Send_advt_report gives
+    :param bda: address as an integer
+    :param rssi: dBm
+    :param dati: content of the advertisement
+    :param adv: type of advertisement
+    :param tipo_bda: type of address
+    :return: bytes
+    """
+    return struct.pack('<BIHBbB', adv, bda & 0xFFFFFFFF, bda >> 32,
+                       tipo_bda, rssi, len(dati)) + dati
+
+
+class _OROLOGIO:
+    """
+    the time is what the test says
+    """
+
+    def __init__(self):
+        self.ora = 100.0
+
+    def __call__(self):
+        return self.ora
+
+
+class TestRegistro(unittest.TestCase):
+
+    def setUp(self):
+        self.orologio = _OROLOGIO()
+        self.reg = cyregistro.REGISTRO(orologio=self.orologio)
+        # A: three times in two seconds, B once, without data
+        for ora, bda, rssi, dati in ((100.0, A, -40, b'\x02\x01\x06'),
+                                     (100.5, B, -70, b''),
+                                     (101.0, A, -60, b'\x03\x03\xAA\xFE'),
+                                     (102.0, A, -50, b'\x02\x01\x04')):
+            self.orologio.ora = ora
+            self.reg(rapporto(bda, rssi, dati, adv=4 if dati else 0, tipo_bda=1))
+        # too short: ignored
+        self.reg(b'\x00\x01\x02')
+
+    def test_colonne(self):
+        self.assertEqual(len(self.reg), 4)
+        col = self.reg.colonne()
+        self.assertEqual(col['bda'].tolist(), [A, B, A, A])
+        self.assertEqual(col['tempo'].tolist(), [100.0, 100.5, 101.0, 102.0])
+        self.assertEqual(col['rssi'].tolist(), [-40, -70, -60, -50])
+        self.assertEqual(col['adv'].tolist(), [4, 0, 4, 4])
+        self.assertEqual(col['tipo_bda'].tolist(), [1] * 4)
+
+        self.assertEqual([cyregistro.dati(col, _) for _ in range(4)],
+                         [b'\x02\x01\x06', b'', b'\x03\x03\xAA\xFE', b'\x02\x01\x04'])
+        self.assertEqual(self.reg.memoria(), 10 + 4 * (8 + 8 + 1 + 1 + 1 + 8))
+
+        # a copy: what comes after is not there
+        self.reg(rapporto(B, -80))
+        self.assertEqual(len(col['bda']), 4)
+
+    def test_dispositivi(self):
+        disp = cyregistro.dispositivi(self.reg.colonne())
+        self.assertEqual(disp['bda'].tolist(), [A, B])
+        self.assertEqual(disp['quanti'].tolist(), [3, 1])
+        self.assertEqual(disp['primo'].tolist(), [100.0, 100.5])
+        self.assertEqual(disp['ultimo'].tolist(), [102.0, 100.5])
+        # two intervals in two seconds, nothing for who was seen once
+        self.assertEqual(disp['ritmo'].tolist(), [1.0, 0.0])
+        self.assertEqual(disp['rssi_min'].tolist(), [-60, -70])
+        self.assertEqual(disp['rssi_max'].tolist(), [-40, -70])
+        self.assertEqual(disp['rssi_medio'].tolist(), [-50.0, -70.0])
+
+        self.assertEqual(cyregistro.stringa_da_bda(disp['bda'][0]), '00:00:C0:00:00:01')
+
+    def test_vuoto(self):
+        col = cyregistro.REGISTRO().colonne()
+        self.assertEqual(len(col['arena']), 0)
+        self.assertEqual(len(col['fine']), 0)
+        disp = cyregistro.dispositivi(col)
+        for val in disp.values():
+            self.assertEqual(len(val), 0)
+
+    def test_salva_carica(self):
+        with tempfile.TemporaryDirectory() as cartella:
+            nomefile = os.path.join(cartella, 'registro.npz')
+            self.reg.salva(nomefile)
+            col = cyregistro.carica(nomefile)
+
+        prima = self.reg.colonne()
+        self.assertEqual(sorted(col), sorted(prima))
+        for nome, val in prima.items():
+            self.assertEqual(col[nome].dtype, val.dtype, nome)
+            np.testing.assert_array_equal(col[nome], val)
+        self.assertEqual(cyregistro.dati(col, 2), b'\x03\x03\xAA\xFE')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,190 @@
+"""
+GHOST against the simulated dongle (cysim)
+"""
+import os
+import queue
+import tempfile
+import unittest
+
+import cyarchivio
+import ghost
+import privacy
+import scan_util
+from cysim import SIMULATORE
+
+NORM = ('C0:00:00:00:00:01', 'ABCDE000001')
+CONF = ('C0:00:00:00:00:02', 'ABCDE000002')
+
+SEGRETO = bytes(range(16))
+
+
+def avviso(cp, srv=ghost.srv_norm):
+    """
+    what a ghost advertises
+    :param cp: serial number
+    :param srv: ghost.srv_norm or ghost.srv_conf
+    :return: bytes
+    """
+    sdata = scan_util.ba_from_stringuuid(srv) + ghost.service_data_from(cp)
+    # flags, 128 bit service data
+    return b'\x02\x01\x06' + bytes([len(sdata) + 1, 0x21]) + sdata
+
+
+def sfida(sim):
+    """
+    the ghost in the simulator challenges who connects
+    :param sim: SIMULATORE
+    :return: the challenge (bytes)
+    """
+    testo = bytes(range(100, 116))
+    sim.attributi[ghost.CYBLE_SERVICE_AUTHOR_CHAR_HANDLE] = \
+        privacy.PRIVACY(SEGRETO).crypt(testo)
+    return testo
+
+
+class TestTrova(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = SIMULATORE(adv=500, dispositivi=20, altri=(
+            (NORM[0], avviso(NORM[1])),
+            (CONF[0], avviso(CONF[1], ghost.srv_conf))))
+        self.dongle = ghost.GHOST(porta=self.sim.porta)
+        self.assertIsNotNone(self.dongle.mio)
+
+    def tearDown(self):
+        self.dongle.close()
+        self.sim.close()
+
+    def test_find(self):
+        sr = self.dongle.find(CONF[1], to=5)
+        self.assertIsNotNone(sr)
+        self.assertEqual(sr['bda'], CONF[0])
+        self.assertEqual(sr['fase'], 'CONF')
+
+        self.assertIsNone(self.dongle.find('ABCDE000003', to=0.5))
+
+    def test_start_find(self):
+        coda = queue.Queue()
+        self.assertTrue(self.dongle.start_find(coda, intervallo=None))
+        # only one for each ghost, the others never
+        trovati = [coda.get(True, 5), coda.get(True, 5)]
+        with self.assertRaises(queue.Empty):
+            coda.get(True, 0.5)
+        self.assertTrue(self.dongle.stop_find())
+
+        self.assertEqual(sorted((_['bda'], _['prod'], _['fase']) for _ in trovati),
+                         [NORM + ('NORM',), CONF + ('CONF',)])
+        self.assertGreater(self.dongle.tabella.visti, self.dongle.tabella.passati)
+
+
+class TestConnessione(unittest.TestCase):
+
+    def _apri(self, **kwargs):
+        self.sim = SIMULATORE(**kwargs)
+        self.addCleanup(self.sim.close)
+        self.sfida = sfida(self.sim)
+        self.dongle = ghost.GHOST(porta=self.sim.porta)
+        self.addCleanup(self.dongle.close)
+
+    def test_connect_to(self):
+        self._apri(cifratura=0.2)
+        self.assertTrue(self.dongle.connect_to(NORM[0], 'NORM', SEGRETO, to=2))
+        # a ghost has a random address
+        self.assertEqual(self.sim.tentativi, [(NORM[0], 1)])
+        self.assertEqual(list(self.dongle.durate), [
+            'connect', 'authReq', 'mtu', 'pairReq', 'passkey', 'encrypt', 'keyinfo',
+            'authorize'])
+        # no sleep: the encryption took what the dongle took
+        self.assertGreaterEqual(self.dongle.durate['encrypt'], 0.1)
+        self.assertLess(self.dongle.durate['encrypt'], 1)
+
+        # the ghost got the response to its challenge
+        risposta = privacy.PRIVACY(SEGRETO).decrypt(
+            self.sim.attributi[ghost.CYBLE_SERVICE_AUTHOR_CHAR_HANDLE])
+        self.assertEqual(risposta, bytearray(self.dongle.mio) +
+                         bytes((~_) & 0xFF for _ in self.sfida[6:]))
+
+    def test_connect_to_scaduto(self):
+        self._apri(cifratura=60)
+        self.assertFalse(self.dongle.connect_to(NORM[0], 'NORM', SEGRETO, to=0.5))
+        self.assertIn('passkey', self.dongle.durate)
+        self.assertNotIn('encrypt', self.dongle.durate)
+
+    def test_connect_to_assente(self):
+        self._apri(assenti=(NORM[0],))
+        self.assertFalse(self.dongle.connect_to(NORM[0], 'NORM', SEGRETO, to_conn=0.5))
+        self.assertEqual(self.dongle.durate, {})
+
+
+class TestRubrica(unittest.TestCase):
+
+    def setUp(self):
+        cartella = tempfile.TemporaryDirectory()
+        self.addCleanup(cartella.cleanup)
+        self.nomefile = os.path.join(cartella.name, 'archivio.db')
+
+    def _apri(self, **kwargs):
+        self.sim = SIMULATORE(**kwargs)
+        self.addCleanup(self.sim.close)
+        sfida(self.sim)
+        self.dongle = ghost.GHOST(porta=self.sim.porta)
+        self.addCleanup(self.dongle.close)
+        self.archivio = cyarchivio.ARCHIVIO(self.nomefile, ms=10)
+        self.addCleanup(self.archivio.close)
+        self.dongle.set_archive(self.archivio)
+
+    def _scrivi(self, cp, bda, fase, bda_type='Random Device Address'):
+        con = cyarchivio.ARCHIVIO(self.nomefile)
+        con.aggiungi({'bda': bda, 'bda_type': bda_type, 'prod': cp, 'fase': fase})
+        con.close()
+
+    def test_start_find(self):
+        self._apri(adv=500, dispositivi=20, altri=(
+            (NORM[0], avviso(NORM[1])),
+            (CONF[0], avviso(CONF[1], ghost.srv_conf))))
+        coda = queue.Queue()
+        self.assertTrue(self.dongle.start_find(coda))
+        coda.get(True, 5)
+        coda.get(True, 5)
+        self.assertTrue(self.dongle.stop_find())
+        self.archivio.close()
+
+        for bda, cp in (NORM, CONF):
+            voce = cyarchivio.indirizzo(self.nomefile, cp)
+            self.assertEqual(voce['bda'], bda)
+            self.assertTrue(ghost.indirizzo_pubblico(voce))
+        self.assertEqual(cyarchivio.indirizzo(self.nomefile, CONF[1])['fase'], 'CONF')
+        self.assertIsNone(cyarchivio.indirizzo(self.nomefile, 'ABCDE000003'))
+
+    def test_senza_scansione(self):
+        # nobody advertises: only the address in the archive can work
+        self._scrivi(NORM[1], NORM[0], 'NORM')
+        self._apri(adv=0)
+        self.assertTrue(self.dongle.connect_to_serial(NORM[1], SEGRETO, to=2))
+        self.assertEqual(self.sim.contatori['adv'], 0)
+        self.assertEqual(self.sim.tentativi, [(NORM[0], 1)])
+
+    def test_tipo_archiviato(self):
+        # the type of the address comes from the archive too
+        self._scrivi(NORM[1], NORM[0], 'NORM', 'Public Device Address')
+        self._apri(adv=0)
+        self.assertTrue(self.dongle.connect_to_serial(NORM[1], SEGRETO, to=2))
+        self.assertEqual(self.sim.tentativi, [(NORM[0], 0)])
+
+    def test_indirizzo_vecchio(self):
+        # the ghost moved: the old address does not answer, find finds the new one
+        vecchio = 'C0:00:00:00:00:09'
+        self._scrivi(NORM[1], vecchio, 'NORM')
+        self._apri(adv=500, dispositivi=20, assenti=(vecchio,),
+                   altri=((NORM[0], avviso(NORM[1])),))
+        self.assertTrue(self.dongle.connect_to_serial(NORM[1], SEGRETO, to=2, breve=0.3))
+        self.assertGreater(self.sim.contatori['adv'], 0)
+        # the simulator advertises public addresses
+        self.assertEqual(self.sim.tentativi, [(vecchio, 1), (NORM[0], 0)])
+        self.archivio.close()
+
+        self.assertEqual(cyarchivio.indirizzo(self.nomefile, NORM[1])['bda'], NORM[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,204 @@
+"""
+RAPPORTO and AD against scan_report and scan_advertise, FILTRO
+"""
+import struct
+import unittest
+
+import scan_util
+import utili
+
+BDA = 'C0:00:00:00:00:01'
+UUID128 = '4A7A3045-BCD8-4ACA-B5AE-95FB82EEB222'
+ALTRO128 = '00001234-0000-1000-8000-00805F9B34FB'
+
+
+def ad(tipo, dati):
+    """
+    :param tipo: AD type
+    :param dati: bytes
+    :return: an AD structure
+    """
+    return bytes([len(dati) + 1, tipo]) + bytes(dati)
+
+
+def rapporto(dati, adv=0, bda=BDA, tipo_bda=0, rssi=-50):
+    """
+    what Send_advt_report gives
+    :param dati: the advertise
+    :param adv: event type
+    :param bda: string
+    :param tipo_bda: address type
+    :param rssi: dBm
+    :return: bytes
+    """
+    return struct.pack('<B6sBbB', adv, bytes(utili.mac_da_stringa(bda)), tipo_bda, rssi,
+                       len(dati)) + dati
+
+
+U128 = bytes(scan_util.ba_from_stringuuid(UUID128))
+
+COMPLETO = ad(0x01, b'\x06') + \
+    ad(0x03, b'\x0A\x18\x0F\x18') + \
+    ad(0x05, b'\x01\x02\x03\x04') + \
+    ad(0x07, U128) + \
+    ad(0x16, b'\xAA\xFE\x10\x00') + \
+    ad(0x20, b'\x01\x02\x03\x04\x99') + \
+    ad(0x21, U128 + b'\x01\x02') + \
+    ad(0xFF, b'\x59\x00\xBE\xEF') + \
+    ad(0x09, b'ghost') + \
+    ad(0x2A, b'\x01')
+
+AVVISI = {
+    'completo': COMPLETO,
+    # the last one goes beyond the end
+    'troncato': ad(0x01, b'\x06') + b'\x0A\x03\x0A\x18',
+    # nothing after a zero length
+    'zero': ad(0x01, b'\x06') + b'\x00' + ad(0x09, b'ghost'),
+    'solo zero': b'\x00',
+    'vuoto': b'',
+    # lists with a piece of uuid, a structure with the type only
+    'avanzi': ad(0x03, b'\x0A\x18\x0F') + ad(0x07, U128 + b'\x01\x02\x03\x04') + ad(0x02, b''),
+    # manufacturer data without the company
+    'corto': ad(0xFF, b'\x59'),
+}
+
+
+class TestStrutture(unittest.TestCase):
+
+    def _uguali(self, vecchio, nuovo):
+        self.assertEqual(len(vecchio), len(nuovo))
+        for tupla, struttura in zip(vecchio, nuovo):
+            nome = tupla[0]
+            if nome in ('srv16', 'srv32', 'srv128'):
+                self.assertEqual(tupla[1], struttura.servizi)
+            elif nome in ('srvd16', 'srvd32', 'srvd128', 'manuf'):
+                self.assertEqual(tupla[1], struttura.uuid)
+                self.assertEqual(bytes(tupla[2]), bytes(struttura.contenuto))
+            elif nome == 'name':
+                self.assertEqual(tupla[1], struttura.nome)
+            elif nome == 'flags':
+                self.assertEqual(bytes(tupla[1]), bytes(struttura.dati))
+            else:
+                self.assertEqual(tupla[1], struttura.tipo)
+                self.assertEqual(bytes(tupla[2]), bytes(struttura.dati))
+
+    def test_strutture(self):
+        for nome, avviso in AVVISI.items():
+            with self.subTest(nome):
+                self._uguali(scan_util.scan_advertise(avviso), scan_util.strutture(avviso))
+
+    def test_quante(self):
+        self.assertEqual(len(scan_util.strutture(COMPLETO)), 10)
+        self.assertEqual([_.tipo for _ in scan_util.strutture(AVVISI['troncato'])], [0x01])
+        self.assertEqual([_.tipo for _ in scan_util.strutture(AVVISI['zero'])], [0x01])
+        self.assertEqual(scan_util.strutture(AVVISI['solo zero']), [])
+
+    def test_servizi(self):
+        lista = scan_util.strutture(AVVISI['avanzi'])
+        self.assertEqual(lista[0].servizi, ['180A'])
+        self.assertEqual(lista[1].servizi, [UUID128])
+        self.assertEqual(lista[2].servizi, [])
+        # not a list
+        self.assertEqual(scan_util.strutture(COMPLETO)[0].servizi, [])
+
+    def test_uuid(self):
+        lista = scan_util.strutture(COMPLETO)
+        self.assertEqual([_.uuid for _ in lista],
+                         [None, None, None, None, 0xFEAA, 0x04030201, UUID128, 0x59, None, None])
+        # too short for the uuid (scan_advertise raises on these)
+        self.assertIsNone(scan_util.strutture(ad(0x16, b'\xAA'))[0].uuid)
+        self.assertIsNone(scan_util.strutture(ad(0x21, U128[:15]))[0].uuid)
+        self.assertIsNone(scan_util.strutture(AVVISI['corto'])[0].uuid)
+
+    def test_trova(self):
+        self.assertEqual([_.uuid for _ in scan_util.trova(COMPLETO, 0x21)], [UUID128])
+        self.assertEqual(scan_util.trova(AVVISI['troncato'], 0x03), [])
+
+    def test_rapporto(self):
+        for nome, avviso in AVVISI.items():
+            with self.subTest(nome):
+                grezzo = rapporto(avviso, adv=4, tipo_bda=1, rssi=-77)
+                rap = scan_util.RAPPORTO(grezzo)
+                self.assertEqual(rap.dizionario(), scan_util.scan_report(bytearray(grezzo)))
+                self.assertEqual(rap.bda, BDA)
+                self.assertEqual(rap.bda_type, rap.dizionario()['bda_type'])
+                self.assertEqual(rap.adv_type, rap.dizionario()['adv_type'])
+                self.assertEqual(rap.rssi, -77)
+                self._uguali(scan_util.scan_advertise(rap.data), rap.strutture())
+
+
+class TestFiltro(unittest.TestCase):
+
+    def _passa(self, filtro, avviso, **kwargs):
+        return filtro(rapporto(avviso, **kwargs))
+
+    def test_tutti(self):
+        filtro = scan_util.FILTRO()
+        self.assertTrue(self._passa(filtro, b''))
+        # not a report
+        self.assertFalse(filtro(b'\x00' * 9))
+        self.assertEqual((filtro.visti, filtro.passati), (2, 1))
+
+    def test_adv(self):
+        filtro = scan_util.FILTRO(adv=[0, 4])
+        self.assertTrue(self._passa(filtro, COMPLETO, adv=4))
+        self.assertFalse(self._passa(filtro, COMPLETO, adv=3))
+
+    def test_bda(self):
+        filtro = scan_util.FILTRO(bda=[BDA])
+        self.assertTrue(self._passa(filtro, COMPLETO))
+        self.assertFalse(self._passa(filtro, COMPLETO, bda='C0:00:00:00:00:02'))
+
+    def test_uuid16(self):
+        filtro = scan_util.FILTRO(uuid16=[0x180F, 0x1234])
+        # in a list or as service data
+        self.assertTrue(self._passa(filtro, ad(0x03, b'\x0A\x18\x0F\x18')))
+        self.assertTrue(self._passa(filtro, ad(0x16, b'\x0F\x18\x01')))
+        # the same bytes elsewhere
+        self.assertFalse(self._passa(filtro, ad(0xFF, b'\x0F\x18\x01')))
+        self.assertFalse(self._passa(filtro, ad(0x20, b'\x0F\x18\x00\x00')))
+        self.assertFalse(self._passa(filtro, ad(0x16, b'\x00\x00\x0F\x18')))
+        # between two uuids of the list
+        self.assertFalse(self._passa(filtro, ad(0x03, b'\x00\x0F\x18\x00')))
+        # in the address
+        self.assertFalse(self._passa(filtro, ad(0x01, b'\x06'), bda='C0:00:00:00:18:0F'))
+
+    def test_uuid128(self):
+        filtro = scan_util.FILTRO(uuid128=[UUID128])
+        self.assertTrue(self._passa(filtro, ad(0x07, bytes(16) + U128)))
+        self.assertTrue(self._passa(filtro, ad(0x21, U128 + b'\x01')))
+        self.assertFalse(self._passa(filtro, ad(0xFF, b'\x59\x00' + U128)))
+        self.assertFalse(self._passa(filtro, ad(0x07, b'\x00' + U128)))
+        self.assertFalse(self._passa(filtro, ad(0x21, bytes(scan_util.ba_from_stringuuid(ALTRO128)))))
+
+    def test_manuf(self):
+        filtro = scan_util.FILTRO(manuf=[0x0059])
+        self.assertTrue(self._passa(filtro, ad(0x01, b'\x06') + ad(0xFF, b'\x59\x00\x01')))
+        self.assertFalse(self._passa(filtro, ad(0x16, b'\x59\x00\x01')))
+        self.assertFalse(self._passa(filtro, ad(0xFF, b'\x00\x59\x00')))
+
+    def test_srvd(self):
+        filtro = scan_util.FILTRO(srvd=[b'\xAA\xFE\x10', U128 + b'\x01'])
+        self.assertTrue(self._passa(filtro, ad(0x16, b'\xAA\xFE\x10\x00')))
+        self.assertTrue(self._passa(filtro, ad(0x21, U128 + b'\x01\x02')))
+        self.assertFalse(self._passa(filtro, ad(0xFF, b'\xAA\xFE\x10\x00')))
+        self.assertFalse(self._passa(filtro, ad(0x07, U128) + ad(0x01, b'\x01')))
+        self.assertFalse(self._passa(filtro, ad(0x16, b'\xAA\xFE\x11\x00')))
+
+    def test_insieme(self):
+        filtro = scan_util.FILTRO(adv=[0], uuid16=[0xFEAA], manuf=[0x0059], uuid128=[UUID128])
+        self.assertTrue(self._passa(filtro, COMPLETO))
+        self.assertFalse(self._passa(filtro, COMPLETO, adv=4))
+        # one criterion missing
+        self.assertFalse(self._passa(filtro, COMPLETO.replace(b'\x59\x00', b'\x58\x00')))
+        self.assertEqual((filtro.visti, filtro.passati), (3, 1))
+
+    def test_troncato(self):
+        filtro = scan_util.FILTRO(uuid16=[0x180A])
+        # after a zero length or beyond the end there is nothing
+        self.assertFalse(self._passa(filtro, ad(0x01, b'\x06') + b'\x00' + ad(0x03, b'\x0A\x18')))
+        self.assertFalse(self._passa(filtro, ad(0x01, b'\x06') + b'\x05\x03\x0A\x18'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+"""
+LOGGA: the handlers do not run in the thread of who logs
+"""
+import logging
+import threading
+import time
+import unittest
+
+import utili
+
+
+class _LENTO(logging.Handler):
+    # a disk that takes its time
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.record = []
+        self.thread = set()
+
+    def emit(self, record):
+        time.sleep(0.05)
+        self.thread.add(threading.get_ident())
+        self.record.append(record.getMessage())
+
+
+class TestDiario(unittest.TestCase):
+
+    def setUp(self):
+        self.registro = logging.getLogger('test.lento')
+        self.registro.propagate = False
+        self.registro.setLevel(logging.DEBUG)
+        self.lento = _LENTO()
+        self.registro.handlers = [self.lento]
+        self.addCleanup(setattr, self.registro, 'handlers', [])
+
+    def _aspetta(self, quanti):
+        for _ in range(100):
+            if len(self.lento.record) == quanti:
+                break
+            time.sleep(0.05)
+        self.assertEqual(len(self.lento.record), quanti)
+
+    def test_lento(self):
+        diario = utili.LOGGA('test.lento')
+        inizio = time.perf_counter()
+        for indice in range(20):
+            diario.error('errore {}'.format(indice))
+        # 20 records take the handler a second
+        self.assertLess(time.perf_counter() - inizio, 0.2)
+
+        self._aspetta(20)
+        self.assertTrue(self.lento.record[0].startswith('errore 0 <'))
+        self.assertNotIn(threading.get_ident(), self.lento.thread)
+
+    def test_gestore_aggiunto_dopo(self):
+        utili.LOGGA('test.lento').info('primo')
+        self._aspetta(1)
+        secondo = _LENTO()
+        self.registro.addHandler(secondo)
+        # the next LOGGA moves it too
+        diario = utili.LOGGA('test.lento')
+        inizio = time.perf_counter()
+        diario.info('secondo')
+        self.assertLess(time.perf_counter() - inizio, 0.04)
+        self._aspetta(2)
+        for _ in range(100):
+            if secondo.record:
+                break
+            time.sleep(0.05)
+        self.assertEqual(secondo.record, ['secondo'])
+
+    def test_senza_coda(self):
+        utili.IN_CODA = False
+        self.addCleanup(setattr, utili, 'IN_CODA', True)
+        logging.getLogger('test.sincrono').handlers = [self.lento]
+        self.addCleanup(setattr, logging.getLogger('test.sincrono'), 'handlers', [])
+        logging.getLogger('test.sincrono').propagate = False
+        logging.getLogger('test.sincrono').setLevel(logging.DEBUG)
+        utili.LOGGA('test.sincrono').info('subito')
+        self.assertEqual(self.lento.record, ['subito'])
+        self.assertEqual(self.lento.thread, {threading.get_ident()})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -101,10 +101,10 @@ class EXAMPLE(CY567x.CY567x):
 
     def scan_progress_cb(self, adv):
         if self.mac is not None:
-            sr = scan_util.scan_report(adv)
-            if sr['bda'] == self.mac:
-                print(sr['bda'] + ' {} dB '.format(sr['rssi']))
-                self.sincro['scan'].put_nowait(sr)
+            rapporto = scan_util.RAPPORTO(adv)
+            if rapporto.bda == self.mac:
+                print(rapporto.bda + ' {} dB '.format(rapporto.rssi))
+                self.sincro['scan'].put_nowait(rapporto.dizionario())
                 self.mac = None
 
     def gattc_handle_value_ntf_cb(self, crt, ntf):
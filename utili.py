@@ -4,13 +4,16 @@
     Varie
 """
 
+import atexit
 import logging
+import logging.handlers
+import queue
+import sys
 import threading
 import random
 import string
 import time
 import tkinter.filedialog as dialogo
-import inspect
 import serial.tools.list_ports as lp
 
 
@@ -250,6 +253,18 @@ def baMac(mac):
     return mac
 
 
+# False: LOGGA.error/critical e Problema non cercano la posizione del chiamante
+POSIZIONE = True
+
+
+def _chiamante(salto):
+    # solo file e riga del codice: nessun accesso ai sorgenti
+    if not POSIZIONE:
+        return None
+    quadro = sys._getframe(salto + 1)
+    return quadro.f_code.co_filename + ': ' + str(quadro.f_lineno)
+
+
 class Problema(Exception):
     """
         Eccezione
@@ -261,8 +276,7 @@ class Problema(Exception):
         self.msg = msg
 
         # recupero la posizione del chiamante
-        fi = inspect.getframeinfo(inspect.currentframe().f_back)
-        self.pos = fi.filename + ': ' + str(fi.lineno)
+        self.pos = _chiamante(1)
 
     def __str__(self):
         return self.msg
@@ -400,6 +414,16 @@ def ba_da_stringa(stringa, sep='-', base=16):
     :return: il bytearray
     """
     stringa = stringa.lstrip(' ')
+
+    if base == 16 and len(sep) == 1:
+        # all the bytes with two digits
+        try:
+            ba = bytearray.fromhex(stringa.replace(sep, ' '))
+            if len(stringa) == 3 * len(ba) - 1 and stringa[2::3] == sep * (len(ba) - 1):
+                return ba
+        except ValueError:
+            pass
+
     ba = bytearray()
     x = stringa.split(sep)
     try:
@@ -419,18 +443,16 @@ def stringa_da_ba(ba, sep='-'):
     :param sep: separatore
     :return: string
     """
-    stringa = ''
-    if len(ba) == 0:
-        pass
-    elif len(ba) == 1:
-        stringa += '%02X' % ba[0]
-    else:
-        for i in range(len(ba) - 1):
-            stringa += '%02X' % ba[i]
-            stringa += sep
-        stringa += '%02X' % ba[len(ba) - 1]
+    try:
+        vista = memoryview(ba)
+    except TypeError:
+        # e.g. a list
+        vista = memoryview(bytes(ba))
 
-    return stringa
+    if len(sep) == 1:
+        return vista.hex(sep).upper()
+
+    return sep.join('%02X' % _ for _ in vista.cast('B'))
 
 
 def stringa_da_mac(cam):
@@ -443,9 +465,7 @@ def stringa_da_mac(cam):
     if len(cam) != 6:
         return '???'
 
-    mac = bytearray(_ for _ in reversed(cam))
-
-    return stringa_da_ba(mac, ':')
+    return stringa_da_ba(bytes(cam)[::-1], ':')
 
 
 def mac_da_stringa(stringa):
@@ -515,6 +535,21 @@ class CRONOMETRO():
         return self.tempo() - self.inizio
 
 
+class Esa:
+    """
+    Bytes printed in hex only when the message is logged:
+        diario.debug('rx %s', Esa(dati))
+    """
+    __slots__ = ('ba', 'sep')
+
+    def __init__(self, ba, sep=' '):
+        self.ba = ba
+        self.sep = sep
+
+    def __str__(self):
+        return stringa_da_ba(self.ba, self.sep)
+
+
 class LOGGA:
     # Lo script principale inizializza, p.e.:
     #     logging.basicConfig(
@@ -530,47 +565,128 @@ class LOGGA:
             self.logger = None
         else:
             self.logger = logging.getLogger(logger)
+            if IN_CODA:
+                # file e console non rallentano chi logga (cfr diario_in_coda)
+                diario_in_coda(logger)
+                diario_in_coda()
 
-    def abilitato(self):
-        return self.logger is not None
+    def abilitato(self, livello=None):
+        """
+        :param livello: None or a level of logging
+        :return: bool (there is a logger and it is enabled for livello)
+        """
+        if self.logger is None:
+            return False
+        if livello is None:
+            return True
+        return self.logger.isEnabledFor(livello)
 
     # in ordine di verbosita'
+    # il messaggio viene composto solo se serve:
+    #     self.diario.debug('cmd=%04X', cmd)
 
-    def debug(self, msg, ba=None):
-        if self.logger is not None:
+    def debug(self, msg, *args, ba=None):
+        if self.logger is not None and self.logger.isEnabledFor(logging.DEBUG):
             if ba is not None:
                 msg = msg + ' [{}]:'.format(len(ba)) + stringa_da_ba(ba, ' ')
-            self.logger.debug(msg)
+            self.logger.debug(msg, *args)
 
-    def info(self, msg):
+    def info(self, msg, *args):
         if self.logger is not None:
-            self.logger.info(msg)
+            self.logger.info(msg, *args)
 
-    def warning(self, msg):
+    def warning(self, msg, *args):
         if self.logger is not None:
-            self.logger.warning(msg)
+            self.logger.warning(msg, *args)
 
     def error(self, msg):
         if self.logger is not None:
             # recupero la posizione del chiamante
-            fi = inspect.getframeinfo(inspect.currentframe().f_back)
+            pos = _chiamante(1)
 
             # e la appiccico in fondo
-            msg = msg + ' <' + fi.filename + ': ' + str(fi.lineno) + '>'
+            if pos is not None:
+                msg = msg + ' <' + pos + '>'
 
             self.logger.error(msg)
 
     def critical(self, msg):
         if self.logger is not None:
             # recupero la posizione del chiamante
-            fi = inspect.getframeinfo(inspect.currentframe().f_back)
+            pos = _chiamante(1)
 
             # e la appiccico in fondo
-            msg = msg + ' <' + fi.filename + ': ' + str(fi.lineno) + '>'
+            if pos is not None:
+                msg = msg + ' <' + pos + '>'
 
             self.logger.critical(msg)
 
 
+class _IN_CODA(logging.handlers.QueueHandler):
+    # il record viene formattato dal thread del listener, non da chi logga
+    # (gli argomenti non devono cambiare dopo la chiamata)
+
+    def prepare(self, record):
+        return record
+
+
+def _ferma_coda(ascolta):
+    if ascolta._thread is not None:
+        ascolta.stop()
+
+
+# False: LOGGA lascia gli handler dove sono
+IN_CODA = True
+
+# logger -> il suo QueueListener
+_ASCOLTATORI = {}
+_MUTEX_CODA = threading.Lock()
+
+
+def diario_in_coda(logger=None):
+    """
+    Sposta gli handler del logger su un thread: chi logga (p.e. il thread
+    del dongle) mette solo il record in una coda, file e console li scrive
+    il listener
+    LOGGA lo fa da solo (cfr IN_CODA) con il suo logger e con root, dopo
+    che il logging e' stato configurato, p.e.:
+        logging.basicConfig(filename='pippo.txt', level=logging.DEBUG)
+    Si puo' richiamare: gli handler aggiunti dopo seguono i primi
+    :param logger: name of the logger (None: root)
+    :return: logging.handlers.QueueListener or None (no handlers)
+    """
+    registro = logging.getLogger(logger)
+    with _MUTEX_CODA:
+        ascolta = _ASCOLTATORI.get(registro)
+        gestori = [_ for _ in registro.handlers if not isinstance(_, _IN_CODA)]
+        if not gestori:
+            return ascolta
+        for gestore in gestori:
+            registro.removeHandler(gestore)
+
+        if ascolta is not None and ascolta._thread is not None:
+            if any(isinstance(_, _IN_CODA) for _ in registro.handlers):
+                ascolta.handlers = ascolta.handlers + tuple(gestori)
+            else:
+                # qualcuno ha rimpiazzato gli handler: valgono solo i nuovi
+                ascolta.handlers = tuple(gestori)
+                registro.addHandler(_IN_CODA(ascolta.queue))
+            return ascolta
+
+        # nessuno o fermato da qualcuno
+        for gestore in [_ for _ in registro.handlers if isinstance(_, _IN_CODA)]:
+            registro.removeHandler(gestore)
+        coda = queue.SimpleQueue()
+        registro.addHandler(_IN_CODA(coda))
+
+        ascolta = logging.handlers.QueueListener(coda, *gestori, respect_handler_level=True)
+        ascolta.start()
+        _ASCOLTATORI[registro] = ascolta
+    # all'uscita svuota la coda (se nessuno l'ha gia' fermato)
+    atexit.register(_ferma_coda, ascolta)
+    return ascolta
+
+
 # p.e.: nomefile = utili.scegli_file_esistente(self.master, [('expander',
 # '.cyacd')])
 def scegli_file_esistente(master, filetypes):